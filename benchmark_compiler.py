@@ -0,0 +1,93 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Times every stage of the compiler pipeline (see jhvm/timings.py) over the
+# sample programs and over generated programs of growing size. Each corpus is
+# compiled in a fresh process, so that the memory figures of one don't hide
+# those of the next.
+import argparse
+import glob
+import multiprocessing
+import os
+
+from tabulate import tabulate
+from compiler import compile_source
+from jhvm.parser import get_parser
+from jhvm.synthetic import ProgramSpec, generate_program
+from jhvm.timings import Timings
+
+PROJECT_ROOT = os.path.dirname(os.path.realpath(__file__))
+SAMPLE_GLOBS = ['exs/*.jh', 'benchmarks/*.jh']
+
+def sample_corpus():
+    sources = []
+    for pattern in SAMPLE_GLOBS:
+        for filename in sorted(glob.glob(os.path.join(PROJECT_ROOT, pattern))):
+            with open(filename) as f:
+                sources.append(f.read())
+    return 'samples', sources
+
+def generated_corpus(functions, seed):
+    program = generate_program(ProgramSpec(functions = functions, seed = seed))
+    return 'generated/%d' % functions, [program.source]
+
+def time_corpus(job):
+    # Runs in a worker process. Returns the stage timings of the fastest of
+    # repeat compilations of every source in the corpus.
+    name, sources, repeat = job
+    get_parser()
+    best = None
+    for _ in range(repeat):
+        timings = Timings()
+        for source in sources:
+            compile_source(source, {}, None, timings)
+        if best is None or timings.total() < best.total():
+            best = timings
+    size = sum([len(source) for source in sources])
+    return name, size, [(stage.name, stage.seconds, stage.rss_growth)
+                        for stage in best.stages]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--functions', default = '64,256,1024',
+                        help = 'function counts of the generated programs '
+                               '(default: 64,256,1024)')
+    parser.add_argument('-s', '--seed', type = int, default = 0)
+    parser.add_argument('-r', '--repeat', type = int, default = 3,
+                        help = 'compilations per corpus, the fastest is '
+                               'reported (default: 3)')
+    args = parser.parse_args()
+
+    corpora = [sample_corpus()]
+    for count in [int(n) for n in args.functions.split(',')]:
+        corpora.append(generated_corpus(count, args.seed))
+
+    time_table = []
+    memory_table = []
+    stage_names = []
+    for corpus_name, sources in corpora:
+        pool = multiprocessing.Pool(1)
+        try:
+            name, size, stages = pool.apply(time_corpus,
+                                            [(corpus_name, sources, args.repeat)])
+        finally:
+            pool.close()
+            pool.join()
+        if not stage_names:
+            stage_names = [stage for stage, _, _ in stages]
+        total = sum([seconds for _, seconds, _ in stages])
+        time_table.append([name, '%.1f' % (size / 1024.0)] +
+                          ['%.4fs' % seconds for _, seconds, _ in stages] +
+                          ['%.4fs' % total, '%.0f' % (size / 1024.0 / total)])
+        memory_table.append([name] + ['%.1fMB' % (growth / 1048576.0)
+                                      for _, _, growth in stages])
+
+    print 'Wall time per stage'
+    print tabulate(time_table, ['corpus', 'KB'] + stage_names +
+                   ['total', 'KB/s'])
+    print
+    print 'Peak RSS growth per stage'
+    print tabulate(memory_table, ['corpus'] + stage_names)
+
+if __name__ == '__main__':
+    main()
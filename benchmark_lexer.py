@@ -0,0 +1,76 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Measures lexer throughput on large generated sources, comparing jhvm's
+# scanner with the rply regex lexer it replaced.
+import argparse
+import time
+
+from tabulate import tabulate
+from jhvm.lexer import lex, rply_lex
+
+FUNCTION_TEMPLATE = """
+fn func_%(n)d(alpha_%(n)d, beta) {
+    counter = object();
+    counter.total_%(n)d = 0;
+    for(index = 0; index < %(n)d; index = index + 1) {
+        if(index == beta) {
+            counter.total_%(n)d = counter.total_%(n)d + (alpha_%(n)d - 1)
+        }
+        else {
+            counter.total_%(n)d = counter.total_%(n)d + func_helper(index, 42)
+        }
+    };
+    return counter.total_%(n)d
+}
+"""
+
+def generate_source(size):
+    # Returns a syntactically valid jh source of at least size bytes.
+    parts = []
+    length = 0
+    n = 0
+    while length < size:
+        part = FUNCTION_TEMPLATE % {'n' : n}
+        parts.append(part)
+        length += len(part)
+        n += 1
+    return ''.join(parts)
+
+def time_lexer(lexer, source, repeat):
+    best = None
+    tokens = 0
+    for _ in range(repeat):
+        start = time.time()
+        tokens = 0
+        for _token in lexer(source):
+            tokens += 1
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, tokens
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--size', type = float, default = 4,
+                        help = 'source size in MB (default: 4)')
+    parser.add_argument('-r', '--repeat', type = int, default = 3,
+                        help = 'runs per lexer, the best is reported (default: 3)')
+    args = parser.parse_args()
+
+    source = generate_source(int(args.size * 1024 * 1024))
+    megabytes = len(source) / (1024.0 * 1024.0)
+
+    table = []
+    results = {}
+    for name, lexer in [('jhvm', lex), ('rply', rply_lex)]:
+        elapsed, tokens = time_lexer(lexer, source, args.repeat)
+        results[name] = elapsed
+        table.append([name, '%.3fs' % elapsed, '%.2f' % (megabytes / elapsed),
+                      '%.0f' % (tokens / elapsed)])
+
+    print 'Lexing %.2fMB (%d lines)' % (megabytes, source.count('\n'))
+    print tabulate(table, ['lexer', 'time', 'MB/s', 'tokens/s'])
+    print 'speedup: %.1fx' % (results['rply'] / results['jhvm'])
+
+if __name__ == '__main__':
+    main()
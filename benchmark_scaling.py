@@ -0,0 +1,107 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Measures how the lexer, parser, code generator and VM scale with program
+# size, on synthetic programs of a growing number of functions (see
+# jhvm/synthetic.py). Throughput should stay flat as programs grow; a stage
+# whose throughput falls with size is superlinear.
+import argparse
+import time
+
+from tabulate import tabulate
+from jhvm.lexer import lex
+from jhvm.parser import get_parser
+from jhvm.genast import generate_bytecode
+from jhvm.closurevm import ClosureMachine
+from jhvm.vm import VirtualMachine
+from jhvm.synthetic import ProgramSpec, generate_program
+
+STAGES = ['lex', 'parse', 'codegen', 'run']
+
+CHART_WIDTH = 50
+
+def best_time(repeat, function):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def measure(program, vm_class, repeat):
+    # Returns the seconds taken by every stage, checking the result.
+    times = {}
+    source = program.source
+    times['lex'], tokens = best_time(repeat, lambda: list(lex(source)))
+    parser = get_parser()
+    times['parse'], ast = best_time(repeat,
+                                    lambda: parser.parse(iter(tokens)))
+    times['codegen'], (bytecode, functions) = best_time(
+        repeat, lambda: generate_bytecode(ast))
+    times['run'], res = best_time(
+        repeat, lambda: vm_class(bytecode, functions).interp(bytecode))
+    if res.int_val != program.expected:
+        raise AssertionError('%r returned %d, expected %d' %
+                             (program.spec, res.int_val, program.expected))
+    return times
+
+def chart(title, sizes, values):
+    # A horizontal bar per size, scaled to the largest value.
+    top = max(values) or 1
+    lines = [title]
+    for size, value in zip(sizes, values):
+        bar = '#' * int(round(CHART_WIDTH * value / top))
+        lines.append('%8d | %-*s %.0f' % (size, CHART_WIDTH, bar, value))
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--functions', default = '16,32,64,128,256',
+                        help = 'function counts to generate programs with '
+                               '(default: 16,32,64,128,256)')
+    parser.add_argument('--loop-depth', type = int, default = 2)
+    parser.add_argument('--expr-depth', type = int, default = 3)
+    parser.add_argument('--shapes', type = int, default = 4)
+    parser.add_argument('--call-depth', type = int, default = 3)
+    parser.add_argument('--iterations', type = int, default = 5,
+                        help = 'largest loop bound (default: 5)')
+    parser.add_argument('-s', '--seed', type = int, default = 0)
+    parser.add_argument('-r', '--repeat', type = int, default = 3,
+                        help = 'runs per stage, the best is reported '
+                               '(default: 3)')
+    parser.add_argument('--interp', action = 'store_true',
+                        help = 'run on the interpreter loop rather than the '
+                               'closure compiler (much slower untranslated)')
+    args = parser.parse_args()
+
+    vm_class = VirtualMachine if args.interp else ClosureMachine
+    sizes = []
+    throughput = dict([(stage, []) for stage in STAGES])
+    table = []
+    for count in [int(n) for n in args.functions.split(',')]:
+        spec = ProgramSpec(count, args.loop_depth, args.expr_depth,
+                           args.shapes, args.call_depth, args.iterations,
+                           args.seed)
+        program = generate_program(spec)
+        times = measure(program, vm_class, args.repeat)
+        kilobytes = len(program.source) / 1024.0
+        sizes.append(len(program.source))
+        row = [count, '%.1f' % kilobytes]
+        for stage in STAGES:
+            throughput[stage].append(kilobytes / times[stage])
+            row.append('%.4fs' % times[stage])
+        table.append(row)
+
+    print tabulate(table, ['functions', 'KB'] + STAGES)
+    for stage in STAGES:
+        print
+        print chart('%s throughput (KB of source/s) by source size (bytes)' %
+                    stage, sizes, throughput[stage])
+        first, last = throughput[stage][0], throughput[stage][-1]
+        if last < first / 2:
+            print 'throughput of %s fell %.1fx: superlinear' % (stage,
+                                                                 first / last)
+
+if __name__ == '__main__':
+    main()
@@ -1,38 +1,265 @@
 # vim: ai ts=4 sts=4 et sw=4
 # -*- coding: utf-8 -*-
+import argparse
+import glob
+import multiprocessing
+import os
 import sys
-from jhvm.parser import parse_input
-from jhvm.genast import generate_bytecode
-from jhvm.opcodes import EOB
+import time
+from jhvm.parser import parse_input, get_parser
+from jhvm.genast import generate_bytecode, IncrementalCompiler
+from jhvm.bcfile import dumps, loads
+from jhvm.cache import BytecodeCache, FunctionCache
+from jhvm.linker import compile_module, link_modules, ObjectModule
+from jhvm.server import run_on_server, ServerError
+from jhvm.timings import Timings, NO_TIMINGS
 
 def usage():
-    print >> sys.stderr, 'Usage: compiler.py filename.jh'
+    print >> sys.stderr, 'Usage: compiler.py [-c | -o outname] [--run [--fast-py | --server PATH]] [--timings] [--no-cache] [--cache-dir DIR] filename.jh [module.jh|module.jho ...]'
+    print >> sys.stderr, '       compiler.py --batch [-j jobs] [--no-cache] [--cache-dir DIR] dir|glob|filename.jh ...'
     sys.exit(1)
 
-def main():
-    if len(sys.argv) != 2:
+def parse_args(argv):
+    parser = argparse.ArgumentParser(add_help = False)
+    parser.add_argument('filenames', nargs = '+')
+    parser.add_argument('-c', dest = 'compile_only', action = 'store_true')
+    parser.add_argument('-o', dest = 'output')
+    parser.add_argument('--run', action = 'store_true')
+    parser.add_argument('--fast-py', action = 'store_true')
+    parser.add_argument('--server')
+    parser.add_argument('--timings', action = 'store_true')
+    parser.add_argument('--no-cache', action = 'store_true')
+    parser.add_argument('--cache-dir')
+    parser.add_argument('--batch', action = 'store_true')
+    parser.add_argument('-j', '--jobs', type = int)
+    parser.error = lambda message: usage()
+    args = parser.parse_args(argv)
+    if args.batch:
+        if args.compile_only or args.output or args.run or args.timings:
+            usage()
+        return args
+    for filename in args.filenames:
+        if not filename.endswith('.jh') and not filename.endswith('.jho'):
+            usage()
+    if args.compile_only and (args.run or args.output):
         usage()
-
-    filename = sys.argv[1]
-    if not filename.endswith('.jh'):
+    if args.server and (not args.run or args.fast_py):
         usage()
+    return args
+
+def codegen_options(args):
+    # Options that change the bytecode produced, and so are part of the
+    # cache key. There are none yet.
+    return {}
+
+def module_name(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+def compile_source(source_code, options, cache = None, timings = NO_TIMINGS):
+    ast = parse_input(source_code, timings)
+    if cache is None:
+        bytecode, functions = generate_bytecode(ast, timings)
+    else:
+        bytecode, functions = incremental_compiler(cache, options).compile_program(ast)
+    with timings.stage('serialize'):
+        return dumps(bytecode, functions)
+
+def compile_object_source(source_code, name, options, cache = None,
+                          timings = NO_TIMINGS):
+    ast = parse_input(source_code, timings)
+    compiler = None if cache is None else incremental_compiler(cache, options)
+    module = compile_module(ast, name, compiler, timings)
+    with timings.stage('serialize'):
+        return module.dumps()
+
+def incremental_compiler(cache, options):
+    # Only functions that changed since they were last compiled are
+    # generated again.
+    return IncrementalCompiler(FunctionCache(cache.cache_dir, options))
+
+def cached_compile(source_code, cache, options, build):
+    # Returns build(source_code), or its cached result, and whether it came
+    # from the cache.
+    if cache is None:
+        return build(source_code), False
 
+    key = cache.key_for(source_code, options)
+    data = cache.get(key)
+    if data is not None:
+        return data, True
+    data = build(source_code)
+    cache.put(key, data)
+    return data, False
+
+def compile_file(filename, cache, options, timings = NO_TIMINGS):
+    with open(filename) as f:
+        source_code = f.read()
+    return cached_compile(source_code, cache, options,
+        lambda source: compile_source(source, options, cache, timings))
+
+def compile_object_file(filename, cache, options, timings = NO_TIMINGS):
     with open(filename) as f:
         source_code = f.read()
+    name = module_name(filename)
+    key_options = dict(options, object_module = name)
+    return cached_compile(source_code, cache, key_options,
+        lambda source: compile_object_source(source, name, options, cache,
+                                             timings))
+
+def load_module(filename, cache, options, timings = NO_TIMINGS):
+    if filename.endswith('.jho'):
+        with open(filename, 'rb') as f:
+            data = f.read()
+    else:
+        data = compile_object_file(filename, cache, options, timings)[0]
+    with timings.stage('deserialize'):
+        return ObjectModule.loads(data)
+
+def run(data, fast_py):
+    bytecode, functions = loads(data)
+    if fast_py:
+        from jhvm.closurevm import ClosureMachine as Machine
+    else:
+        from jhvm.vm import VirtualMachine as Machine
+    machine = Machine(bytecode, functions)
+    return machine.interp(bytecode)
+
+def expand_inputs(patterns):
+    # Directories are searched recursively for .jh files; anything else is
+    # treated as a glob.
+    filenames = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for dirpath, dirnames, names in os.walk(pattern):
+                filenames.update(os.path.join(dirpath, name)
+                                 for name in names if name.endswith('.jh'))
+        else:
+            filenames.update(name for name in glob.glob(pattern)
+                             if name.endswith('.jh'))
+    return sorted(filenames)
+
+def init_batch_worker():
+    # Built once per worker process rather than once per file.
+    get_parser()
 
-    ast = parse_input(source_code)
-    bytecode, var_count = generate_bytecode(ast)
+def file_size(filename):
+    # 0 for a file that is missing or can't be read, which also fails to
+    # compile.
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
 
-    outname = filename[:-len('.jh')]
+def compile_batch_file(job):
+    # Runs in a worker process. Failures are returned, not raised, so one bad
+    # file doesn't stop the batch.
+    filename, cache_dir, use_cache, options = job
+    cache = BytecodeCache(cache_dir) if use_cache else None
+    try:
+        data, cached = compile_file(filename, cache, options)
+        with open(filename[:-len('.jh')], 'wb') as f:
+            f.write(data)
+    except Exception as e:
+        return filename, file_size(filename), False, '%s: %s' % (e.__class__.__name__, e)
+    return filename, file_size(filename), cached, None
+
+def batch_compile(args, options):
+    filenames = expand_inputs(args.filenames)
+    if not filenames:
+        print >> sys.stderr, 'No .jh files found.'
+        return 1
+
+    cache_dir = BytecodeCache(args.cache_dir).cache_dir
+    jobs = [(filename, cache_dir, not args.no_cache, options) for filename in filenames]
+    processes = args.jobs or multiprocessing.cpu_count()
+
+    start = time.time()
+    pool = multiprocessing.Pool(processes, init_batch_worker)
+    failed = 0
+    cached_count = 0
+    total_bytes = 0
+    try:
+        for filename, size, cached, error in pool.imap_unordered(compile_batch_file, jobs):
+            total_bytes += size
+            if error is not None:
+                failed += 1
+                print >> sys.stderr, 'FAILED %s: %s' % (filename, error)
+            elif cached:
+                cached_count += 1
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = max(time.time() - start, 1e-6)
+
+    print 'Compiled %d files (%d cached, %d failed) in %.2fs with %d processes: %.1f files/s, %.1f KB/s' % (
+        len(filenames) - failed, cached_count, failed, elapsed, processes,
+        len(filenames) / elapsed, total_bytes / 1024.0 / elapsed)
+    return 1 if failed else 0
+
+def report(outname, cached):
+    if cached:
+        print '%s successfully compiled (cached).' % outname
+    else:
+        print '%s successfully compiled.' % outname
+
+def print_timings(timings):
+    if timings is not NO_TIMINGS:
+        print >> sys.stderr, timings.report()
+
+def main():
+    args = parse_args(sys.argv[1:])
+    # Timed compilations skip the cache, so that every stage runs.
+    cache = None if args.no_cache or args.timings else BytecodeCache(args.cache_dir)
+    options = codegen_options(args)
+    timings = Timings() if args.timings else NO_TIMINGS
+
+    if args.batch:
+        sys.exit(batch_compile(args, options))
+
+    if args.compile_only:
+        # Compile each file to a relocatable .jho object module.
+        for filename in args.filenames:
+            if not filename.endswith('.jh'):
+                usage()
+            data, cached = compile_object_file(filename, cache, options,
+                                               timings)
+            outname = filename[:-len('.jh')] + '.jho'
+            with open(outname, 'wb') as f:
+                f.write(data)
+            report(outname, cached)
+        print_timings(timings)
+        return
+
+    filenames = args.filenames
+    if len(filenames) == 1 and filenames[0].endswith('.jh'):
+        data, cached = compile_file(filenames[0], cache, options, timings)
+    else:
+        modules = [load_module(filename, cache, options, timings)
+                   for filename in filenames]
+        with timings.stage('link'):
+            bytecode, functions = link_modules(modules)
+        with timings.stage('serialize'):
+            data = dumps(bytecode, functions)
+        cached = False
+    print_timings(timings)
+
+    if args.run and args.server:
+        # Run on a VM started with `target-vm --serve PATH`.
+        try:
+            print run_on_server(args.server, data)
+        except (ServerError, IOError) as e:
+            print >> sys.stderr, 'Error running on %s: %s' % (args.server, e)
+            sys.exit(1)
+        return
+
+    if args.run:
+        print run(data, args.fast_py).repr()
+        return
+
+    outname = args.output or os.path.splitext(filenames[0])[0]
     with open(outname, 'wb') as f:
-        for op in bytecode:
-            f.write('%s\n' % op)
-        f.write('%s\n' % EOB)
-        for k, v in var_count.items():
-            f.write('%s,%s\n' % (k, v))
-    print '%s successfully compiled.' % outname
+        f.write(data)
+    report(outname, cached)
 
 if __name__ == '__main__':
     main()
-
-
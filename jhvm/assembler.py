@@ -0,0 +1,149 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Two-pass assembler for the code of a single function.
+#
+# GeneratorContext emits a list of items: opcode and operand strings, Label
+# operands for jump targets, FunctionRef operands for callees and LabelDef
+# markers where a label is placed. Its VarRef operands are replaced by slots
+# before the code gets here. The first pass records the pc of every
+# LabelDef, the second emits the final code with Label operands replaced by
+# those pcs. Only operands that are typed as labels are ever rewritten, and
+# both passes are linear in the length of the code.
+#
+# stack_depth() finds how deep the code's stack gets, which sizes the stacks
+# of the function's frames.
+from __future__ import absolute_import
+
+from jhvm.opcodes import *
+
+class Label(object):
+    # A jump target. Labels are compared by identity, the name is only there
+    # to make listings readable.
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return 'Label(%s)' % self.name
+
+class LabelDef(object):
+    # Marks the position of label in the code. Takes up no space.
+
+    def __init__(self, label):
+        self.label = label
+
+    def __repr__(self):
+        return '%s:' % self.label.name
+
+class FunctionRef(object):
+    # The callee of a CALL, resolved by the linker, which also checks that
+    # the callee takes arg_count arguments.
+
+    def __init__(self, name, arg_count = 0):
+        self.name = name
+        self.arg_count = arg_count
+
+    def __repr__(self):
+        return 'FunctionRef(%s/%s)' % (self.name, self.arg_count)
+
+class VarRef(object):
+    # A local variable operand of VAR, or of the CONST_INT before an ASSIGN.
+    # GeneratorContext replaces it with the variable's slot (see
+    # jhvm/liveness.py) before assembling.
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return 'VarRef(%s)' % self.name
+
+class AssemblerError(Exception):
+    pass
+
+def resolve_labels(items):
+    # First pass: label -> pc.
+    labels = {}
+    pc = 0
+    for item in items:
+        if isinstance(item, LabelDef):
+            if item.label in labels:
+                raise AssemblerError('%s placed twice' % item.label.name)
+            labels[item.label] = pc
+        else:
+            pc += 1
+    return labels
+
+def assemble(items):
+    # Returns the code with labels resolved to function-relative pcs, plus
+    # the indexes of the jump and call operands the linker has to fix up.
+    labels = resolve_labels(items)
+    code = []
+    jump_operands = []
+    call_operands = []
+    for item in items:
+        if isinstance(item, LabelDef):
+            continue
+        elif isinstance(item, Label):
+            try:
+                target = labels[item]
+            except KeyError:
+                raise AssemblerError('%s is never placed' % item.name)
+            jump_operands.append(len(code))
+            code.append(str(target))
+        elif isinstance(item, FunctionRef):
+            call_operands.append(len(code))
+            code.append(item.name)
+        else:
+            code.append(item)
+    return code, jump_operands, call_operands
+
+# How many values each opcode leaves on the stack less than it takes. CALL
+# and NEW_WITH_SHAPE take as many as their operands say.
+STACK_EFFECTS = {
+    CONST_INT : 1, CONST_STR : 1, VAR : 1, NEW : 1, DUP : 1,
+    POP : -1, RET : -1, ADD : -1, SUB : -1, EQ : -1, NEQ : -1, LT : -1,
+    ADD_INT : -1, SUB_INT : -1, EQ_INT : -1, LT_INT : -1, ARRAY_GET : -1,
+    JUMP_IF_TRUE : -1, JUMP_IF_FALSE : -1, LOOP_IF_TRUE : -1,
+    LT_INT_JUMP_IF_FALSE : -2, LT_INT_LOOP_IF_TRUE : -2,
+    ASSIGN : -2, SET_FIELD : -2, ARRAY_SET : -3,
+    GET_FIELD : 0, NEW_ARRAY : 0, SWAP : 0, JUMP : 0, EXIT : 0, SNAPSHOT : 0,
+}
+
+def stack_effect(opcode, operand):
+    if opcode == CALL:
+        return 1 - operand.arg_count
+    elif opcode == NEW_WITH_SHAPE:
+        return 1 - len(operand.split(','))
+    try:
+        return STACK_EFFECTS[opcode]
+    except KeyError:
+        raise AssemblerError('no stack effect for opcode %s' % opcode)
+
+def stack_depth(items):
+    # The most values the code, as given to assemble(), ever has on its
+    # stack. Statements leave the stack as they found it, so the depth at a
+    # label is the same whichever way it is reached, and the code can be
+    # walked once in order, a label taking the depth of the first jump to it
+    # or of the code falling through to it. Nothing falls through a JUMP,
+    # RET or EXIT; a label only reached that way is dead code.
+    label_depths = {}
+    depth = max_depth = 0
+    i = 0
+    while i < len(items):
+        item = items[i]
+        if isinstance(item, LabelDef):
+            depth = label_depths.setdefault(item.label, depth)
+            i += 1
+            continue
+        operand = None
+        if HAS_ARGS[int(item)]:
+            operand = items[i + 1]
+        i += int(HAS_ARGS[int(item)]) + 1
+        depth += stack_effect(item, operand)
+        max_depth = max(max_depth, depth)
+        if isinstance(operand, Label):
+            label_depths.setdefault(operand, depth)
+        if item in (JUMP, RET, EXIT):
+            depth = 0
+    return max_depth
@@ -2,17 +2,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 from jhvm.opcodes import *
+from jhvm.bcfile import quote_str
 
 from rply.token import BaseBox
 
-COUNT = 0
-
-def next_label():
-    global COUNT
-    nxt = COUNT
-    COUNT += 1
-    return nxt
-
 class Node(BaseBox):
 
     def __repr__(self):
@@ -43,7 +36,6 @@ class Function(Node):
     def _compile(self, gen):
         arg_names = [arg.name for arg in self.arg_listbox.items]
         gen.register_function(self.name, arg_names)
-        gen.emit_label(self.name + ':')
         self.body.compile(gen)
 
 class ListBox(Node):
@@ -75,17 +67,12 @@ class If(Statement):
         self.cond = cond
         self.then_body = then_body
 
-        label_no = next_label()
-        self._then = 'then_%s' % label_no
-        self._exit = 'exit_%s' % label_no
-        self._then_def = self._then + ':'
-        self._exit_def = self._exit + ':'
-
     def _compile(self, gen):
-        self.cond.compile(gen)
-        gen.emit_bc_arg_str(JUMP_IF_FALSE, self._exit)
+        _exit = gen.new_label('exit')
+
+        compile_branch(gen, self.cond, JUMP_IF_FALSE, _exit)
         self.then_body.compile(gen)
-        gen.emit_label(self._exit_def)
+        gen.emit_label(_exit)
 
 class IfElse(Statement):
     def __init__(self, cond, then_body, else_body):
@@ -93,28 +80,76 @@ class IfElse(Statement):
         self.then_body = then_body
         self.else_body = else_body
 
-        label_no = next_label()
-        self._then = 'then_%s' % label_no
-        self._else = 'else_%s' % label_no
-        self._exit = 'exit_%s' % label_no
-        self._then_def = self._then + ':'
-        self._else_def = self._else + ':'
-        self._exit_def = self._exit + ':'
-
     def _compile(self, gen):
-        self.cond.compile(gen)
-        gen.emit_bc_arg_str(JUMP_IF_FALSE, self._else)
+        _else = gen.new_label('else')
+        _exit = gen.new_label('exit')
+
+        compile_branch(gen, self.cond, JUMP_IF_FALSE, _else)
         self.then_body.compile(gen)
-        gen.emit_bc_arg_str(JUMP, self._exit)
-        gen.emit_label(self._else_def)
+        gen.emit_jump(JUMP, _exit)
+        gen.emit_label(_else)
         self.else_body.compile(gen)
-        gen.emit_label(self._exit_def)
+        gen.emit_label(_exit)
 
 class While(Statement):
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
 
+    def _compile(self, gen):
+        compile_loop(gen, self.condition, [self.body])
+
+class HoistedLoop(Statement):
+    # A loop with its invariant code hoisted out (see jhvm/licm.py). Its
+    # original condition, entry_cond, is tested once on entry; once it has
+    # passed, preheader computes the hoisted values, and cond, which reads
+    # them, is tested after every iteration of the nodes in body.
+    def __init__(self, entry_cond, preheader, cond, body):
+        self.entry_cond = entry_cond
+        self.preheader = preheader
+        self.cond = cond
+        self.body = body
+
+    def _compile(self, gen):
+        compile_loop(gen, self.cond, self.body, self.entry_cond,
+                     self.preheader)
+
+def compile_loop(gen, cond, body, entry_cond = None, preheader = None):
+    # Loops are inverted: the condition is tested once before entering the
+    # loop and then again at the bottom of every iteration, so an iteration
+    # costs a single conditional branch back to the loop header.
+    _header = gen.new_label('loop')
+    _exit = gen.new_label('exit')
+
+    if entry_cond is None:
+        entry_cond = cond
+    compile_branch(gen, entry_cond, JUMP_IF_FALSE, _exit)
+    if preheader is not None:
+        preheader.compile(gen)
+    gen.emit_label(_header)
+    for node in body:
+        compile_discarding(gen, node)
+    compile_branch(gen, cond, LOOP_IF_TRUE, _header)
+    gen.emit_label(_exit)
+
+# Branches on the result of an int LT, and the opcode doing both at once.
+FUSED_INT_BRANCHES = {
+    JUMP_IF_FALSE : LT_INT_JUMP_IF_FALSE,
+    LOOP_IF_TRUE : LT_INT_LOOP_IF_TRUE,
+}
+
+def compile_branch(gen, cond, opcode, label):
+    # Compiles cond followed by a branch on its value. A LT on two ints is
+    # fused with the branch.
+    if (isinstance(cond, BinExp) and cond.op.op_code == LT and
+            gen.int_operands(cond)):
+        cond.lhs.compile(gen)
+        cond.rhs.compile(gen)
+        gen.emit_jump(FUSED_INT_BRANCHES[opcode], label)
+    else:
+        cond.compile(gen)
+        gen.emit_jump(opcode, label)
+
 class Return(Statement):
     def __init__(self, exp):
         self.exp = exp
@@ -123,14 +158,30 @@ class Return(Statement):
         self.exp.compile(gen)
         gen.emit_bc(RET)
 
+class Snapshot(Statement):
+    def _compile(self, gen):
+        gen.emit_bc(SNAPSHOT)
+
 class Block(ListBox):
-    pass
+    def _compile(self, gen):
+        for item in self.items:
+            compile_discarding(gen, item)
+
+def compile_discarding(gen, node):
+    # Compiles a statement, or an expression whose value goes unused and is
+    # popped, so that the stack is as deep after it as before and a
+    # function's stack depth can be known when it is assembled.
+    node.compile(gen)
+    if isinstance(node, Exp) and node.leaves_value:
+        gen.emit_bc(POP)
 
 
 
 
 class Exp(Node):
-    pass
+    # Whether the expression leaves a value on the stack. Assignments leave
+    # none.
+    leaves_value = True
 
 class Call(Exp):
     def __init__(self, name, args):
@@ -139,8 +190,7 @@ class Call(Exp):
 
     def _compile(self, gen):
         self.args._compile_reversed(gen)
-        gen.emit_bc_arg_int(CONST_INT, self.args.get_length())
-        gen.emit_bc_arg_str(CALL, self.name)
+        gen.emit_call(self.name, self.args.get_length())
 
 class BinOp(Node):
     def __init__(self, op_name):
@@ -158,7 +208,10 @@ class BinExp(Exp):
     def _compile(self, gen):
         self.lhs.compile(gen)
         self.rhs.compile(gen)
-        self.op.compile(gen)
+        if gen.int_operands(self):
+            gen.emit_bc(INT_OPCODES[self.op.op_code])
+        else:
+            self.op.compile(gen)
 
 class For(Node):
     def __init__(self, start, cond, step, body):
@@ -167,36 +220,26 @@ class For(Node):
         self.step = step
         self.body = body
 
-        label_no = next_label()
-        self._entry = 'entry_%s' % label_no
-        self._exit = 'exit_%s' % label_no
-        self._entry_def = self._entry + ':'
-        self._exit_def = self._exit + ':'
-
     def _compile(self, gen):
-        self.start.compile(gen)
-        gen.emit_label(self._entry_def)
-        self.cond.compile(gen)
-        gen.emit_bc_arg_str(JUMP_IF_FALSE, self._exit)
-        self.body.compile(gen)
-        self.step.compile(gen)
-        gen.emit_bc_arg_str(JUMP, self._entry)
-        gen.emit_label(self._exit_def)
+        compile_discarding(gen, self.start)
+        compile_loop(gen, self.cond, [self.body, self.step])
 
 class Var(Node):
     def __init__(self, name):
         self.name = name
 
     def _compile(self, gen):
-        gen.emit_bc_arg_int(VAR, gen.register_num_for_var(self.name))
+        gen.emit_var(VAR, self.name)
 
 class Assign(Exp):
+    leaves_value = False
+
     def __init__(self, name, exp):
         self.name = name
         self.exp = exp
 
     def _compile(self, gen):
-        gen.emit_bc_arg_int(CONST_INT, gen.register_num_for_var(self.name))
+        gen.emit_var(CONST_INT, self.name)
         self.exp.compile(gen)
         gen.emit_bc(ASSIGN)
 
@@ -207,6 +250,13 @@ class Number(Exp):
     def _compile(self, gen):
         gen.emit_bc_arg_int(CONST_INT, self.value)
 
+class String(Exp):
+    def __init__(self, value):
+        self.value = value
+
+    def _compile(self, gen):
+        gen.emit_bc_arg_str(CONST_STR, quote_str(self.value))
+
 class FieldAccessor(Exp):
     def __init__(self, obj_var, field):
         self.obj_var = obj_var
@@ -217,6 +267,8 @@ class FieldAccessor(Exp):
         gen.emit_bc_arg_str(GET_FIELD, self.field)
 
 class FieldSetter(Exp):
+    leaves_value = False
+
     def __init__(self, obj_var, field, exp):
         self.obj_var = obj_var
         self.field = field
@@ -233,5 +285,60 @@ class Obj(Exp):
         self.values = values
 
     def _compile(self, gen):
-        gen.emit_bc(NEW)
+        if not self.fields:
+            gen.emit_bc(NEW)
+            return
+        for i, field in enumerate(self.fields):
+            if field in self.fields[:i]:
+                raise ValueError('Field %s is given twice' % field)
+
+        for value in self.values:
+            value.compile(gen)
+        gen.emit_bc_arg_str(NEW_WITH_SHAPE, ','.join(self.fields))
+
+class ArrayLiteral(Exp):
+    def __init__(self, items):
+        self.items = items
+
+    def _compile(self, gen):
+        # Filled in one element at a time, so that long literals don't need
+        # a deep stack.
+        gen.emit_bc_arg_int(CONST_INT, self.items.get_length())
+        gen.emit_bc(NEW_ARRAY)
+        for i, item in enumerate(self.items.items):
+            gen.emit_bc(DUP)
+            gen.emit_bc_arg_int(CONST_INT, i)
+            item.compile(gen)
+            gen.emit_bc(ARRAY_SET)
+
+class NewArray(Exp):
+    def __init__(self, size):
+        self.size = size
+
+    def _compile(self, gen):
+        self.size.compile(gen)
+        gen.emit_bc(NEW_ARRAY)
+
+class ArrayAccessor(Exp):
+    def __init__(self, array_var, index):
+        self.array_var = array_var
+        self.index = index
+
+    def _compile(self, gen):
+        self.array_var.compile(gen)
+        self.index.compile(gen)
+        gen.emit_bc(ARRAY_GET)
 
+class ArraySetter(Exp):
+    leaves_value = False
+
+    def __init__(self, array_var, index, exp):
+        self.array_var = array_var
+        self.index = index
+        self.exp = exp
+
+    def _compile(self, gen):
+        self.array_var.compile(gen)
+        self.index.compile(gen)
+        self.exp.compile(gen)
+        gen.emit_bc(ARRAY_SET)
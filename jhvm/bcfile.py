@@ -0,0 +1,121 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Reading and writing of compiled bytecode files: one instruction or operand
+# per line, then EOB, then the function table, one
+# "pc,var_count,stack_size,arity,name" line per function in the order CALL
+# operands index it.
+# CONST_STR operands are written quoted, as in jh source, so that no string
+# spans lines or reads as EOB.
+# loads(), quote_str() and unquote_str() are RPython, as the translated VM
+# uses them.
+from __future__ import absolute_import
+
+from jhvm.opcodes import EOB
+
+from rpython.rlib.rstring import StringBuilder
+
+ESCAPES = {'\n' : 'n', '\r' : 'r', '\t' : 't', '"' : '"', '\\' : '\\'}
+
+HEX_DIGITS = '0123456789abcdef'
+
+def quote_str(value):
+    # Other control characters are written as \xHH, so that a quoted string
+    # is a single line whichever way lines are split.
+    parts = ['"']
+    for c in value:
+        escape = ESCAPES.get(c, None)
+        if escape is not None:
+            parts.append('\\' + escape)
+        elif ord(c) < 32 or ord(c) == 127:
+            parts.append('\\x' + HEX_DIGITS[ord(c) >> 4] +
+                         HEX_DIGITS[ord(c) & 15])
+        else:
+            parts.append(c)
+    parts.append('"')
+    return ''.join(parts)
+
+def hex_value(c):
+    # The value of a hex digit of either case, -1 for any other character.
+    if 'A' <= c <= 'F':
+        return ord(c) - ord('A') + 10
+    return HEX_DIGITS.find(c)
+
+def unquote_str(literal):
+    # The inverse of quote_str(). An unknown escape stands for the escaped
+    # character itself, as does \x not followed by two hex digits.
+    end = len(literal) - 1
+    assert end >= 1
+    builder = StringBuilder(end)
+    i = 1
+    while i < end:
+        c = literal[i]
+        if c == '\\' and i + 1 < end:
+            i += 1
+            c = literal[i]
+            if c == 'n':
+                c = '\n'
+            elif c == 'r':
+                c = '\r'
+            elif c == 't':
+                c = '\t'
+            elif c == 'x' and i + 2 < end:
+                high = hex_value(literal[i + 1])
+                low = hex_value(literal[i + 2])
+                if high >= 0 and low >= 0:
+                    c = chr(high * 16 + low)
+                    i += 2
+        builder.append(c)
+        i += 1
+    return builder.build()
+
+class FunctionInfo(object):
+    # An entry of the function table: where the function's code starts, how
+    # many variable slots and stack slots its frame needs, how many of the
+    # variable slots are taken by its arguments, and its name, which only
+    # tools reading the image use.
+    _immutable_fields_ = ['pc', 'var_count', 'stack_size', 'arity', 'name']
+
+    def __init__(self, pc, var_count, stack_size, arity, name):
+        self.pc = pc
+        self.var_count = var_count
+        self.stack_size = stack_size
+        self.arity = arity
+        self.name = name
+
+    def __eq__(self, other):
+        return self.__dict__ == other.__dict__
+
+    def __repr__(self):
+        return 'FunctionInfo(%s, %s, %s, %s, %s)' % (self.pc, self.var_count,
+                                                     self.stack_size,
+                                                     self.arity, self.name)
+
+def dumps(bytecode, functions):
+    lines = ['%s\n' % op for op in bytecode]
+    lines.append('%s\n' % EOB)
+    for function in functions:
+        lines.append('%s,%s,%s,%s,%s\n' % (function.pc, function.var_count,
+                                           function.stack_size,
+                                           function.arity, function.name))
+    return ''.join(lines)
+
+def loads(data):
+    # Only '\n' ends a line, as written by dumps().
+    lines = data.split('\n')
+    if lines and lines[-1] == '':
+        lines.pop()
+    bytecode = []
+    break_line = 0
+    for i, line in enumerate(lines):
+        if line == EOB:
+            break_line = i
+            break
+        bytecode.append(line)
+
+    functions = []
+    for line in lines[break_line + 1:]:
+        pc, var_count, stack_size, arity, name = line.split(',')
+        functions.append(FunctionInfo(int(pc), int(var_count),
+                                      int(stack_size), int(arity), name))
+    return bytecode, functions
@@ -0,0 +1,130 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# On-disk cache of compiled bytecode, so that unchanged .jh files don't go
+# through lexing, parsing and code generation again.
+#
+# Entries are keyed on a hash of the source, the compiler version and the
+# options that affect code generation. The compiler version is itself a hash
+# of the compiler's own sources, so editing the compiler invalidates the cache
+# without anyone having to remember to bump a number.
+from __future__ import absolute_import
+
+import hashlib
+import os
+import re
+import tempfile
+
+CACHE_DIR_ENV = 'JHVM_CACHE_DIR'
+
+# The modules the compiler is entered through. They and every jhvm module
+# they import, directly or not, determine the bytecode produced for a given
+# input, so the list of those can't drift as passes are added.
+COMPILER_ENTRY_MODULES = ['parser', 'linker', 'bcfile']
+
+JHVM_IMPORT = re.compile(r'^\s*(?:from\s+jhvm\.(\w+)\s+import'
+                         r'|from\s+jhvm\s+import\s+([\w, ]+)'
+                         r'|import\s+jhvm\.(\w+))', re.M)
+
+_compiler_version = None
+
+def default_cache_dir():
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir:
+        return cache_dir
+    return os.path.join(os.path.expanduser('~'), '.cache', 'jhvm')
+
+def compiler_modules(package_dir):
+    # The names of the entry modules and of the jhvm modules they import,
+    # following imports transitively, sorted.
+    modules = set()
+    pending = list(COMPILER_ENTRY_MODULES)
+    while pending:
+        name = pending.pop()
+        path = os.path.join(package_dir, name + '.py')
+        if name in modules or not os.path.exists(path):
+            continue
+        modules.add(name)
+        with open(path) as f:
+            source = f.read()
+        for module, names, imported in JHVM_IMPORT.findall(source):
+            pending.extend([module, imported])
+            pending.extend([n.strip() for n in names.split(',')])
+    return sorted(modules)
+
+def compiler_version():
+    global _compiler_version
+    if _compiler_version is None:
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha1()
+        for name in compiler_modules(package_dir):
+            with open(os.path.join(package_dir, name + '.py'), 'rb') as f:
+                digest.update(name + '\0')
+                digest.update(f.read())
+        _compiler_version = digest.hexdigest()
+    return _compiler_version
+
+class BytecodeCache(object):
+
+    def __init__(self, cache_dir = None):
+        self.cache_dir = cache_dir or default_cache_dir()
+
+    def key_for(self, source, options = None):
+        digest = hashlib.sha1()
+        digest.update(compiler_version())
+        for name, value in sorted((options or {}).items()):
+            digest.update('\0%s=%s' % (name, value))
+        digest.update('\0')
+        digest.update(source)
+        return digest.hexdigest()
+
+    def _path_for(self, key):
+        return os.path.join(self.cache_dir, key + '.jhc')
+
+    def get(self, key):
+        try:
+            with open(self._path_for(key), 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def put(self, key, data):
+        write_atomic(self._path_for(key), data)
+
+class FunctionCache(object):
+    # Compiled functions keyed on their AST fingerprint, for use as the store
+    # of an IncrementalCompiler. Entries for different compiler versions or
+    # options live side by side.
+
+    def __init__(self, cache_dir = None, options = None):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.prefix = BytecodeCache(self.cache_dir).key_for('', options)
+
+    def _path_for(self, fingerprint):
+        digest = hashlib.sha1(self.prefix + fingerprint).hexdigest()
+        return os.path.join(self.cache_dir, 'functions', digest + '.jhf')
+
+    def get(self, fingerprint):
+        from jhvm.genast import CompiledFunction
+        try:
+            with open(self._path_for(fingerprint), 'rb') as f:
+                return CompiledFunction.loads(f.read())
+        except IOError:
+            return None
+
+    def __setitem__(self, fingerprint, compiled_function):
+        write_atomic(self._path_for(fingerprint), compiled_function.dumps())
+
+def write_atomic(path, data):
+    # Written to a temp file first so concurrent compilers never see a
+    # partially written entry.
+    cache_dir = os.path.dirname(path)
+    try:
+        os.makedirs(cache_dir)
+    except OSError:
+        if not os.path.isdir(cache_dir):
+            raise
+    fd, tmp_path = tempfile.mkstemp(dir = cache_dir)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.rename(tmp_path, path)
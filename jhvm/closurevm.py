@@ -0,0 +1,370 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Closure-compiled backend for running jhvm bytecode under plain CPython.
+#
+# Untranslated, VirtualMachine.interp spends most of its time decoding: every
+# instruction goes through a chain of string compares and int() conversions of
+# its operand. Here the bytecode is split into basic blocks once, and every
+# instruction is turned into a Python closure with its operand already decoded
+# and bound. Running a program is then just a matter of calling block
+# closures, each of which returns the pc of the next block to run.
+#
+# Values, objects and maps are the ones from jhvm.vm, so results are
+# identical to those of VirtualMachine.interp. Not RPython.
+from __future__ import absolute_import
+
+from jhvm.opcodes import *
+from jhvm.util import bail
+from jhvm.vm import (Int, Bool, Obj, Array, get_shape, new_obj_with_shape,
+                     intern_str, MAP_TREE)
+
+BRANCHES = (JUMP, JUMP_IF_TRUE, JUMP_IF_FALSE, LOOP_IF_TRUE,
+            LT_INT_JUMP_IF_FALSE, LT_INT_LOOP_IF_TRUE)
+TERMINATORS = BRANCHES + (CALL, RET, EXIT)
+
+# pc returned by a block when the program has finished
+HALT = -1
+
+class ClosureFrame(object):
+    __slots__ = ('stack', 'variables', 'return_address', 'caller_frame')
+
+    def __init__(self, return_address, variables, caller_frame):
+        self.stack = []
+        self.variables = variables
+        self.return_address = return_address
+        self.caller_frame = caller_frame
+
+    def repr(self):
+        return '<vm object>'
+
+class State(object):
+    # Mutable execution state shared by all block closures of a run.
+    __slots__ = ('frame', 'result', 'returned')
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.result = None
+        self.returned = False
+
+class ClosureMachine(object):
+
+    def __init__(self, instructions, functions, args = None, map_tree = None):
+        self.instructions = instructions
+        self.stack = []
+        self.functions = functions
+        self.heap = []
+        if map_tree is None:
+            map_tree = MAP_TREE
+        self.map_tree = map_tree
+        self._compiled_for = None
+        self._blocks = None
+
+        # ints passed to main as its arguments
+        self.args = []
+        if args:
+            self.args = args
+
+    def interp(self, bytecode):
+        if self._compiled_for is not bytecode:
+            self._blocks = self.compile(bytecode)
+            self._compiled_for = bytecode
+
+        main_fn = self.functions[0]
+        if len(self.args) > main_fn.arity:
+            bail('main takes %d arguments, got %d' % (main_fn.arity,
+                                                      len(self.args)))
+        main_vars = [None] * main_fn.var_count
+        for i in range(len(self.args)):
+            main_vars[i] = Int(self.args[i])
+        frame = ClosureFrame(len(bytecode) + 1, main_vars, None)
+        self.stack.append(frame)
+        state = State(frame)
+
+        blocks = self._blocks
+        pc = 0 if bytecode else HALT
+        while pc != HALT:
+            pc = blocks[pc](state)
+
+        if state.returned:
+            return state.result
+        return self.stack.pop()
+
+    def compile(self, bytecode):
+        # Returns a list indexed by pc holding the closure of the basic block
+        # starting at that pc, or None where no block starts.
+        decoded = decode(bytecode)
+        starts = find_leaders(decoded, self.functions, len(bytecode))
+        blocks = [None] * len(bytecode)
+
+        index = 0
+        for n, start in enumerate(starts):
+            end = starts[n + 1] if n + 1 < len(starts) else len(bytecode)
+            while decoded[index][0] < start:
+                index += 1
+            ops = []
+            terminator = None
+            while index < len(decoded) and decoded[index][0] < end:
+                pc, instr, arg = decoded[index]
+                index += 1
+                if instr in TERMINATORS:
+                    terminator = self._compile_terminator(pc, instr, arg,
+                                                          len(bytecode))
+                    break
+                ops.append(self._compile_op(instr, arg))
+            if terminator is None:
+                terminator = fall_through(end, len(bytecode))
+            blocks[start] = make_block(ops, terminator)
+        return blocks
+
+    def _compile_op(self, instr, arg):
+        heap = self.heap
+        root_map = self.map_tree.root
+
+        if instr == CONST_INT:
+            const = Int(int(arg))
+            def op(frame):
+                frame.stack.append(const)
+        elif instr == CONST_STR:
+            value = intern_str(arg)
+            def op(frame):
+                frame.stack.append(value)
+        elif instr == POP:
+            def op(frame):
+                frame.stack.pop()
+        elif instr == ADD:
+            def op(frame):
+                stack = frame.stack
+                o2 = stack.pop()
+                stack.append(stack.pop().add(o2))
+        elif instr == ADD_INT:
+            def op(frame):
+                stack = frame.stack
+                o2 = stack.pop()
+                stack.append(Int(stack.pop().int_val + o2.int_val))
+        elif instr == SUB_INT:
+            def op(frame):
+                stack = frame.stack
+                o2 = stack.pop()
+                stack.append(Int(stack.pop().int_val - o2.int_val))
+        elif instr == EQ_INT:
+            def op(frame):
+                stack = frame.stack
+                o2 = stack.pop()
+                stack.append(Bool(stack.pop().int_val == o2.int_val))
+        elif instr == LT_INT:
+            def op(frame):
+                stack = frame.stack
+                o2 = stack.pop()
+                stack.append(Bool(stack.pop().int_val < o2.int_val))
+        elif instr == SUB:
+            def op(frame):
+                stack = frame.stack
+                o2 = stack.pop()
+                stack.append(stack.pop().sub(o2))
+        elif instr == EQ:
+            def op(frame):
+                stack = frame.stack
+                o2 = stack.pop()
+                stack.append(stack.pop().eq(o2))
+        elif instr == NEQ:
+            def op(frame):
+                stack = frame.stack
+                o2 = stack.pop()
+                stack.append(stack.pop().neq(o2))
+        elif instr == LT:
+            def op(frame):
+                stack = frame.stack
+                o2 = stack.pop()
+                stack.append(stack.pop().lt(o2))
+        elif instr == DUP:
+            def op(frame):
+                frame.stack.append(frame.stack[-1])
+        elif instr == SWAP:
+            def op(frame):
+                stack = frame.stack
+                stack[-1], stack[-2] = stack[-2], stack[-1]
+        elif instr == VAR:
+            index = int(arg)
+            def op(frame):
+                frame.stack.append(frame.variables[index])
+        elif instr == ASSIGN:
+            def op(frame):
+                stack = frame.stack
+                value = stack.pop()
+                var = stack.pop()
+                if not isinstance(var, Int):
+                    raise NotImplementedError()
+                frame.variables[var.int_val] = value
+        elif instr == NEW:
+            def op(frame):
+                heap.append(Obj(root_map))
+                frame.stack.append(Int(len(heap) - 1))
+        elif instr == NEW_WITH_SHAPE:
+            shape = get_shape(arg)
+            count = len(shape.names)
+            def op(frame):
+                stack = frame.stack
+                values = stack[-count:]
+                del stack[-count:]
+                heap.append(new_obj_with_shape(shape, values, root_map))
+                stack.append(Int(len(heap) - 1))
+        elif instr == GET_FIELD:
+            def op(frame):
+                obj_ref = frame.stack.pop()
+                if not isinstance(obj_ref, Int):
+                    raise NotImplementedError()
+                frame.stack.append(heap[obj_ref.int_val].get_field(arg))
+        elif instr == SET_FIELD:
+            def op(frame):
+                stack = frame.stack
+                value = stack.pop()
+                obj_ref = stack.pop()
+                if not isinstance(obj_ref, Int):
+                    raise NotImplementedError()
+                heap[obj_ref.int_val].set_field(arg, value)
+        elif instr == NEW_ARRAY:
+            def op(frame):
+                length = frame.stack.pop()
+                if not isinstance(length, Int):
+                    raise NotImplementedError()
+                heap.append(Array(length.int_val))
+                frame.stack.append(Int(len(heap) - 1))
+        elif instr == ARRAY_GET:
+            def op(frame):
+                stack = frame.stack
+                index = stack.pop()
+                array = array_for_ref(heap, stack.pop())
+                if not isinstance(index, Int):
+                    raise NotImplementedError()
+                stack.append(array.get(index.int_val))
+        elif instr == ARRAY_SET:
+            def op(frame):
+                stack = frame.stack
+                value = stack.pop()
+                index = stack.pop()
+                array = array_for_ref(heap, stack.pop())
+                if not isinstance(index, Int):
+                    raise NotImplementedError()
+                array.set(index.int_val, value)
+        elif instr == SNAPSHOT:
+            # Images are only taken by the interpreter loop.
+            def op(frame):
+                pass
+        else:
+            # interp only complains once it reaches an unknown opcode
+            def op(frame):
+                bail('unknown op_code: %s' % instr)
+        return op
+
+    def _compile_terminator(self, pc, instr, arg, code_length):
+        next_pc = pc_or_halt(pc + 2, code_length)
+
+        if instr == JUMP:
+            target = int(arg)
+            def terminator(state):
+                return target
+        elif instr in (JUMP_IF_TRUE, JUMP_IF_FALSE, LOOP_IF_TRUE):
+            target = int(arg)
+            jump_when = instr != JUMP_IF_FALSE
+            def terminator(state):
+                exp = state.frame.stack.pop()
+                if not isinstance(exp, Bool):
+                    raise NotImplementedError()
+                if exp.bool_val == jump_when:
+                    return target
+                return next_pc
+        elif instr in (LT_INT_JUMP_IF_FALSE, LT_INT_LOOP_IF_TRUE):
+            target = int(arg)
+            jump_when = instr == LT_INT_LOOP_IF_TRUE
+            def terminator(state):
+                stack = state.frame.stack
+                o2 = stack.pop()
+                if (stack.pop().int_val < o2.int_val) == jump_when:
+                    return target
+                return next_pc
+        elif instr == CALL:
+            function = self.functions[int(arg)]
+            address = function.pc
+            var_size = function.var_count
+            arity = function.arity
+            def terminator(state):
+                caller_frame = state.frame
+                stack = caller_frame.stack
+                variables = [None] * var_size
+                for i in range(arity):
+                    variables[i] = stack.pop()
+                state.frame = ClosureFrame(next_pc, variables, caller_frame)
+                return address
+        elif instr == RET:
+            def terminator(state):
+                frame = state.frame
+                ret_val = frame.stack.pop()
+                caller_frame = frame.caller_frame
+                if caller_frame is None: # if main function
+                    state.result = ret_val
+                    state.returned = True
+                    return HALT
+                caller_frame.stack.append(ret_val)
+                state.frame = caller_frame
+                return frame.return_address
+        else: # EXIT
+            def terminator(state):
+                return HALT
+        return terminator
+
+def decode(bytecode):
+    # Splits the flat bytecode list into (pc, instr, arg) triples.
+    decoded = []
+    pc = 0
+    while pc < len(bytecode):
+        instr = bytecode[pc]
+        if has_arg(instr):
+            decoded.append((pc, instr, bytecode[pc + 1]))
+            pc += 2
+        else:
+            decoded.append((pc, instr, None))
+            pc += 1
+    return decoded
+
+def has_arg(instr):
+    try:
+        return HAS_ARGS[int(instr)]
+    except (ValueError, IndexError):
+        return False
+
+def find_leaders(decoded, functions, code_length):
+    leaders = set([0])
+    leaders.update([function.pc for function in functions])
+    for pc, instr, arg in decoded:
+        if instr in BRANCHES:
+            leaders.add(int(arg))
+        if instr in TERMINATORS:
+            leaders.add(pc + int(has_arg(instr)) + 1)
+    return sorted(pc for pc in leaders if pc < code_length)
+
+def pc_or_halt(pc, code_length):
+    if pc >= code_length:
+        return HALT
+    return pc
+
+def fall_through(pc, code_length):
+    pc = pc_or_halt(pc, code_length)
+    def terminator(state):
+        return pc
+    return terminator
+
+def make_block(ops, terminator):
+    def block(state):
+        frame = state.frame
+        for op in ops:
+            op(frame)
+        return terminator(state)
+    return block
+
+def array_for_ref(heap, array_ref):
+    if isinstance(array_ref, Int):
+        array = heap[array_ref.int_val]
+        if isinstance(array, Array):
+            return array
+    raise NotImplementedError()
@@ -2,21 +2,182 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
-from jhvm.parser import parse_input
-from jhvm.ast import *
+import hashlib
 
-def generate_bytecode(ast):
-    context = GeneratorContext()
-    ast.compile(context)
-    return context.get_bytecode()
+from jhvm.ast import *
+from jhvm.assembler import (Label, LabelDef, FunctionRef, VarRef, assemble,
+                            stack_depth)
+from jhvm.bcfile import FunctionInfo
+from jhvm.timings import NO_TIMINGS
+from jhvm.typeinfer import infer_types
+from jhvm.licm import hoist_invariants
+from jhvm.liveness import allocate_slots
+
+def generate_bytecode(ast, timings = NO_TIMINGS):
+    functions = compile_functions(ast, timings)
+    with timings.stage('link'):
+        return link(functions)
+
+def compile_functions(ast, timings = NO_TIMINGS):
+    with timings.stage('ast passes'):
+        functions = [run_ast_passes(function)
+                     for function in ast.functions.items]
+    with timings.stage('codegen'):
+        contexts = [emit_function(function, types)
+                    for function, types in functions]
+    with timings.stage('liveness'):
+        for context in contexts:
+            context.allocate_slots()
+    with timings.stage('assemble'):
+        return [context.get_function() for context in contexts]
+
+def compile_function(function):
+    function, types = run_ast_passes(function)
+    return emit_function(function, types).get_function()
+
+def run_ast_passes(function):
+    # Returns the function to generate code for, after the optimizations on
+    # its AST, and its types.
+    function = hoist_invariants(function)
+    return function, infer_types(function)
+
+def emit_function(function, types):
+    # Returns the GeneratorContext holding the function's unassembled code.
+    context = GeneratorContext(types)
+    function.compile(context)
+    return context
+
+def function_fingerprint(function):
+    # Labels are numbered per function at compile time, so two Function nodes
+    # with the same repr always compile to the same code.
+    return hashlib.sha1(repr(function)).hexdigest()
+
+def link(functions):
+    # Lays the functions out one after another in a single bytecode image,
+    # the first function (main) at pc 0. Jump targets are relocated by the
+    # function's start pc, and CALL operands become indexes into the function
+    # table, which lists the functions in the same order.
+    function_indexes = {}
+    for function in functions:
+        if function.name in function_indexes:
+            raise ValueError('Function %s is defined twice' % function.name)
+        function_indexes[function.name] = len(function_indexes)
+
+    bytecode = []
+    function_table = []
+    for function in functions:
+        start = len(bytecode)
+        code = list(function.code)
+        for i in function.jump_operands:
+            code[i] = str(int(code[i]) + start)
+        for i, arg_count in zip(function.call_operands,
+                                function.call_arg_counts):
+            try:
+                index = function_indexes[code[i]]
+            except KeyError:
+                raise ValueError('Call to undefined function %s' % code[i])
+            callee = functions[index]
+            if arg_count != callee.arity:
+                raise ValueError('%s takes %d arguments, %d given in %s' %
+                                 (callee.name, callee.arity, arg_count,
+                                  function.name))
+            code[i] = str(index)
+        bytecode.extend(code)
+        function_table.append(FunctionInfo(start, function.var_count,
+                                           function.stack_size,
+                                           function.arity, function.name))
+    return bytecode, function_table
+
+
+class CompiledFunction(object):
+    # The bytecode of a single function, before linking. Jump targets are
+    # relative to the start of the function and CALL operands are still
+    # function names. jump_operands and call_operands hold the indexes into
+    # code of those operands, and call_arg_counts the number of arguments
+    # passed by each call. stack_size is the deepest the code's stack gets.
+
+    def __init__(self, name, code, var_count, stack_size, arity,
+                 jump_operands, call_operands, call_arg_counts):
+        self.name = name
+        self.code = code
+        self.var_count = var_count
+        self.stack_size = stack_size
+        self.arity = arity
+        self.jump_operands = jump_operands
+        self.call_operands = call_operands
+        self.call_arg_counts = call_arg_counts
+
+    def __eq__(self, other):
+        return self.__dict__ == other.__dict__
+
+    def dumps(self):
+        lines = [self.name, str(self.var_count), str(self.stack_size),
+                 str(self.arity),
+                 ','.join([str(i) for i in self.jump_operands]),
+                 ','.join([str(i) for i in self.call_operands]),
+                 ','.join([str(i) for i in self.call_arg_counts])]
+        lines.extend(self.code)
+        return ''.join(['%s\n' % line for line in lines])
+
+    @staticmethod
+    def loads(data):
+        lines = data.split('\n')[:-1]
+        name, var_count, stack_size, arity = lines[:4]
+        jump_operands, call_operands, call_arg_counts = [
+            [int(i) for i in line.split(',') if i] for line in lines[4:7]]
+        return CompiledFunction(name, lines[7:], int(var_count),
+                                int(stack_size), int(arity), jump_operands,
+                                call_operands, call_arg_counts)
+
+
+class IncrementalCompiler(object):
+    # Compiles programs that change a little between calls, such as a file
+    # being edited. Only functions whose AST changed since the last call are
+    # generated again; the others are taken from the previous result, or from
+    # store (any object with get() and item assignment, e.g. a FunctionCache),
+    # and everything is relinked.
+
+    def __init__(self, store = None):
+        self.store = store
+        self.functions = {}
+        self.regenerated = []
+
+    def compile_program(self, ast):
+        return link(self.compile_functions(ast))
+
+    def compile_functions(self, ast):
+        previous, self.functions = self.functions, {}
+        self.regenerated = []
+        compiled_functions = []
+        for function in ast.functions.items:
+            key = function_fingerprint(function)
+            compiled = previous.get(key) or self.functions.get(key)
+            if compiled is None and self.store is not None:
+                compiled = self.store.get(key)
+            if compiled is None:
+                compiled = compile_function(function)
+                self.regenerated.append(function.name)
+                if self.store is not None:
+                    self.store[key] = compiled
+            self.functions[key] = compiled
+            compiled_functions.append(compiled)
+        return compiled_functions
 
 
 class GeneratorContext(object):
+    # Collects the code of one function and assembles it. types is the
+    # function's typeinfer.TypeInfo; without it only generic opcodes are
+    # emitted.
 
-    def __init__(self):
+    def __init__(self, types = None):
+        self.types = types
         self.code = []
-        self.func_names = []
-        self.func_vars = []
+        self.func_name = None
+        self.params = []
+        self.label_count = 0
+        # variable name -> slot, and the number of slots, once allocated
+        self.slots = None
+        self.var_count = 0
 
     def emit_bc(self, opcode):
         self.code.append(str(opcode))
@@ -32,54 +193,54 @@ class GeneratorContext(object):
         conv_opcode = str(opcode)
         self.code.extend([conv_opcode, arg])
 
-    def register_function(self, name, args):
-        self.func_names.append(name)
-        self.func_vars.append(args)
-
-    def register_num_for_var(self, var):
+    def emit_var(self, opcode, name):
         # Using a number to represent vars in bytecode makes interpreting it
-        # easier, in addition to being a more efficient representation.
+        # easier, in addition to being a more efficient representation. The
+        # numbers are only allocated once the whole function is generated.
         #
         # As our language has no global vars or closures, we assume each var
-        # number is unique to its enclosing function's scope.
-        var_list = self.func_vars[-1]
-        try:
-            return var_list.index(var)
-        except ValueError:
-            var_list.append(var)
-            return len(var_list) - 1
+        # name is unique to its enclosing function's scope.
+        self.code.extend([str(opcode), VarRef(name)])
+
+    def emit_jump(self, opcode, label):
+        assert isinstance(label, Label)
+        self.code.extend([str(opcode), label])
+
+    def int_operands(self, binexp):
+        return self.types is not None and self.types.int_operands(binexp)
+
+    def emit_call(self, name, arg_count):
+        self.code.extend([CALL, FunctionRef(name, arg_count)])
+
+    def register_function(self, name, args):
+        assert self.func_name is None, 'one function per GeneratorContext'
+        self.func_name = name
+        self.params = list(args)
+
+    def new_label(self, kind):
+        label = Label('%s_%s' % (kind, self.label_count))
+        self.label_count += 1
+        return label
 
     def emit_label(self, label):
-        self.code.append(label)
-
-    def _get_func_arg_count(self):
-        var_count = [len(f_vars) for f_vars in self.func_vars]
-        return {k:v for k,v in zip(self.func_names, var_count)}
-
-
-    def _remove_func_names(self):
-        # Remove statically function and loop labels from bytecode and
-        # replace them with index of bytecode instr. to jump to.
-        labels = {}
-        for i, instr in enumerate(self.code):
-            if instr.endswith(':'):
-                del self.code[i]
-                labels.update({instr[:-1] : str(i)})
-        for i, instr in enumerate(self.code):
-            try:
-                self.code[i] = labels[instr]
-            except KeyError: pass
-
-        return labels
-
-    def get_bytecode(self):
-        print self.func_vars
-        var_count = self._get_func_arg_count()
-        labels = self._remove_func_names()
-        var_count_for_call_pc = {}
-        for fn_name, count in var_count.items():
-            fn_jump_loc = int(labels[fn_name])
-            var_count_for_call_pc[fn_jump_loc] = count
-
-        print var_count_for_call_pc
-        return self.code, var_count_for_call_pc
+        self.code.append(LabelDef(label))
+
+    def allocate_slots(self):
+        # Variables whose live ranges don't overlap share a slot.
+        self.slots, self.var_count = allocate_slots(self.code, self.params)
+
+    def get_function(self):
+        if self.slots is None:
+            self.allocate_slots()
+        slots = self.slots
+        items = [str(slots[item.name]) if isinstance(item, VarRef) else item
+                 for item in self.code]
+        code, jump_operands, call_operands = assemble(items)
+        call_arg_counts = [item.arg_count for item in items
+                           if isinstance(item, FunctionRef)]
+        # Every argument needs a slot, even if a parameter name is repeated.
+        arity = len(self.params)
+        return CompiledFunction(self.func_name, code,
+                                max(self.var_count, arity),
+                                stack_depth(items), arity, jump_operands,
+                                call_operands, call_arg_counts)
@@ -0,0 +1,377 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Images of a running program, for programs that spend much of their run
+# building the same objects before they do any real work. Asked to take a
+# snapshot, the VM stops at the first SNAPSHOT instruction (a `snapshot`
+# statement) and the image saves what it needs to carry on from there: the
+# heap, the map tree its objects' maps belong to and the chain of frames.
+# Later runs load the image and resume right after the snapshot.
+#
+# Like bytecode files, images are text, one item per line:
+#
+#   jhvm-image
+#   the checksum of the bytecode the image was taken running
+#   the pc to resume at
+#   "maps N", then a "parent is_int replacement field" line per map. The
+#       root and dictionary mode maps are maps 0 and 1 and aren't listed,
+#       every other map comes after its parent.
+#   "heap N", then per heap entry either "obj map N", "dict N", "ints N" or
+#       "array N", followed by the N values of the object's fields, in the
+#       order of its map, its field names and values, or the array's
+#       elements, unboxed ints for "ints"
+#   "frames N", then per frame, main's first, "frame return_address
+#       var_count stack_size sp", followed by its variables and the values on
+#       its stack
+#
+# Values are a line each: "-" for none, "i" and an int, "b" and 0 or 1, or
+# "s" and a quoted string, "S" for an interned one. Strings are saved flat.
+#
+# Maps are recreated by taking the same transitions again in the loading
+# machine's map tree. Should that tree run out of maps first, the objects
+# with the maps it can't have are loaded in dictionary mode.
+#
+# RPython, as the translated VM reads and writes images.
+from __future__ import absolute_import
+
+from jhvm.bcfile import quote_str, unquote_str
+from jhvm.vm import (Obj, Array, IntArrayStorage, ObjectArrayStorage, Int,
+                     Bool, Str, StrLiteral, Frame, intern_value)
+
+from rpython.rlib.listsort import make_timsort_class
+from rpython.rlib.rarithmetic import r_uint, intmask
+
+MAGIC = 'jhvm-image'
+
+# RPython lists have no sort().
+NameSort = make_timsort_class()
+
+class ImageError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+def bytecode_checksum(bytecode):
+    # FNV-1a over the instructions and operands, each ended by a newline.
+    h = r_uint(2166136261)
+    for item in bytecode:
+        for c in item:
+            h = (h ^ r_uint(ord(c))) * r_uint(16777619)
+        h = (h ^ r_uint(10)) * r_uint(16777619)
+    return intmask(h)
+
+def dumps_image(machine, bytecode):
+    # The image of machine, which must have stopped at a SNAPSHOT.
+    frame = machine.snapshot_frame
+    assert frame is not None
+    writer = ImageWriter()
+    writer.lines.append(MAGIC)
+    writer.lines.append(str(bytecode_checksum(bytecode)))
+    writer.lines.append(str(machine.snapshot_pc))
+    writer.write_maps(machine.map_tree)
+    writer.write_heap(machine.heap)
+    writer.write_frames(frame)
+    writer.lines.append('')
+    return '\n'.join(writer.lines)
+
+def load_image(machine, bytecode, data):
+    # Fills in machine.heap from an image taken running bytecode. Returns
+    # the innermost frame and the pc to resume at, for machine.resume().
+    reader = ImageReader(data.split('\n'))
+    try:
+        if reader.next_line() != MAGIC:
+            raise ImageError('not an image')
+        if reader.next_int() != bytecode_checksum(bytecode):
+            raise ImageError('taken running different bytecode')
+        pc = reader.next_int()
+        reader.read_maps(machine.map_tree)
+        machine.heap = reader.read_heap()
+        frame = reader.read_frames()
+    except ValueError:
+        raise ImageError('malformed line %d' % reader.pos)
+    return frame, pc
+
+def resume_from_image(machine, bytecode, data):
+    frame, pc = load_image(machine, bytecode, data)
+    return machine.resume(bytecode, frame, pc)
+
+
+class ImageWriter(object):
+
+    def __init__(self):
+        self.lines = []
+        self.map_indexes = {}
+
+    def write_maps(self, tree):
+        self.map_indexes[tree.root] = 0
+        self.map_indexes[tree.dict_map] = 1
+        maps = []
+        pending = [tree.root]
+        while pending:
+            parent = pending.pop()
+            for is_int in [True, False]:
+                if is_int:
+                    transitions = parent.int_maps
+                else:
+                    transitions = parent.other_maps
+                names = transitions.keys()
+                NameSort(names).sort()
+                for name in names:
+                    child = transitions[name]
+                    self.map_indexes[child] = len(self.map_indexes)
+                    maps.append((child, parent, is_int, name))
+                    pending.append(child)
+
+        self.lines.append('maps %d' % len(maps))
+        for child, parent, is_int, name in maps:
+            replacement = -1
+            if child.replacement is not None:
+                replacement = self.map_indexes[child.replacement]
+            self.lines.append('%d %d %d %s' % (self.map_indexes[parent],
+                                               int(is_int), replacement, name))
+
+    def write_heap(self, heap):
+        self.lines.append('heap %d' % len(heap))
+        for entry in heap:
+            if isinstance(entry, Obj):
+                self.write_obj(entry)
+            elif isinstance(entry, Array):
+                self.write_array(entry)
+            else:
+                raise ImageError('cannot save heap entry %s' % entry.repr())
+
+    def write_obj(self, obj):
+        _map = obj.map
+        if _map.dict_mode:
+            names = obj.dict_fields.keys()
+            NameSort(names).sort()
+            self.lines.append('dict %d' % len(names))
+            for name in names:
+                self.lines.append(name)
+                self.write_value(obj.dict_fields[name])
+            return
+        index = self.map_indexes.get(_map, -1)
+        if index == -1:
+            raise ImageError('object of a map outside the map tree')
+        self.lines.append('obj %d %d' % (index, len(_map.fields)))
+        for name in _map.fields:
+            self.write_value(obj.get_field(name))
+
+    def write_array(self, array):
+        storage = array.storage
+        if isinstance(storage, IntArrayStorage):
+            self.lines.append('ints %d' % len(storage.items))
+            for item in storage.items:
+                self.lines.append(str(item))
+        elif isinstance(storage, ObjectArrayStorage):
+            self.lines.append('array %d' % len(storage.items))
+            for value in storage.items:
+                self.write_value(value)
+
+    def write_frames(self, frame):
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.caller_frame
+        frames.reverse()
+        self.lines.append('frames %d' % len(frames))
+        for frame in frames:
+            self.lines.append('frame %d %d %d %d' % (frame.return_address,
+                                                     len(frame.variables),
+                                                     len(frame.stack),
+                                                     frame.sp))
+            for value in frame.variables:
+                self.write_value(value)
+            for i in range(frame.sp):
+                self.write_value(frame.stack[i])
+
+    def write_value(self, value):
+        if value is None:
+            self.lines.append('-')
+        elif isinstance(value, Int):
+            self.lines.append('i%d' % value.int_val)
+        elif isinstance(value, Bool):
+            self.lines.append('b%d' % int(value.bool_val))
+        elif isinstance(value, Str):
+            if value.is_interned():
+                kind = 'S'
+            else:
+                kind = 's'
+            self.lines.append(kind + quote_str(value.flatten()))
+        else:
+            raise ImageError('cannot save value %s' % value.repr())
+
+
+class ImageReader(object):
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.pos = 0
+        self.tree = None
+        # per map of the image: the map in this process, None if the tree
+        # had no room for it, and its field names
+        self.maps = []
+        self.map_fields = []
+
+    def next_line(self):
+        if self.pos >= len(self.lines):
+            raise ImageError('truncated image')
+        line = self.lines[self.pos]
+        self.pos += 1
+        return line
+
+    def next_int(self):
+        return int(self.next_line())
+
+    def next_header(self, kind):
+        # The count of a "kind N" line.
+        words = self.next_line().split(' ')
+        if len(words) != 2 or words[0] != kind:
+            raise ImageError('expected %s at line %d' % (kind, self.pos))
+        return int(words[1])
+
+    def read_maps(self, tree):
+        self.tree = tree
+        self.maps = [tree.root, tree.dict_map]
+        self.map_fields = [[], []]
+        replacements = []
+        for i in range(self.next_header('maps')):
+            words = self.next_line().split(' ')
+            if len(words) != 4:
+                raise ImageError('malformed map at line %d' % self.pos)
+            parent = int(words[0])
+            if parent < 0 or parent >= len(self.maps):
+                raise ImageError('map before its parent at line %d' %
+                                 self.pos)
+            is_int = words[1] == '1'
+            name = words[3]
+            parent_map = self.maps[parent]
+            _map = None
+            if parent_map is not None:
+                _map = parent_map.new_map_with_additional_field(name, is_int)
+            self.maps.append(_map)
+            self.map_fields.append(self.map_fields[parent] + [name])
+            replacements.append(int(words[2]))
+        for i in range(len(replacements)):
+            _map = self.maps[i + 2]
+            replacement = replacements[i]
+            if _map is not None and replacement >= 0:
+                _map.replacement = self.get_map(replacement)
+
+    def get_map(self, index):
+        if index < 0 or index >= len(self.maps):
+            raise ImageError('no map %d' % index)
+        return self.maps[index]
+
+    def read_heap(self):
+        heap = []
+        for i in range(self.next_header('heap')):
+            words = self.next_line().split(' ')
+            kind = words[0]
+            if kind == 'obj' and len(words) == 3:
+                heap.append(self.read_obj(int(words[1]), int(words[2])))
+            elif kind == 'dict' and len(words) == 2:
+                obj = Obj()
+                obj.map = self.tree.dict_map
+                obj.dict_fields = {}
+                for j in range(int(words[1])):
+                    name = self.next_line()
+                    obj.dict_fields[name] = self.read_value()
+                heap.append(obj)
+            elif kind == 'ints' and len(words) == 2:
+                array = Array(self.check_length(int(words[1])))
+                storage = array.storage
+                assert isinstance(storage, IntArrayStorage)
+                for j in range(len(storage.items)):
+                    storage.items[j] = self.next_int()
+                heap.append(array)
+            elif kind == 'array' and len(words) == 2:
+                items = [None] * self.check_length(int(words[1]))
+                for j in range(len(items)):
+                    items[j] = self.read_value()
+                array = Array(0)
+                array.storage = ObjectArrayStorage(items)
+                heap.append(array)
+            else:
+                raise ImageError('malformed heap entry at line %d' % self.pos)
+        return heap
+
+    def check_length(self, length):
+        if length < 0:
+            raise ImageError('negative length at line %d' % self.pos)
+        return length
+
+    def read_obj(self, map_index, count):
+        _map = self.get_map(map_index)
+        names = self.map_fields[map_index]
+        if len(names) != count:
+            raise ImageError('wrong field count at line %d' % self.pos)
+        values = [None] * count
+        for i in range(count):
+            values[i] = self.read_value()
+
+        obj = Obj()
+        if _map is not None and _map.dict_mode:
+            raise ImageError('object of the dictionary mode map')
+        if _map is None:
+            obj.map = self.tree.dict_map
+            obj.dict_fields = {}
+            for i in range(count):
+                obj.dict_fields[names[i]] = values[i]
+            return obj
+        field_values = [None] * (count - _map.int_count)
+        int_values = [0] * _map.int_count
+        for i in range(count):
+            index = _map.get_field_index(names[i])
+            value = values[i]
+            if _map.field_is_int(names[i]):
+                if not isinstance(value, Int):
+                    raise ImageError('int field holding a non-int')
+                int_values[index] = value.int_val
+            else:
+                field_values[index] = value
+        obj.map = _map
+        obj.field_values = field_values
+        obj.int_values = int_values
+        return obj
+
+    def read_frames(self):
+        frame = None
+        for i in range(self.next_header('frames')):
+            words = self.next_line().split(' ')
+            if len(words) != 5 or words[0] != 'frame':
+                raise ImageError('malformed frame at line %d' % self.pos)
+            variables = [None] * int(words[2])
+            for j in range(len(variables)):
+                variables[j] = self.read_value()
+            frame = Frame(int(words[1]), variables, frame, int(words[3]))
+            sp = int(words[4])
+            if sp < 0 or sp > len(frame.stack):
+                raise ImageError('stack too deep at line %d' % self.pos)
+            for j in range(sp):
+                value = self.read_value()
+                if value is None:
+                    raise ImageError('empty stack slot at line %d' % self.pos)
+                frame.push(value)
+        if frame is None:
+            raise ImageError('no frames')
+        return frame
+
+    def read_value(self):
+        line = self.next_line()
+        if line == '-':
+            return None
+        if len(line) < 2:
+            raise ImageError('malformed value at line %d' % self.pos)
+        kind = line[0]
+        rest = line[1:]
+        if kind in 'sS' and (len(rest) < 2 or rest[0] != '"'):
+            raise ImageError('malformed string at line %d' % self.pos)
+        if kind == 'i':
+            return Int(int(rest))
+        elif kind == 'b':
+            return Bool(rest == '1')
+        elif kind == 'S':
+            return intern_value(unquote_str(rest))
+        elif kind == 's':
+            return StrLiteral(unquote_str(rest))
+        raise ImageError('malformed value at line %d' % self.pos)
@@ -0,0 +1,281 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Reads the PYPYLOG output of a JIT build and relates what the JIT did back to
+# the bytecode image it ran. Run the program with PYPYLOG=jit:<file> (or at
+# least jit-log-opt, jit-backend-counts, jit-tracing and jit-abort-log).
+#
+# The sections used are:
+#   jit-log-opt-loop    "# Loop N (<location>) : loop with K ops", then ops
+#   jit-log-opt-bridge  "# bridge out of Guard 0x<id> with K ops", then ops
+#   jit-backend-counts  "entry N:count", "TargetToken(id):count" and
+#                       "bridge <decimal id>:count" run counters
+#   jit-tracing         "~~~ ABORTING TRACING <reason>" lines, with the partial
+#                       trace in a jit-abort-log section when that is enabled
+# Locations are get_location() strings, "LineNo:<pc + 1> Instr:<opcode>", as
+# printed by debug_merge_point for every bytecode a trace covers.
+#
+# A guard's failures are only counted once a bridge has been compiled for it,
+# so the failure counts given are the runs of the guard's bridge. Guards that
+# never got a bridge failed fewer times than the JIT's bridge threshold.
+#
+# Not RPython.
+from __future__ import absolute_import
+
+import re
+
+from jhvm.opcodes import OP_CODES
+
+SECTION_START = re.compile(r'^\[[0-9a-f]+\] \{([\w-]+)$')
+SECTION_END = re.compile(r'^\[[0-9a-f]+\] ([\w-]+)\}$')
+LOOP_HEADER = re.compile(r'^# Loop (\d+) \((.*)\) : ([\w ]+) with (\d+) ops$')
+BRIDGE_HEADER = re.compile(r'^# bridge out of Guard 0x([0-9a-f]+) with (\d+) ops$')
+LOCATION = re.compile(r'LineNo:(\d+) Instr:(\w+)')
+MERGE_POINT = re.compile(r'debug_merge_point\(.*\'(.*)\'\)')
+GUARD = re.compile(r'(guard_\w+)\(.*descr=<Guard0x([0-9a-f]+)>')
+TARGET_TOKEN = re.compile(r'descr=TargetToken\((\d+)\)')
+ABORT = re.compile(r'~~~ ABORTING TRACING (\w+)')
+LONGEST = re.compile(r'found new longest: (.*) \d+$')
+COUNTER = re.compile(r'^(entry|bridge) (-?\d+):(\d+)$')
+TOKEN_COUNTER = re.compile(r'^TargetToken\((\d+)\):(\d+)$')
+
+def parse_location(text):
+    # Returns the pc and opcode name of a get_location() string, or None.
+    match = LOCATION.search(text)
+    if match is None:
+        return None
+    return int(match.group(1)) - 1, match.group(2)
+
+
+class Guard(object):
+
+    def __init__(self, op, guard_id, location):
+        self.op = op
+        self.guard_id = guard_id
+        self.location = location    # (pc, opcode) or None
+
+
+class Trace(object):
+    # A compiled loop or bridge. number is the loop number, or for a bridge
+    # the id of the guard it leaves from.
+
+    def __init__(self, kind, number, location, op_count):
+        self.kind = kind
+        self.number = number
+        self.location = location
+        self.op_count = op_count
+        self.guards = []
+        self.target_tokens = []
+        self.merge_points = 0
+
+
+class Abort(object):
+
+    def __init__(self, reason, location):
+        self.reason = reason
+        self.location = location
+
+
+class JitLog(object):
+
+    def __init__(self):
+        self.loops = []
+        self.bridges = []
+        self.aborts = []
+        self.entry_counts = {}      # loop number -> entries from the interpreter
+        self.token_counts = {}      # TargetToken id -> iterations
+        self.bridge_counts = {}     # guard id -> runs of its bridge
+        self.guards = {}            # guard id -> Guard
+
+    def failures(self, guard_id):
+        return self.bridge_counts.get(guard_id, 0)
+
+    def iterations(self, trace):
+        return sum([self.token_counts.get(token, 0)
+                    for token in trace.target_tokens])
+
+
+def parse_log(lines):
+    log = JitLog()
+    sections = []
+    trace = None
+    location = None
+    # The reason and the location of the abort in the current jit-tracing
+    # section; the location comes from its partial trace, or failing that
+    # from the longest function found for a trace that was too long.
+    abort_reason = None
+    abort_location = None
+
+    for line in lines:
+        line = line.rstrip('\n')
+        match = SECTION_START.match(line)
+        if match:
+            name = match.group(1)
+            sections.append(name)
+            if name == 'jit-tracing':
+                abort_reason = None
+                abort_location = None
+            continue
+        match = SECTION_END.match(line)
+        if match:
+            name = match.group(1)
+            if sections and sections[-1] == name:
+                sections.pop()
+            if name in ('jit-log-opt-loop', 'jit-log-opt-bridge'):
+                trace = None
+            elif name == 'jit-tracing' and abort_reason is not None:
+                log.aborts.append(Abort(abort_reason, abort_location))
+                abort_reason = None
+            continue
+        if not sections:
+            continue
+        section = sections[-1]
+        text = line.strip()
+
+        if section in ('jit-log-opt-loop', 'jit-log-opt-bridge'):
+            match = LOOP_HEADER.match(text)
+            if match:
+                location = parse_location(match.group(2))
+                trace = Trace('loop', int(match.group(1)), location,
+                              int(match.group(4)))
+                log.loops.append(trace)
+                continue
+            match = BRIDGE_HEADER.match(text)
+            if match:
+                guard_id = int(match.group(1), 16)
+                guard = log.guards.get(guard_id)
+                location = guard.location if guard is not None else None
+                trace = Trace('bridge', guard_id, location,
+                              int(match.group(2)))
+                log.bridges.append(trace)
+                continue
+            if trace is None:
+                continue
+            match = MERGE_POINT.search(text)
+            if match:
+                location = parse_location(match.group(1))
+                if trace.location is None:
+                    trace.location = location
+                trace.merge_points += 1
+                continue
+            match = GUARD.search(text)
+            if match:
+                guard = Guard(match.group(1), int(match.group(2), 16),
+                              location)
+                trace.guards.append(guard)
+                log.guards[guard.guard_id] = guard
+                continue
+            match = TARGET_TOKEN.search(text)
+            if match and 'label(' in text:
+                trace.target_tokens.append(int(match.group(1)))
+        elif section == 'jit-backend-counts':
+            match = COUNTER.match(text)
+            if match:
+                kind, number, count = match.groups()
+                if kind == 'entry':
+                    log.entry_counts[int(number)] = int(count)
+                else:
+                    log.bridge_counts[int(number)] = int(count)
+                continue
+            match = TOKEN_COUNTER.match(text)
+            if match:
+                log.token_counts[int(match.group(1))] = int(match.group(2))
+        elif 'jit-tracing' in sections:
+            match = ABORT.search(text)
+            if match:
+                abort_reason = match.group(1)
+                continue
+            match = MERGE_POINT.search(text)
+            if match and section == 'jit-abort-log' and abort_location is None:
+                abort_location = parse_location(match.group(1))
+                continue
+            match = LONGEST.search(text)
+            if match and abort_location is None:
+                abort_location = parse_location(match.group(1))
+
+    # A bridge logged before the guard it leaves from is still placed.
+    for bridge in log.bridges:
+        guard = log.guards.get(bridge.number)
+        if guard is not None and guard.location is not None:
+            bridge.location = guard.location
+    return log
+
+# =============================================================================
+# Report
+# =============================================================================
+
+def function_at(functions, pc):
+    # The function whose code contains pc: the one starting last at or
+    # before it, as link() lays the functions out one after another.
+    found = None
+    for function in functions:
+        if function.pc <= pc and (found is None or function.pc > found.pc):
+            found = function
+    return found
+
+def describe_location(location, bytecode, functions):
+    if location is None:
+        return 'unknown location'
+    pc, opcode = location
+    if 0 <= pc < len(bytecode):
+        opcode = OP_CODES[int(bytecode[pc])]
+    function = function_at(functions, pc)
+    name = function.name if function is not None else '?'
+    return 'pc %d %s in %s' % (pc, opcode, name)
+
+def plural(count, word):
+    return '%d %s%s' % (count, word, '' if count == 1 else 's')
+
+def failing_guards(log, trace, top):
+    guards = [guard for guard in trace.guards
+              if guard.guard_id in log.bridge_counts]
+    guards.sort(key = lambda guard: -log.failures(guard.guard_id))
+    return guards[:top]
+
+def format_trace(log, trace, bytecode, functions, top):
+    where = describe_location(trace.location, bytecode, functions)
+    if trace.kind == 'loop':
+        title = 'Loop %d at %s' % (trace.number, where)
+        runs = '%s, %s' % (
+            plural(log.entry_counts.get(trace.number, 0), 'entry'),
+            plural(log.iterations(trace), 'iteration'))
+    else:
+        title = 'Bridge out of guard 0x%x at %s' % (trace.number, where)
+        runs = plural(log.bridge_counts.get(trace.number, 0), 'run')
+    lines = [title,
+             '    %s, %s, %s, %s' % (plural(trace.op_count, 'op'),
+                                     plural(trace.merge_points, 'bytecode'),
+                                     plural(len(trace.guards), 'guard'), runs)]
+    for guard in failing_guards(log, trace, top):
+        lines.append('    %10d  %s at %s' % (
+            log.failures(guard.guard_id), guard.op,
+            describe_location(guard.location, bytecode, functions)))
+    return lines
+
+def format_report(log, bytecode, functions, top = 5):
+    # Loops are listed from the most iterated, bridges from the most run.
+    loops = sorted(log.loops, key = lambda loop: -log.iterations(loop))
+    bridges = sorted(log.bridges,
+                     key = lambda bridge: -log.failures(bridge.number))
+    lines = ['%s, %s, %s' % (plural(len(log.loops), 'loop'),
+                             plural(len(log.bridges), 'bridge'),
+                             plural(len(log.aborts), 'aborted trace')), '']
+    for trace in loops + bridges:
+        lines.extend(format_trace(log, trace, bytecode, functions, top))
+        lines.append('')
+
+    if log.aborts:
+        counts = {}
+        for abort in log.aborts:
+            function = None
+            if abort.location is not None:
+                function = function_at(functions, abort.location[0])
+            key = (function.name if function is not None else '?',
+                   abort.reason)
+            counts[key] = counts.get(key, 0) + 1
+        lines.append('Aborted tracing:')
+        for (name, reason), count in sorted(
+                counts.items(), key = lambda item: (-item[1], item[0])):
+            lines.append('%10d  %s in %s' % (count, reason, name))
+        lines.append('')
+    return '\n'.join(lines)
@@ -2,10 +2,15 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import absolute_import
-from rply import LexerGenerator
+import re
 
-lg = LexerGenerator()
+from rply import LexerGenerator
+from rply.errors import LexingError
+from rply.token import Token, SourcePosition
 
+# The token rules as rply regexes, tried in order. lex() doesn't use them, but
+# produces exactly the token stream a lexer built from them would; see
+# rply_lex().
 token_rules = [
     ('ADD', '\+'),
     ('SUB', '\-'),
@@ -28,19 +33,147 @@ token_rules = [
     ('WHILE', 'while(?!\w)'),
     ('FN', 'fn(?!\w)'),
     ('OBJECT', 'object(?!\w)'),
+    ('ARRAY', 'array(?!\w)'),
     ('RETURN', 'return(?!\w)'),
+    ('SNAPSHOT', 'snapshot(?!\w)'),
     ('ID', '[a-zA-Z_][a-zA-Z_0-9]*'),
     ('NUMBER', '\d+'),
+    ('STRING', r'"(\\.|[^"\\\n])*"'),
 ]
 
-token_names = []
-for token, rule in token_rules:
-    token_names.append(token)
-    lg.add(token,rule)
+token_names = [token for token, rule in token_rules]
+
+# =============================================================================
+# Scanner
+#
+# Every character is classified with a table lookup. Identifiers, numbers and
+# whitespace are then consumed with a single regex match each, as are string
+# literals, keywords are identifiers found in KEYWORDS, and everything else
+# is one or two characters of punctuation.
+# =============================================================================
+
+PUNCTUATION = {
+    '+' : 'ADD',
+    '-' : 'SUB',
+    '(' : 'LPAREN',
+    ')' : 'RPAREN',
+    '{' : 'LBRACE',
+    '}' : 'RBRACE',
+    '[' : 'LSQUARE',
+    ']' : 'RSQUARE',
+    '.' : 'DOT',
+    ',' : 'COMMA',
+    ';' : 'SEMICOLON',
+    '=' : 'ASSIGN',
+    '<' : 'LT',
+}
+
+# Punctuation that is a different token when followed by a second character.
+DOUBLE_PUNCTUATION = {
+    '==' : 'EQ',
+}
+
+KEYWORDS = {
+    'to' : 'TO',
+    'for' : 'FOR',
+    'if' : 'IF',
+    'else' : 'ELSE',
+    'while' : 'WHILE',
+    'fn' : 'FN',
+    'object' : 'OBJECT',
+    'array' : 'ARRAY',
+    'return' : 'RETURN',
+    'snapshot' : 'SNAPSHOT',
+}
+
+CHAR_OTHER = 0
+CHAR_SPACE = 1
+CHAR_ID = 2
+CHAR_DIGIT = 3
+CHAR_PUNCT = 4
+CHAR_QUOTE = 5
+
+CHAR_CLASSES = [CHAR_OTHER] * 256
+for c in ' \t\n\r\f\v':
+    CHAR_CLASSES[ord(c)] = CHAR_SPACE
+for c in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_':
+    CHAR_CLASSES[ord(c)] = CHAR_ID
+for c in '0123456789':
+    CHAR_CLASSES[ord(c)] = CHAR_DIGIT
+for c in PUNCTUATION:
+    CHAR_CLASSES[ord(c)] = CHAR_PUNCT
+CHAR_CLASSES[ord('"')] = CHAR_QUOTE
 
-lg.ignore('\s')
-lexer = lg.build()
+SPACE_RUN = re.compile(r'[ \t\n\r\f\v]+')
+ID_RUN = re.compile(r'[a-zA-Z_0-9]+')
+DIGIT_RUN = re.compile(r'[0-9]+')
+STRING_RUN = re.compile(r'"(\\.|[^"\\\n])*"')
 
 def lex(source):
-    for token in lexer.lex(source):
+    char_classes = CHAR_CLASSES
+    end = len(source)
+    idx = 0
+    lineno = 1
+    line_start = 0 # index of the first character of the current line
+
+    while idx < end:
+        c = source[idx]
+        code = ord(c)
+        char_class = char_classes[code] if code < 256 else CHAR_OTHER
+
+        if char_class == CHAR_SPACE:
+            stop = SPACE_RUN.match(source, idx).end()
+            newlines = source.count('\n', idx, stop)
+            if newlines:
+                lineno += newlines
+                line_start = source.rfind('\n', idx, stop) + 1
+            idx = stop
+            continue
+
+        pos = SourcePosition(idx, lineno, idx - line_start + 1)
+        if char_class == CHAR_ID:
+            stop = ID_RUN.match(source, idx).end()
+            value = source[idx:stop]
+            yield Token(KEYWORDS.get(value, 'ID'), value, pos)
+        elif char_class == CHAR_DIGIT:
+            stop = DIGIT_RUN.match(source, idx).end()
+            yield Token('NUMBER', source[idx:stop], pos)
+        elif char_class == CHAR_PUNCT:
+            pair = source[idx:idx + 2]
+            name = DOUBLE_PUNCTUATION.get(pair)
+            if name is not None:
+                stop = idx + 2
+                yield Token(name, pair, pos)
+            else:
+                stop = idx + 1
+                yield Token(PUNCTUATION[c], c, pos)
+        elif char_class == CHAR_QUOTE:
+            match = STRING_RUN.match(source, idx)
+            if match is None:
+                raise LexingError(None, SourcePosition(idx, -1, -1))
+            stop = match.end()
+            yield Token('STRING', source[idx:stop], pos)
+        else:
+            raise LexingError(None, SourcePosition(idx, -1, -1))
+        idx = stop
+
+# =============================================================================
+# Reference lexer built by rply from token_rules, for checking lex() against.
+# =============================================================================
+
+_rply_lexer = None
+
+def get_rply_lexer():
+    # Built on first use rather than at import time.
+    global _rply_lexer
+    if _rply_lexer is None:
+        lg = LexerGenerator()
+        for token, rule in token_rules:
+            lg.add(token,rule)
+        lg.ignore('\s')
+        _rply_lexer = lg.build()
+    return _rply_lexer
+
+def rply_lex(source):
+    for token in get_rply_lexer().lex(source):
         yield token
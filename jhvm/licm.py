@@ -0,0 +1,235 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Loop-invariant code motion over a single Function, run before type
+# inference. An expression in a loop is invariant when no iteration can change
+# its value: it reads only variables the loop never assigns and, for field and
+# array reads, fields no FieldSetter in the loop writes and arrays only if
+# there is no ArraySetter in it. A loop making calls may write any field or
+# array, so none of its field and array reads are invariant.
+#
+# Every maximal invariant expression, other than a bare variable or constant,
+# is computed once into a new local ($licm0, $licm1, ...) and the loop reads
+# the local instead. Structurally equal expressions share the local.
+#
+# Field reads and arithmetic can fail, so an expression is only hoisted when
+# the first iteration is certain to evaluate it: it is in the condition, or
+# in the body up to the first statement that may return, and not in the body
+# of an if or a nested loop. The locals are computed once the loop's entry
+# test has passed (see ast.HoistedLoop), so a loop that never runs evaluates
+# nothing more than before. Once an expression is hoisted, every occurrence of
+# it in the loop reads the local, wherever it is.
+from __future__ import absolute_import
+
+import copy
+
+from jhvm import ast
+
+TEMP_PREFIX = '$licm'
+
+def hoist_invariants(function):
+    # Returns a copy of function with the invariant code of its loops
+    # hoisted, innermost loops first, or function itself if there was none.
+    # function is left as it was, as its repr is its cache key.
+    hoister = InvariantHoister()
+    body = hoister.statement(function.body)
+    if not hoister.temp_count:
+        return function
+    return ast.Function(function.name, function.arg_listbox, body)
+
+
+class LoopWrites(object):
+    # What the code of a loop may write.
+
+    def __init__(self, nodes):
+        self.variables = set()
+        self.fields = set()
+        self.arrays = False
+        self.calls = False
+        for node in nodes:
+            self.visit(node)
+
+    def visit(self, node):
+        if isinstance(node, ast.Assign):
+            self.variables.add(node.name)
+        elif isinstance(node, ast.FieldSetter):
+            self.fields.add(node.field)
+        elif isinstance(node, ast.ArraySetter):
+            self.arrays = True
+        elif isinstance(node, ast.Call):
+            self.calls = True
+        for child in child_nodes(node):
+            self.visit(child)
+
+    def is_invariant(self, exp):
+        if isinstance(exp, (ast.Number, ast.String)):
+            return True
+        elif isinstance(exp, ast.Var):
+            return exp.name not in self.variables
+        elif isinstance(exp, ast.BinExp):
+            return self.is_invariant(exp.lhs) and self.is_invariant(exp.rhs)
+        elif isinstance(exp, ast.FieldAccessor):
+            return (not self.calls and exp.field not in self.fields and
+                    self.is_invariant(exp.obj_var))
+        elif isinstance(exp, ast.ArrayAccessor):
+            return (not self.calls and not self.arrays and
+                    self.is_invariant(exp.array_var) and
+                    self.is_invariant(exp.index))
+        return False
+
+
+# Expressions worth computing into a local; any other invariant expression is
+# a variable or a constant, no dearer to evaluate than the local.
+HOISTABLE = (ast.BinExp, ast.FieldAccessor, ast.ArrayAccessor)
+
+class InvariantHoister(object):
+
+    def __init__(self):
+        self.temp_count = 0
+
+    def new_temp(self):
+        name = '%s%d' % (TEMP_PREFIX, self.temp_count)
+        self.temp_count += 1
+        return name
+
+    def statement(self, node):
+        # Returns node with its loops rewritten.
+        if isinstance(node, ast.ListBox):
+            return node.__class__([self.statement(item)
+                                   for item in node.items])
+        elif isinstance(node, ast.If):
+            return ast.If(node.cond, self.statement(node.then_body))
+        elif isinstance(node, ast.IfElse):
+            return ast.IfElse(node.cond, self.statement(node.then_body),
+                              self.statement(node.else_body))
+        elif isinstance(node, ast.While):
+            body = self.statement(node.body)
+            loop = self.loop(node.condition, [body])
+            return loop or ast.While(node.condition, body)
+        elif isinstance(node, ast.For):
+            body = self.statement(node.body)
+            loop = self.loop(node.cond, [body, node.step])
+            if loop is None:
+                return ast.For(node.start, node.cond, node.step, body)
+            return ast.Block([node.start, loop])
+        return node
+
+    def loop(self, cond, body):
+        # Returns the HoistedLoop for a loop, or None if nothing in it is
+        # worth hoisting.
+        writes = LoopWrites([cond] + body)
+        temps = {}
+        preheader = []
+        for exp in evaluated_first(cond, body):
+            self.collect(exp, writes, temps, preheader)
+        if not preheader:
+            return None
+
+        def replace(node):
+            if isinstance(node, HOISTABLE):
+                temp = temps.get(repr(node))
+                if temp is not None:
+                    return ast.Var(temp)
+            return map_children(node, replace)
+
+        return ast.HoistedLoop(cond, ast.Block(preheader), replace(cond),
+                               [replace(node) for node in body])
+
+    def collect(self, exp, writes, temps, preheader):
+        # Adds an assignment to a new local to preheader for every maximal
+        # invariant expression in exp not hoisted yet.
+        if isinstance(exp, HOISTABLE) and writes.is_invariant(exp):
+            key = repr(exp)
+            if key not in temps:
+                temps[key] = self.new_temp()
+                preheader.append(ast.Assign(temps[key], exp))
+            return
+        for operand in operands(exp):
+            self.collect(operand, writes, temps, preheader)
+
+
+def evaluated_first(cond, body):
+    # The expressions the first iteration of a loop is certain to evaluate,
+    # in order: its condition, tested on entry, and those of the statements
+    # in body up to the first that may return.
+    exps = [cond]
+    for node in body:
+        if not statement_exps(node, exps):
+            break
+    return exps
+
+def statement_exps(node, exps):
+    # Appends the expressions node evaluates whenever it runs to exps.
+    # Returns False if node may return, so that what follows may not run.
+    if isinstance(node, ast.ListBox):
+        for item in node.items:
+            if not statement_exps(item, exps):
+                return False
+        return True
+    elif isinstance(node, (ast.If, ast.IfElse)):
+        exps.append(node.cond)
+    elif isinstance(node, ast.While):
+        exps.append(node.condition)
+    elif isinstance(node, ast.For):
+        exps.extend([node.start, node.cond])
+    elif isinstance(node, ast.HoistedLoop):
+        exps.append(node.entry_cond)
+    elif isinstance(node, ast.Return):
+        exps.append(node.exp)
+        return False
+    else:
+        exps.append(node)
+        return True
+    return not may_return(node)
+
+def may_return(node):
+    if isinstance(node, ast.Return):
+        return True
+    return any([may_return(child) for child in child_nodes(node)
+                if isinstance(child, (ast.Statement, ast.ListBox, ast.For))])
+
+def operands(exp):
+    # The subexpressions of exp, in the order they are evaluated.
+    if isinstance(exp, ast.BinExp):
+        return [exp.lhs, exp.rhs]
+    elif isinstance(exp, ast.Assign):
+        return [exp.exp]
+    elif isinstance(exp, ast.Call):
+        return list(reversed(exp.args.items))
+    elif isinstance(exp, ast.FieldAccessor):
+        return [exp.obj_var]
+    elif isinstance(exp, ast.FieldSetter):
+        return [exp.obj_var, exp.exp]
+    elif isinstance(exp, ast.Obj):
+        return list(exp.values)
+    elif isinstance(exp, ast.ArrayLiteral):
+        return list(exp.items.items)
+    elif isinstance(exp, ast.NewArray):
+        return [exp.size]
+    elif isinstance(exp, ast.ArrayAccessor):
+        return [exp.array_var, exp.index]
+    elif isinstance(exp, ast.ArraySetter):
+        return [exp.array_var, exp.index, exp.exp]
+    return []
+
+def child_nodes(node):
+    children = []
+    for value in node.__dict__.values():
+        if isinstance(value, ast.Node):
+            children.append(value)
+        elif isinstance(value, list):
+            children.extend([item for item in value
+                             if isinstance(item, ast.Node)])
+    return children
+
+def map_children(node, function):
+    # Returns a shallow copy of node with function applied to its children.
+    clone = copy.copy(node)
+    for name, value in node.__dict__.items():
+        if isinstance(value, ast.Node):
+            setattr(clone, name, function(value))
+        elif isinstance(value, list):
+            setattr(clone, name, [function(item)
+                                  if isinstance(item, ast.Node) else item
+                                  for item in value])
+    return clone
@@ -0,0 +1,99 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Separate compilation of .jh files. Each file is compiled to an ObjectModule
+# holding its functions in relocatable form (see genast.CompiledFunction),
+# the names of the functions it exports and the names of those it calls but
+# doesn't define. link_modules() combines any number of modules into one
+# executable bytecode image, resolving every call through a single function
+# table.
+from __future__ import absolute_import
+
+from jhvm.genast import compile_functions, link, CompiledFunction
+from jhvm.timings import NO_TIMINGS
+
+OBJECT_MAGIC = ':__JHO__:'
+
+ENTRY_POINT = 'main'
+
+def compile_module(ast, name, compiler = None, timings = NO_TIMINGS):
+    # compiler may be an IncrementalCompiler, whose cached functions are
+    # reused.
+    if compiler is None:
+        functions = compile_functions(ast, timings)
+    else:
+        functions = compiler.compile_functions(ast)
+    return ObjectModule(name, functions)
+
+def link_modules(modules, entry = ENTRY_POINT):
+    # The VM starts at pc 0, so the entry function is laid out first, followed
+    # by every module's functions in the order given.
+    defined_in = {}
+    for module in modules:
+        for symbol in module.exports:
+            if symbol in defined_in:
+                raise ValueError('Function %s is defined in both %s and %s' %
+                                 (symbol, defined_in[symbol], module.name))
+            defined_in[symbol] = module.name
+
+    for module in modules:
+        for symbol in module.imports:
+            if symbol not in defined_in:
+                raise ValueError('Undefined function %s called from %s' %
+                                 (symbol, module.name))
+
+    if entry not in defined_in:
+        raise ValueError('No %s function to start from' % entry)
+
+    functions = []
+    for module in modules:
+        for function in module.functions:
+            if function.name == entry:
+                functions.insert(0, function)
+            else:
+                functions.append(function)
+    return link(functions)
+
+
+class ObjectModule(object):
+
+    def __init__(self, name, functions):
+        self.name = name
+        self.functions = functions
+        self.exports = [function.name for function in functions]
+
+        imports = set()
+        for function in functions:
+            for i in function.call_operands:
+                imports.add(function.code[i])
+        self.imports = sorted(imports.difference(self.exports))
+
+    def __eq__(self, other):
+        return self.__dict__ == other.__dict__
+
+    def dumps(self):
+        lines = [OBJECT_MAGIC, self.name,
+                 ','.join(self.exports), ','.join(self.imports)]
+        parts = ['%s\n' % line for line in lines]
+        for function in self.functions:
+            data = function.dumps()
+            parts.append('%s\n' % data.count('\n'))
+            parts.append(data)
+        return ''.join(parts)
+
+    @staticmethod
+    def loads(data):
+        lines = data.split('\n')
+        if lines[0] != OBJECT_MAGIC:
+            raise ValueError('Not a jhvm object module')
+        name = lines[1]
+        functions = []
+        i = 4
+        while i < len(lines) - 1:
+            line_count = int(lines[i])
+            function_lines = lines[i + 1:i + 1 + line_count]
+            functions.append(CompiledFunction.loads(
+                ''.join(['%s\n' % line for line in function_lines])))
+            i += line_count + 1
+        # exports and imports are derived from the functions again
+        return ObjectModule(name, functions)
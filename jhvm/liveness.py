@@ -0,0 +1,161 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Allocation of the local variable slots of a single function. Variables
+# whose values are never needed at the same time share a slot, so a frame
+# needs as many slots as the function has values live at once, not one per
+# variable name.
+#
+# Runs on the unassembled code of GeneratorContext, in which variables are
+# still VarRef operands. A variable is read by VAR and written by the ASSIGN
+# matching the CONST_INT that pushed its VarRef; the value assigned is
+# evaluated in between, so `x = y + 1` can give x the slot of y. Liveness is
+# the usual backward dataflow over the basic blocks of the code, and two
+# variables interfere when one is assigned while the other is live.
+# Slots are then handed out greedily, in order of first appearance, each
+# variable taking the lowest slot no variable it interferes with has.
+#
+# Parameters are pinned to the slots their arguments are passed in, and hold
+# their values from the start, as do variables read before being assigned,
+# which find their slots as they were when the frame was made.
+from __future__ import absolute_import
+
+from jhvm.assembler import Label, LabelDef, VarRef
+from jhvm.opcodes import HAS_ARGS, CONST_INT, ASSIGN, JUMP, RET, EXIT
+
+class Block(object):
+    # A basic block. accesses lists the variables the block reads and
+    # writes, in order, as ('use', name) and ('def', name).
+
+    def __init__(self):
+        self.accesses = []
+        self.successors = []
+        self.gen = set()
+        self.kill = set()
+        self.live_in = set()
+        self.live_out = set()
+
+    def summarize(self):
+        # gen: the variables read before being written, kill: those written.
+        for kind, name in self.accesses:
+            if kind == 'use' and name not in self.kill:
+                self.gen.add(name)
+            elif kind == 'def':
+                self.kill.add(name)
+
+
+def build_blocks(items):
+    # Splits items into basic blocks: at every label, and after every jump,
+    # RET and EXIT. Returns the blocks in code order, the entry block first.
+    blocks = [Block()]
+    label_blocks = {}
+    jumps = []
+    pending = []
+    i = 0
+    while i < len(items):
+        item = items[i]
+        block = blocks[-1]
+        if isinstance(item, LabelDef):
+            # A label after code touching no variables can share its block.
+            if block.accesses:
+                block = Block()
+                blocks.append(block)
+            label_blocks[item.label] = block
+            i += 1
+            continue
+        operand = None
+        if HAS_ARGS[int(item)]:
+            operand = items[i + 1]
+        i += int(HAS_ARGS[int(item)]) + 1
+        if isinstance(operand, VarRef):
+            if item == CONST_INT:
+                pending.append(operand.name)
+            else:
+                block.accesses.append(('use', operand.name))
+        elif item == ASSIGN:
+            block.accesses.append(('def', pending.pop()))
+        elif isinstance(operand, Label) or item in (RET, EXIT):
+            jumps.append((block, item, operand))
+            blocks.append(Block())
+
+    ends = dict([(block, (opcode, target))
+                 for block, opcode, target in jumps])
+    for index, block in enumerate(blocks):
+        next_blocks = blocks[index + 1:index + 2]
+        if block not in ends:
+            block.successors = next_blocks
+            continue
+        opcode, target = ends[block]
+        if opcode == JUMP:
+            block.successors = [label_blocks[target]]
+        elif opcode in (RET, EXIT):
+            block.successors = []
+        else:
+            block.successors = [label_blocks[target]] + next_blocks
+    return blocks
+
+def compute_liveness(blocks):
+    for block in blocks:
+        block.summarize()
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(blocks):
+            live_out = set()
+            for successor in block.successors:
+                live_out |= successor.live_in
+            live_in = block.gen | (live_out - block.kill)
+            if live_in != block.live_in:
+                changed = True
+            block.live_in = live_in
+            block.live_out = live_out
+
+def interference(blocks, names, params):
+    edges = dict([(name, set()) for name in names])
+
+    def interfere(a, b):
+        if a != b:
+            edges[a].add(b)
+            edges[b].add(a)
+
+    # The arguments are stored on entry.
+    for param in params:
+        for name in blocks[0].live_in:
+            interfere(param, name)
+    for block in blocks:
+        live = set(block.live_out)
+        for kind, name in reversed(block.accesses):
+            if kind == 'def':
+                for other in live:
+                    interfere(name, other)
+                live.discard(name)
+            else:
+                live.add(name)
+    return edges
+
+def allocate_slots(items, params):
+    # Returns a dict mapping every variable in items and every parameter to
+    # its slot, and the number of slots used.
+    names = []
+    seen = set()
+    for name in params + [item.name for item in items
+                          if isinstance(item, VarRef)]:
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    blocks = build_blocks(items)
+    compute_liveness(blocks)
+    edges = interference(blocks, names, params)
+
+    slots = {}
+    for index, param in enumerate(params):
+        slots.setdefault(param, index)
+    for name in names:
+        if name in slots:
+            continue
+        taken = set([slots[other] for other in edges[name] if other in slots])
+        slot = 0
+        while slot in taken:
+            slot += 1
+        slots[name] = slot
+    return slots, max([slot + 1 for slot in slots.values()] or [0])
@@ -127,6 +127,80 @@ START_ITER = "22"
 OP_CODES.append('START_ITER')
 HAS_ARGS.append(False)
 
+# Instantiates a new array of the given length filled with 0, pushes heap
+# reference on stack.
+# length -> arrayref
+NEW_ARRAY = "23"
+OP_CODES.append('NEW_ARRAY')
+HAS_ARGS.append(False)
+
+# Pops index and arrayref and pushes the array's element at that index
+# arrayref, index -> val
+ARRAY_GET = "24"
+OP_CODES.append('ARRAY_GET')
+HAS_ARGS.append(False)
+
+# Stores value in the array's element at index
+# arrayref, index, val ->
+ARRAY_SET = "25"
+OP_CODES.append('ARRAY_SET')
+HAS_ARGS.append(False)
+
+# Pops the item at the top, evaluates it, if true will jump back to the loop
+# header given as arg. Only used for the backward branch of a loop; jumping
+# to the header is where the JIT may start tracing.
+# val ->
+LOOP_IF_TRUE = "26"
+OP_CODES.append('LOOP_IF_TRUE')
+HAS_ARGS.append(True)
+
+# Instantiates a new object with the fields named in arg, a comma-separated
+# list, set to the values on the stack, and pushes its heap reference.
+# val1, ..., valN -> objectref
+NEW_WITH_SHAPE = "27"
+OP_CODES.append('NEW_WITH_SHAPE')
+HAS_ARGS.append(True)
+
+# Int-specialized forms of ADD, SUB, EQ and LT, emitted where type inference
+# (jhvm.typeinfer) has proved both operands to be ints. They skip the dynamic
+# dispatch of the generic opcodes.
+# int1, int2 -> result
+ADD_INT = "28"
+OP_CODES.append('ADD_INT')
+HAS_ARGS.append(False)
+
+SUB_INT = "29"
+OP_CODES.append('SUB_INT')
+HAS_ARGS.append(False)
+
+EQ_INT = "30"
+OP_CODES.append('EQ_INT')
+HAS_ARGS.append(False)
+
+LT_INT = "31"
+OP_CODES.append('LT_INT')
+HAS_ARGS.append(False)
+
+# LT_INT fused with the branch on its result: jumps to arg unless int1 < int2.
+# int1, int2 ->
+LT_INT_JUMP_IF_FALSE = "32"
+OP_CODES.append('LT_INT_JUMP_IF_FALSE')
+HAS_ARGS.append(True)
+
+# LT_INT fused with LOOP_IF_TRUE: jumps back to the loop header given as arg
+# if int1 < int2.
+# int1, int2 ->
+LT_INT_LOOP_IF_TRUE = "33"
+OP_CODES.append('LT_INT_LOOP_IF_TRUE')
+HAS_ARGS.append(True)
+
+# Marks the point a program's state is saved at to an image (see
+# jhvm/image.py), when the VM was asked to take one. Does nothing otherwise.
+# ->
+SNAPSHOT = "34"
+OP_CODES.append('SNAPSHOT')
+HAS_ARGS.append(False)
+
 BINOP_TO_OPCODE = {
     'ADD' : ADD,
     'SUB' : SUB,
@@ -134,4 +208,11 @@ BINOP_TO_OPCODE = {
     'LT' : LT
 }
 
+INT_OPCODES = {
+    ADD : ADD_INT,
+    SUB : SUB_INT,
+    EQ : EQ_INT,
+    LT : LT_INT
+}
+
 EOB = ':__EOB__:'
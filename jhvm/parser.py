@@ -1,10 +1,18 @@
 # vim: ai ts=4 sts=4 et sw=4
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
+import json
+import os
 from rply import ParserGenerator
+from rply.grammar import Grammar
+from rply.parser import LRParser
+from rply.parsergenerator import LRTable
 
 from jhvm.ast import *
+from jhvm.bcfile import unquote_str
+from jhvm.cache import default_cache_dir, write_atomic
 from jhvm.lexer import token_names, lex
+from jhvm.timings import NO_TIMINGS
 
 pg = ParserGenerator(
     token_names,
@@ -76,6 +84,10 @@ def fragment_exp(p):
 def statement_return(p):
     return Return(p[1])
 
+@pg.production('statement : SNAPSHOT')
+def statement_snapshot(p):
+    return Snapshot()
+
 @pg.production('statement : IF LPAREN exp RPAREN LBRACE block RBRACE')
 def statement_if(p):
     return If(p[2], p[5])
@@ -88,6 +100,10 @@ def statement_if_else(p):
 def statement_for(p):
     return For(p[2], p[4], p[6], p[9])
 
+@pg.production('statement : WHILE LPAREN exp RPAREN LBRACE block RBRACE')
+def statement_while(p):
+    return While(p[2], p[5])
+
 @pg.production('exp : ID DOT ID')
 def exp_field_accessor(p):
     return FieldAccessor(Var(p[0].getstr()), p[2].getstr())
@@ -100,6 +116,10 @@ def exp_field_setter(p):
 def exp_number(p):
     return Number(int(p[0].getstr()))
 
+@pg.production('exp : STRING')
+def exp_string(p):
+    return String(unquote_str(p[0].getstr()))
+
 @pg.production('exp : ID')
 def exp_identifier(p):
     return Var(p[0].getstr())
@@ -140,6 +160,43 @@ def arg(p):
 def new_obj(p):
     return Obj([],[])
 
+@pg.production('exp : OBJECT LPAREN field_inits RPAREN')
+def new_obj_with_fields(p):
+    fields = [field for field, value in p[2]]
+    values = [value for field, value in p[2]]
+    return Obj(fields, values)
+
+@pg.production('field_inits : field_inits COMMA field_init')
+def field_inits(p):
+    return p[0] + [p[2]]
+
+@pg.production('field_inits : field_init')
+def field_inits_single(p):
+    return [p[0]]
+
+@pg.production('field_init : ID ASSIGN exp')
+def field_init(p):
+    return (p[0].getstr(), p[2])
+
+@pg.production('exp : LSQUARE non_empty_arg_list RSQUARE')
+@pg.production('exp : LSQUARE empty RSQUARE')
+def exp_array_literal(p):
+    if p[1] is None:
+        return ArrayLiteral(ListBox([]))
+    return ArrayLiteral(p[1])
+
+@pg.production('exp : ARRAY LPAREN exp RPAREN')
+def exp_new_array(p):
+    return NewArray(p[2])
+
+@pg.production('exp : ID LSQUARE exp RSQUARE')
+def exp_array_accessor(p):
+    return ArrayAccessor(Var(p[0].getstr()), p[2])
+
+@pg.production('exp : ID LSQUARE exp RSQUARE ASSIGN exp')
+def exp_array_setter(p):
+    return ArraySetter(Var(p[0].getstr()), p[2], p[5])
+
 @pg.production('exp : exp bin_operators exp')
 def binop(p):
     return BinExp(p[1], p[0], p[2])
@@ -164,7 +221,60 @@ def p_empty(p):
 def error_handler(token):
     raise ValueError("Illegal use of  %s. Line: %s" % (token.gettokentype(), token.getsourcepos()))
 
-parser = pg.build()
-
-def parse_input(source):
-    return parser.parse(lex(source))
+def _build_grammar():
+    # The same steps pg.build() takes before it generates the LR tables.
+    g = Grammar(pg.tokens)
+    for level, (assoc, terms) in enumerate(pg.precedence, 1):
+        for term in terms:
+            g.set_precedence(term, assoc, level)
+    for prod_name, syms, func, precedence in pg.productions:
+        g.add_production(prod_name, syms, func, precedence)
+    g.set_start()
+    g.build_lritems()
+    g.compute_first()
+    g.compute_follow()
+    return g
+
+def build_parser(cache_dir = None):
+    # Generating the LALR tables is the slow part of building the parser, so
+    # they are stored in the cache dir under the grammar's hash and only
+    # regenerated when the grammar changes.
+    g = _build_grammar()
+    path = os.path.join(cache_dir or default_cache_dir(), 'parser-%s-%s.json' %
+                        (pg.VERSION, pg.compute_grammar_hash(g)))
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if pg.data_is_valid(g, data):
+            return LRParser(LRTable.from_cache(g, data), pg.error_handler)
+    except (IOError, ValueError, KeyError):
+        pass
+
+    # pg.build() also warns about conflicts, which is worth seeing whenever
+    # the grammar changes.
+    parser = pg.build()
+    try:
+        write_atomic(path, json.dumps(pg.serialize_table(parser.lr_table)))
+    except (IOError, OSError):
+        # The tables only save time; compiling goes on without them.
+        pass
+    return parser
+
+_parser = None
+
+def get_parser():
+    global _parser
+    if _parser is None:
+        _parser = build_parser()
+    return _parser
+
+def parse_input(source, timings = NO_TIMINGS):
+    if timings is NO_TIMINGS:
+        return get_parser().parse(lex(source))
+    # Timed, the source is lexed up front so that lexing and parsing are
+    # measured apart.
+    parser = get_parser()
+    with timings.stage('lex'):
+        tokens = list(lex(source))
+    with timings.stage('parse'):
+        return parser.parse(iter(tokens))
@@ -0,0 +1,85 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Memory profiler for the VM. When a VirtualMachine is given a MemoryProfiler
+# it records every NEW and NEW_ARRAY by pc and every map transition taken by
+# an object, and report() adds what is still on the heap: the number of
+# objects per map and the arrays by storage strategy. It also includes the
+# map tree's counters of objects that switched to dictionary mode.
+#
+# Nothing is ever freed from the heap, so every allocated object is counted
+# as live. RPython.
+from __future__ import absolute_import
+
+from jhvm.opcodes import OP_CODES
+from jhvm.vm import Obj, Array, IntArrayStorage, MAP_TREE
+
+from rpython.rlib.listsort import make_timsort_class
+
+def _count_lt(a, b):
+    # Most frequent first, ties by name.
+    count_a, name_a = a
+    count_b, name_b = b
+    return count_a > count_b or (count_a == count_b and name_a < name_b)
+
+CountSort = make_timsort_class(lt=_count_lt)
+
+def sorted_counts(counts):
+    pairs = [(count, name) for name, count in counts.items()]
+    CountSort(pairs).sort()
+    return pairs
+
+def pad_left(text, width):
+    # RPython's string formatting has no field widths.
+    if len(text) >= width:
+        return text
+    return ' ' * (width - len(text)) + text
+
+class MemoryProfiler(object):
+
+    def __init__(self):
+        self.allocations = {}      # "pc N OPCODE" -> count
+        self.transitions = {}      # "old map -> new map" -> count
+        self.peak_heap_size = 0
+
+    def record_allocation(self, pc, instr, heap_size):
+        site = 'pc %d %s' % (pc, OP_CODES[int(instr)])
+        self.allocations[site] = self.allocations.get(site, 0) + 1
+        if heap_size > self.peak_heap_size:
+            self.peak_heap_size = heap_size
+
+    def record_transition(self, old_map, new_map):
+        key = '%s -> %s' % (old_map.describe(), new_map.describe())
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+
+    def live_objects(self, heap):
+        objects_by_map = {}
+        arrays_by_storage = {}
+        for obj in heap:
+            if isinstance(obj, Obj):
+                key = obj.map.describe()
+                objects_by_map[key] = objects_by_map.get(key, 0) + 1
+            elif isinstance(obj, Array):
+                if isinstance(obj.storage, IntArrayStorage):
+                    key = 'int array'
+                else:
+                    key = 'boxed array'
+                arrays_by_storage[key] = arrays_by_storage.get(key, 0) + 1
+        return objects_by_map, arrays_by_storage
+
+    def report(self, heap, map_tree = MAP_TREE):
+        objects_by_map, arrays_by_storage = self.live_objects(heap)
+        lines = ['Memory profile',
+                 'peak heap size: %d' % self.peak_heap_size]
+        lines.extend(map_tree.stats())
+        lines.append('')
+        sections = [('Allocations by site', self.allocations),
+                    ('Live objects by map', objects_by_map),
+                    ('Live arrays by storage', arrays_by_storage),
+                    ('Map transitions', self.transitions)]
+        for title, counts in sections:
+            lines.append('%s:' % title)
+            for count, name in sorted_counts(counts):
+                lines.append(pad_left(str(count), 10) + '  ' + name)
+            lines.append('')
+        return '\n'.join(lines)
@@ -0,0 +1,171 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Server mode, for running many short programs without paying for process
+# startup and a cold JIT on every run.
+#
+# serve() listens on a Unix socket and forks a number of worker processes,
+# which all accept connections on it. A connection carries one request: a
+# line of space-separated int arguments for main, followed by the contents of
+# a bytecode file. The client then shuts down its side, and the worker runs
+# the program on a fresh VirtualMachine, replies with a single line,
+# "ok <result>" or "error <message>", and closes the connection.
+#
+# Each worker keeps the programs it has loaded in a ProgramCache, keyed on
+# the bytecode file's contents. Running the same program again reuses the
+# same bytecode list, which is a green of the jitdriver, so the machine code
+# the JIT compiled for the earlier runs is used straight away.
+#
+# Each program also has a map tree of its own, which its runs share. The
+# maps its objects get are then the same from run to run, as that machine
+# code expects, while the shapes of other programs neither use up the tree's
+# limits nor send its objects into dictionary mode.
+#
+# Everything up to run_on_server() is RPython.
+from __future__ import absolute_import
+
+import os
+
+from jhvm.bcfile import loads
+from jhvm.vm import VirtualMachine, MapTree
+
+from rpython.rlib.rsocket import (RSocket, UNIXAddress, AF_UNIX, SOCK_STREAM,
+                                  SocketError, make_socket)
+
+DEFAULT_WORKERS = 4
+
+# Programs a worker keeps loaded. The cache is emptied when it's full.
+MAX_PROGRAMS = 256
+
+BACKLOG = 128
+
+RECV_SIZE = 65536
+
+class Program(object):
+    def __init__(self, bytecode, functions):
+        self.bytecode = bytecode
+        self.functions = functions
+        self.map_tree = MapTree()
+
+class ProgramCache(object):
+
+    def __init__(self, max_programs = MAX_PROGRAMS):
+        self.max_programs = max_programs
+        self.programs = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, data):
+        program = self.programs.get(data, None)
+        if program is not None:
+            self.hits += 1
+            return program
+        self.misses += 1
+        if len(self.programs) >= self.max_programs:
+            self.programs.clear()
+        bytecode, functions = loads(data)
+        program = Program(bytecode, functions)
+        self.programs[data] = program
+        return program
+
+def parse_request(request):
+    # Returns the int arguments and the bytecode file contents.
+    end = request.find('\n')
+    if end < 0:
+        raise ValueError()
+    args = []
+    for arg in request[:end].split(' '):
+        if arg:
+            args.append(int(arg))
+    return args, request[end + 1:]
+
+def handle_request(cache, request):
+    try:
+        args, data = parse_request(request)
+    except ValueError:
+        return 'error malformed request\n'
+    program = cache.get(data)
+    if not program.bytecode or not program.functions:
+        return 'error no program\n'
+    machine = VirtualMachine(program.bytecode, program.functions, args,
+                             map_tree = program.map_tree)
+    try:
+        res = machine.interp(program.bytecode)
+    except Exception:
+        return 'error program failed\n'
+    return 'ok %s\n' % res.repr()
+
+def read_request(conn):
+    parts = []
+    while True:
+        data = conn.recv(RECV_SIZE)
+        if not data:
+            break
+        parts.append(data)
+    return ''.join(parts)
+
+def worker_loop(sock):
+    cache = ProgramCache()
+    while True:
+        try:
+            fd, _ = sock.accept()
+        except SocketError:
+            continue
+        conn = make_socket(fd, AF_UNIX, SOCK_STREAM, 0)
+        try:
+            conn.sendall(handle_request(cache, read_request(conn)))
+        except SocketError:
+            pass
+        conn.close()
+
+def serve(path, workers = DEFAULT_WORKERS):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+    sock = RSocket(AF_UNIX, SOCK_STREAM)
+    sock.bind(UNIXAddress(path))
+    sock.listen(BACKLOG)
+
+    # Workers that die are replaced, each with an empty cache.
+    children = 0
+    while True:
+        while children < workers:
+            if os.fork() == 0:
+                worker_loop(sock)
+                os._exit(0)
+            children += 1
+        os.waitpid(-1, 0)
+        children -= 1
+
+# =============================================================================
+# Client side. Not RPython.
+# =============================================================================
+
+class ServerError(Exception):
+    pass
+
+def format_request(data, args = ()):
+    return '%s\n%s' % (' '.join([str(int(arg)) for arg in args]), data)
+
+def run_on_server(path, data, args = ()):
+    # Runs a compiled program on the server listening at path and returns the
+    # repr of its result.
+    import socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(format_request(data, args))
+        sock.shutdown(socket.SHUT_WR)
+        parts = []
+        while True:
+            part = sock.recv(RECV_SIZE)
+            if not part:
+                break
+            parts.append(part)
+    finally:
+        sock.close()
+    status, _, message = ''.join(parts).rstrip('\n').partition(' ')
+    if status != 'ok':
+        raise ServerError(message or 'no response')
+    return message
@@ -0,0 +1,181 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Generator of synthetic jh programs of controlled size and shape, for load
+# and scaling benchmarks of the toolchain and the VM.
+#
+# A program is a main function calling functions f_0 ... f_<n-1>. Every
+# function starts from its arguments, builds an object literal of one of a
+# number of object shapes, calls a function one level further down the call
+# graph, and then runs nested for loops whose body is an if/else over random
+# arithmetic expressions. Functions are assigned call levels round robin and
+# only call functions on the next level, so the call graph is acyclic and no
+# deeper than call_depth, and the running time stays linear in the number of
+# functions.
+#
+# The same random choices are written out a second time as Python, which is
+# run to give the result main is expected to return. Programs only depend on
+# the spec, seed included.
+from __future__ import absolute_import
+
+import random
+
+# Loop variables, one per level of nesting.
+LOOP_VARS = 'ijklmn'
+
+class ProgramSpec(object):
+
+    def __init__(self, functions = 8, loop_depth = 2, expr_depth = 3,
+                 shapes = 4, call_depth = 3, iterations = 5, seed = 0):
+        self.functions = functions
+        self.loop_depth = loop_depth
+        self.expr_depth = expr_depth
+        self.shapes = shapes
+        self.call_depth = call_depth
+        self.iterations = iterations
+        self.seed = seed
+        if loop_depth > len(LOOP_VARS):
+            raise ValueError('loop_depth can be at most %d' % len(LOOP_VARS))
+        if functions < 1 or shapes < 1 or iterations < 1:
+            raise ValueError('functions, shapes and iterations must be '
+                             'positive')
+
+    def __repr__(self):
+        return ('ProgramSpec(functions=%d, loop_depth=%d, expr_depth=%d, '
+                'shapes=%d, call_depth=%d, iterations=%d, seed=%d)' %
+                (self.functions, self.loop_depth, self.expr_depth,
+                 self.shapes, self.call_depth, self.iterations, self.seed))
+
+
+class SyntheticProgram(object):
+
+    def __init__(self, spec, source, python_source, expected):
+        self.spec = spec
+        self.source = source
+        self.python_source = python_source
+        self.expected = expected
+
+
+def generate_program(spec):
+    generator = ProgramGenerator(spec)
+    source, python_source = generator.generate()
+    namespace = {}
+    exec python_source in namespace
+    return SyntheticProgram(spec, source, python_source, namespace['main']())
+
+
+class ProgramGenerator(object):
+    # Writes the jh program and its Python twin side by side.
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+        self.jh = []
+        self.py = []
+        # Object shapes: every shape has an x field, which the loops update,
+        # and up to three fields of its own, all set by a literal.
+        self.shapes = []
+        for s in range(spec.shapes):
+            self.shapes.append(['x'] + ['s%d_%d' % (s, k)
+                                        for k in range(s % 4)])
+
+    def level(self, index):
+        return index % (self.spec.call_depth + 1)
+
+    def generate(self):
+        self.emit_main()
+        for index in range(self.spec.functions):
+            self.emit_function(index)
+        return ''.join(self.jh), ''.join(self.py)
+
+    def write(self, indent, jh, py = None):
+        if jh is not None:
+            self.jh.append('%s%s\n' % ('    ' * indent, jh))
+        if py is not None:
+            self.py.append('%s%s\n' % ('    ' * indent, py))
+
+    def emit_main(self):
+        callees = [index for index in range(self.spec.functions)
+                   if self.level(index) == 0]
+        self.write(0, 'fn main() {', 'def main():')
+        self.write(1, 's = 0;', 's = 0')
+        for index in callees:
+            a, b = self.rng.randint(0, 9), self.rng.randint(0, 9)
+            self.write(1, 's = (s + f_%d(%d, %d));' % (index, a, b),
+                       's = (s + f_%d(%d, %d))' % (index, a, b))
+        self.write(1, 'return s', 'return s')
+        self.write(0, '}', '')
+        self.write(0, '', None)
+
+    def emit_function(self, index):
+        rng = self.rng
+        self.write(0, 'fn f_%d(a, b) {' % index, 'def f_%d(a, b):' % index)
+        start = rng.randint(0, 9)
+        self.write(1, 't = (a + %d);' % start, 't = (a + %d)' % start)
+
+        fields = rng.choice(self.shapes)
+        values = [rng.randint(0, 9) for _ in fields]
+        self.write(1, 'o = object(%s);' % ', '.join(
+                       ['%s = %d' % pair for pair in zip(fields, values)]),
+                   'o = {%s}' % ', '.join(
+                       ["'%s' : %d" % pair for pair in zip(fields, values)]))
+
+        callees = [callee for callee in range(self.spec.functions)
+                   if self.level(callee) == self.level(index) + 1]
+        if callees:
+            call = 'f_%d(%d, b)' % (rng.choice(callees), rng.randint(0, 9))
+            self.write(1, 'c = %s;' % call, 'c = %s' % call)
+        else:
+            self.write(1, 'c = 0;', 'c = 0')
+
+        loop_vars = []
+        for depth in range(self.spec.loop_depth):
+            var = LOOP_VARS[depth]
+            bound = rng.randint(1, self.spec.iterations)
+            self.write(1 + depth,
+                       'for(%s = 0; %s < %d; %s = %s + 1) {' %
+                       (var, var, bound, var, var),
+                       'for %s in range(%d):' % (var, bound))
+            loop_vars.append(var)
+        self.emit_body(1 + self.spec.loop_depth, ['a', 'b'] + loop_vars,
+                       fields, ';' if not loop_vars else '')
+        for depth in reversed(range(self.spec.loop_depth)):
+            self.write(1 + depth, '};' if depth == 0 else '}', None)
+
+        self.write(1, 'return ((t + o.x) + c)', "return ((t + o['x']) + c)")
+        self.write(0, '}', '')
+        self.write(0, '', None)
+
+    def emit_body(self, indent, variables, fields, end):
+        left = self.expression(self.spec.expr_depth, variables, fields)
+        right = self.expression(self.spec.expr_depth, variables, fields)
+        step = self.expression(self.spec.expr_depth, variables, fields)
+        self.write(indent, 'if(%s < %s) {' % (left[0], right[0]),
+                   'if %s < %s:' % (left[1], right[1]))
+        self.write(indent + 1, 't = (t + %s)' % step[0],
+                   't = (t + %s)' % step[1])
+        self.write(indent, '} else {', 'else:')
+        self.write(indent + 1, 't = (t - 1)', 't = (t - 1)')
+        self.write(indent, '};', None)
+        self.write(indent, 'o.x = (o.x + 1)%s' % end, "o['x'] = (o['x'] + 1)")
+
+    def expression(self, depth, variables, fields):
+        # Returns the expression in jh and in Python. Leaves are constants,
+        # arguments, loop variables and fields of o, but never t, so values
+        # only grow polynomially with the loop bounds.
+        rng = self.rng
+        if depth == 0 or rng.random() < 0.2:
+            choice = rng.randint(0, 2)
+            if choice == 0:
+                value = str(rng.randint(0, 9))
+                return value, value
+            elif choice == 1:
+                var = rng.choice(variables)
+                return var, var
+            field = rng.choice(fields)
+            return 'o.%s' % field, "o['%s']" % field
+        left = self.expression(depth - 1, variables, fields)
+        right = self.expression(depth - 1, variables, fields)
+        op = rng.choice('+-')
+        return ('(%s %s %s)' % (left[0], op, right[0]),
+                '(%s %s %s)' % (left[1], op, right[1]))
@@ -0,0 +1,79 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Per-stage timing of the compiler pipeline. The stages of a compilation are
+# run inside `with timings.stage(name):` blocks; a stage run more than once,
+# e.g. once per module, adds up.
+#
+# Besides wall time, every stage records the process's peak resident set size
+# when it finished and how much the stage raised it. The peak only ever grows,
+# so a stage that raised it by nothing allocated no more than earlier stages
+# had already needed.
+from __future__ import absolute_import
+
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+def peak_rss():
+    # In bytes. Linux reports kilobytes, macOS bytes.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageTiming(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.runs = 0
+        self.peak_rss = 0
+        self.rss_growth = 0
+
+
+class Timings(object):
+
+    def __init__(self):
+        self.stages = []
+        self.by_name = {}
+
+    @contextmanager
+    def stage(self, name):
+        timing = self.by_name.get(name)
+        if timing is None:
+            timing = self.by_name[name] = StageTiming(name)
+            self.stages.append(timing)
+        rss_before = peak_rss()
+        start = time.time()
+        try:
+            yield
+        finally:
+            timing.seconds += time.time() - start
+            timing.runs += 1
+            timing.peak_rss = peak_rss()
+            timing.rss_growth += timing.peak_rss - rss_before
+
+    def total(self):
+        return sum([timing.seconds for timing in self.stages])
+
+    def report(self):
+        total = self.total() or 1e-9
+        lines = ['%-16s %10s %6s %12s %12s' % ('stage', 'time', '%',
+                                               'peak RSS', 'RSS growth')]
+        for timing in self.stages:
+            lines.append('%-16s %9.4fs %5.1f%% %10.1fMB %10.1fMB' % (
+                timing.name, timing.seconds, 100 * timing.seconds / total,
+                timing.peak_rss / 1048576.0, timing.rss_growth / 1048576.0))
+        lines.append('%-16s %9.4fs' % ('total', self.total()))
+        return '\n'.join(lines)
+
+
+class NoTimings(object):
+    # Stands in for Timings when nothing is being measured.
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+NO_TIMINGS = NoTimings()
@@ -0,0 +1,172 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Lowers a jhvm Program AST to Python source and compiles every Function into
+# a native Python function, so that jh code can be embedded in and run by a
+# plain CPython or PyPy host without the bytecode VM.
+#
+# Variables become Python locals, For loops become while loops and objects
+# are JhObject instances, a dict keyed by field name. Arrays are Python lists.
+# Results are plain Python values. Unlike the VM, ints do not wrap around on
+# overflow and negative array indexes count from the end. Not RPython.
+from __future__ import absolute_import
+
+from jhvm import ast
+from jhvm.opcodes import ADD, SUB, EQ, LT
+
+OPCODE_TO_PY_OP = {
+    ADD : '+',
+    SUB : '-',
+    EQ : '==',
+    LT : '<',
+}
+
+INDENT = '    '
+
+class JhObject(dict):
+    __slots__ = ()
+
+    def __missing__(self, field_name):
+        # Mirrors Obj.get_field in the VM.
+        raise AttributeError(field_name)
+
+def transpile(program):
+    gen = PyGenerator()
+    gen.program(program)
+    return gen.get_source()
+
+def compile_program(program, filename = '<jh>'):
+    source = transpile(program)
+    namespace = {'JhObject' : JhObject}
+    exec compile(source, filename, 'exec') in namespace
+    return PyProgram(program, namespace, source)
+
+def run_program(program, *args):
+    return compile_program(program).main(*args)
+
+def py_name_for_function(name):
+    return 'f_' + name
+
+def py_name_for_var(name):
+    return 'v_' + name
+
+class PyProgram(object):
+
+    def __init__(self, program, namespace, source):
+        self.source = source
+        self.functions = {}
+        for function in program.functions.items:
+            py_name = py_name_for_function(function.name)
+            self.functions[function.name] = namespace[py_name]
+        # As in the VM, the first function in the file is the entry point.
+        self.main = self.functions[program.functions.items[0].name]
+
+class PyGenerator(object):
+
+    def __init__(self):
+        self.lines = []
+        self.depth = 0
+
+    def get_source(self):
+        return '\n'.join(self.lines) + '\n'
+
+    def emit(self, line):
+        self.lines.append(INDENT * self.depth + line)
+
+    def program(self, program):
+        for function in program.functions.items:
+            self.function(function)
+
+    def function(self, function):
+        params = [py_name_for_var(arg.name) for arg in function.arg_listbox.items]
+        self.emit('def %s(%s):' % (py_name_for_function(function.name),
+                                   ', '.join(params)))
+        self.suite(function.body)
+        self.emit('')
+
+    def suite(self, block):
+        self.depth += 1
+        start = len(self.lines)
+        for item in block.items:
+            self.statement(item)
+        if len(self.lines) == start:
+            self.emit('pass')
+        self.depth -= 1
+
+    # =========================================================================
+    # Statements
+    # =========================================================================
+
+    def statement(self, node):
+        if isinstance(node, ast.Return):
+            self.emit('return %s' % self.exp(node.exp))
+        elif isinstance(node, ast.IfElse):
+            self.emit('if %s:' % self.exp(node.cond))
+            self.suite(node.then_body)
+            self.emit('else:')
+            self.suite(node.else_body)
+        elif isinstance(node, ast.If):
+            self.emit('if %s:' % self.exp(node.cond))
+            self.suite(node.then_body)
+        elif isinstance(node, ast.For):
+            self.statement(node.start)
+            self.emit('while %s:' % self.exp(node.cond))
+            self.suite(ast.Block(node.body.items + [node.step]))
+        elif isinstance(node, ast.While):
+            self.emit('while %s:' % self.exp(node.condition))
+            self.suite(node.body)
+        elif isinstance(node, ast.Assign):
+            self.emit('%s = %s' % (py_name_for_var(node.name),
+                                   self.exp(node.exp)))
+        elif isinstance(node, ast.FieldSetter):
+            self.emit('%s[%r] = %s' % (self.exp(node.obj_var), node.field,
+                                       self.exp(node.exp)))
+        elif isinstance(node, ast.ArraySetter):
+            self.emit('%s[%s] = %s' % (self.exp(node.array_var),
+                                       self.exp(node.index),
+                                       self.exp(node.exp)))
+        elif isinstance(node, ast.ListBox):
+            for item in node.items:
+                self.statement(item)
+        elif isinstance(node, ast.Snapshot):
+            self.emit('pass')
+        else:
+            self.emit(self.exp(node))
+
+    # =========================================================================
+    # Expressions
+    # =========================================================================
+
+    def exp(self, node):
+        if isinstance(node, (ast.Number, ast.String)):
+            return repr(node.value)
+        elif isinstance(node, ast.Var):
+            return py_name_for_var(node.name)
+        elif isinstance(node, ast.BinExp):
+            return '(%s %s %s)' % (self.exp(node.lhs),
+                                   OPCODE_TO_PY_OP[node.op.op_code],
+                                   self.exp(node.rhs))
+        elif isinstance(node, ast.Call):
+            args = [self.exp(arg) for arg in node.args.items]
+            return '%s(%s)' % (py_name_for_function(node.name), ', '.join(args))
+        elif isinstance(node, ast.FieldAccessor):
+            return '%s[%r]' % (self.exp(node.obj_var), node.field)
+        elif isinstance(node, ast.Obj):
+            # A list of pairs, as the values are evaluated in order.
+            fields = ['(%r, %s)' % (field, self.exp(value))
+                      for field, value in zip(node.fields, node.values)]
+            if not fields:
+                return 'JhObject()'
+            return 'JhObject([%s])' % ', '.join(fields)
+        elif isinstance(node, ast.ArrayLiteral):
+            return '[%s]' % ', '.join([self.exp(item)
+                                       for item in node.items.items])
+        elif isinstance(node, ast.NewArray):
+            return '[0] * %s' % self.exp(node.size)
+        elif isinstance(node, ast.ArrayAccessor):
+            return '%s[%s]' % (self.exp(node.array_var), self.exp(node.index))
+        elif isinstance(node, (ast.Assign, ast.FieldSetter, ast.ArraySetter)):
+            # These leave nothing on the VM's stack either.
+            raise ValueError('%s cannot be used as a value' %
+                             node.__class__.__name__)
+        raise NotImplementedError(node.__class__.__name__)
@@ -0,0 +1,189 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Static type inference over a single Function, run before code generation.
+# Its only client so far is BinExp, which emits the int-specialized opcodes
+# (ADD_INT, LT_INT_JUMP_IF_FALSE, ...) where both operands are proved to be
+# ints, and the generic ones everywhere else.
+#
+# The analysis is flow sensitive: it walks the function's body with an
+# environment mapping every variable to the type of its current value. At an
+# if, the environments of the branches are joined; a loop body is walked
+# again until the environment at the loop header stops changing. As the
+# lattice is only three levels deep, that takes a couple of passes.
+#
+# Nothing is known about parameters, call results, fields and array elements.
+# Object and array references are ints in the VM, but are kept apart as REF,
+# so only values computed from int literals count as ints. Functions are
+# analysed one at a time, which keeps them separately compilable and
+# cacheable.
+from __future__ import absolute_import
+
+from jhvm import ast
+from jhvm.opcodes import ADD, SUB, EQ, LT
+
+# The lattice: BOTTOM below the value types, UNKNOWN above them.
+BOTTOM = 'bottom'       # no value yet
+INT = 'int'
+BOOL = 'bool'
+STR = 'str'
+REF = 'ref'             # heap reference to an object or array
+UNKNOWN = 'unknown'
+
+def join(a, b):
+    if a == b or b == BOTTOM:
+        return a
+    if a == BOTTOM:
+        return b
+    return UNKNOWN
+
+def join_envs(a, b):
+    env = dict(a)
+    for name, value_type in b.items():
+        env[name] = join(env.get(name, BOTTOM), value_type)
+    return env
+
+
+class TypeInfo(object):
+    # The result of inferring a function's types: the types of the operands
+    # of every BinExp, joined over every time the analysis reached it.
+
+    def __init__(self):
+        self.operand_types = {}
+
+    def record(self, node, lhs_type, rhs_type):
+        # Keyed on identity, with the node kept alive alongside.
+        _, old_lhs, old_rhs = self.operand_types.get(id(node),
+                                                     (node, BOTTOM, BOTTOM))
+        self.operand_types[id(node)] = (node, join(old_lhs, lhs_type),
+                                        join(old_rhs, rhs_type))
+
+    def operands(self, node):
+        _, lhs_type, rhs_type = self.operand_types.get(id(node),
+                                                       (node, UNKNOWN, UNKNOWN))
+        return lhs_type, rhs_type
+
+    def int_operands(self, node):
+        return self.operands(node) == (INT, INT)
+
+
+def infer_types(function):
+    info = TypeInfo()
+    env = dict([(arg.name, UNKNOWN) for arg in function.arg_listbox.items])
+    TypeInference(info).statement(function.body, env)
+    return info
+
+
+class TypeInference(object):
+
+    def __init__(self, info):
+        self.info = info
+
+    def statement(self, node, env):
+        # Returns the environment after node.
+        if isinstance(node, ast.ListBox):
+            for item in node.items:
+                env = self.statement(item, env)
+            return env
+        elif isinstance(node, ast.If):
+            self.exp(node.cond, env)
+            return join_envs(env, self.statement(node.then_body, dict(env)))
+        elif isinstance(node, ast.IfElse):
+            self.exp(node.cond, env)
+            return join_envs(self.statement(node.then_body, dict(env)),
+                             self.statement(node.else_body, dict(env)))
+        elif isinstance(node, ast.While):
+            return self.loop(node.condition, [node.body], env)
+        elif isinstance(node, ast.For):
+            env = dict(env)
+            self.exp(node.start, env)
+            return self.loop(node.cond, [node.body, node.step], env)
+        elif isinstance(node, ast.HoistedLoop):
+            env = dict(env)
+            self.exp(node.entry_cond, env)
+            env = self.statement(node.preheader, env)
+            return self.loop(node.cond, node.body, env)
+        elif isinstance(node, ast.Return):
+            self.exp(node.exp, env)
+            return env
+        env = dict(env)
+        self.exp(node, env)
+        return env
+
+    def loop(self, cond, body, env):
+        # The environment at the header is the join of the one on entry and
+        # the one at the end of the body, so walk the body until it is
+        # stable.
+        env = dict(env)
+        self.exp(cond, env)
+        while True:
+            body_env = dict(env)
+            for node in body:
+                body_env = self.statement(node, body_env)
+            self.exp(cond, body_env)
+            header_env = join_envs(env, body_env)
+            if header_env == env:
+                return env
+            env = header_env
+
+    def exp(self, node, env):
+        # Returns the type of node's value. Assignments update env.
+        if isinstance(node, ast.Number):
+            return INT
+        elif isinstance(node, ast.String):
+            return STR
+        elif isinstance(node, ast.Var):
+            return env.get(node.name, BOTTOM)
+        elif isinstance(node, ast.Assign):
+            env[node.name] = self.exp(node.exp, env)
+            return BOTTOM
+        elif isinstance(node, ast.BinExp):
+            lhs_type = self.exp(node.lhs, env)
+            rhs_type = self.exp(node.rhs, env)
+            self.info.record(node, lhs_type, rhs_type)
+            op_code = node.op.op_code
+            if op_code in (EQ, LT):
+                return BOOL
+            if lhs_type == rhs_type == INT:
+                return INT
+            if op_code == ADD and lhs_type == rhs_type == STR:
+                return STR
+            return UNKNOWN
+        elif isinstance(node, ast.Call):
+            for arg in node.args.items:
+                self.exp(arg, env)
+            return UNKNOWN
+        elif isinstance(node, ast.FieldAccessor):
+            self.exp(node.obj_var, env)
+            return UNKNOWN
+        elif isinstance(node, ast.FieldSetter):
+            self.exp(node.obj_var, env)
+            self.exp(node.exp, env)
+            return BOTTOM
+        elif isinstance(node, ast.Obj):
+            for value in node.values:
+                self.exp(value, env)
+            return REF
+        elif isinstance(node, ast.ArrayLiteral):
+            for item in node.items.items:
+                self.exp(item, env)
+            return REF
+        elif isinstance(node, ast.NewArray):
+            self.exp(node.size, env)
+            return REF
+        elif isinstance(node, ast.ArrayAccessor):
+            self.exp(node.array_var, env)
+            self.exp(node.index, env)
+            return UNKNOWN
+        elif isinstance(node, ast.ArraySetter):
+            self.exp(node.array_var, env)
+            self.exp(node.index, env)
+            self.exp(node.exp, env)
+            return BOTTOM
+        elif isinstance(node, ast.ListBox):
+            for item in node.items:
+                self.exp(item, env)
+            return UNKNOWN
+        # Statements used where an expression is expected compile to code
+        # the analysis knows nothing about.
+        return UNKNOWN
@@ -4,9 +4,11 @@ from __future__ import absolute_import
 
 from jhvm.opcodes import *
 from jhvm.util import bail
+from jhvm.bcfile import unquote_str
 
 from rpython.rlib import jit
 from rpython.rlib.debug import make_sure_not_resized
+from rpython.rlib.rstring import StringBuilder
 def get_location(pc, bytecode):
     assert pc >= 0
     return "LineNo:%s Instr:%s" % (pc + 1, OP_CODES[int(bytecode[pc])])
@@ -22,7 +24,8 @@ def jitpolicy(driver):
     return JitPolicy()
 
 class VM_Obj(object):
-    pass
+    def repr(self):
+        return '<vm object>'
 
 class VM_Objspace(VM_Obj):
     def add(self, other):
@@ -40,51 +43,370 @@ class VM_Objspace(VM_Obj):
     def lt(self, other):
         raise NotImplementedError()
 
+# =============================================================================
+# Objects
+#
+# Fields that have only ever held ints are stored unboxed, in the object's
+# int_values, and all other fields boxed in field_values. Which storage a
+# field uses is part of the map, so an object's maps depend on the types of
+# its field values as well as on the field names: adding a field follows
+# either the int or the boxed transition.
+#
+# When a non-Int is written to an int field the object is rebuilt with that
+# field boxed, and the int transition that introduced the field is marked as
+# replaced by the boxed one, so that objects created afterwards store the
+# field boxed from the start instead of being rebuilt in turn.
+#
+# Every map belongs to a MapTree, which bounds the number of maps and the
+# number of transitions out of any one map. An object that would need a map
+# past those limits switches to dictionary mode for good: its map becomes
+# the tree's dict_map and its fields move into dict_fields. Programs that
+# create objects with many differently named or ordered fields then stop
+# creating maps, and the guards on them stop failing.
+# =============================================================================
+
+MAX_MAPS = 1024
+MAX_TRANSITIONS = 16
+
+class MapTree(object):
+    _immutable_fields_ = ('max_maps', 'max_transitions', 'root', 'dict_map')
+    def __init__(self, max_maps = MAX_MAPS, max_transitions = MAX_TRANSITIONS):
+        self.max_maps = max_maps
+        self.max_transitions = max_transitions
+        self.map_count = 0
+        # how often an object switched to dictionary mode, by cause
+        self.map_limit_hits = 0
+        self.transition_limit_hits = 0
+        self.root = ObjMap(self)
+        self.dict_map = ObjMap(self, dict_mode = True)
+
+    def stats(self):
+        return ['maps: %d' % self.map_count,
+                'dict mode switches (map limit): %d' % self.map_limit_hits,
+                'dict mode switches (transition limit): %d' %
+                    self.transition_limit_hits]
+
+    def record_dict_mode_switch(self, _map):
+        # Counts an object of _map switching to dictionary mode as no map was
+        # allowed for its new field, by the limit that didn't allow it.
+        if len(_map.int_maps) + len(_map.other_maps) >= self.max_transitions:
+            self.transition_limit_hits += 1
+        else:
+            self.map_limit_hits += 1
+
 class ObjMap(object):
-    _immutable_fields_ = ('field_indexes', 'other_maps')
-    def __init__(self):
+    _immutable_fields_ = ('tree', 'dict_mode', 'field_indexes', 'int_fields',
+                          'fields', 'other_maps', 'int_maps', 'replacement?')
+    def __init__(self, tree, dict_mode = False):
+        self.tree = tree
+        self.dict_mode = dict_mode
         self.field_indexes = {}
+        self.int_fields = {}
+        self.fields = []
+        self.int_count = 0
         self.other_maps = {}
+        self.int_maps = {}
+        # map to use instead of this one, once its int field was generalized
+        self.replacement = None
+        tree.map_count += 1
 
     @jit.elidable
     def get_field_index(self, field_name):
         return self.field_indexes.get(field_name, -1)
 
     @jit.elidable
-    def new_map_with_additional_field(self, field_name):
-        if field_name not in self.other_maps:
-            new_map = ObjMap()
+    def field_is_int(self, field_name):
+        return field_name in self.int_fields
+
+    @jit.elidable
+    def new_map_with_additional_field(self, field_name, is_int):
+        # Returns None if the tree's limits don't allow another map. As the
+        # limits only ever get closer, the answer never changes. Callers
+        # switching an object to dictionary mode on None count it with
+        # MapTree.record_dict_mode_switch().
+        if is_int:
+            maps = self.int_maps
+        else:
+            maps = self.other_maps
+        if field_name not in maps:
+            tree = self.tree
+            if len(self.int_maps) + len(self.other_maps) >= tree.max_transitions:
+                return None
+            if tree.map_count >= tree.max_maps:
+                return None
+            new_map = ObjMap(tree)
             new_map.field_indexes.update(self.field_indexes)
-            new_map.field_indexes[field_name] = len(self.field_indexes)
-            self.other_maps[field_name] = new_map
-        return self.other_maps[field_name]
+            new_map.int_fields.update(self.int_fields)
+            new_map.fields = self.fields + [field_name]
+            new_map.int_count = self.int_count
+            if is_int:
+                new_map.field_indexes[field_name] = self.int_count
+                new_map.int_fields[field_name] = True
+                new_map.int_count += 1
+            else:
+                boxed_count = len(self.fields) - self.int_count
+                new_map.field_indexes[field_name] = boxed_count
+            maps[field_name] = new_map
+        return maps[field_name]
+
+    def describe(self):
+        # e.g. {a:int, b} for the map of an object with an unboxed field a
+        # and a boxed field b
+        if self.dict_mode:
+            return '{dict mode}'
+        names = []
+        for name in self.fields:
+            if name in self.int_fields:
+                names.append(name + ':int')
+            else:
+                names.append(name)
+        return '{' + ', '.join(names) + '}'
 
-EMPTY_MAP = ObjMap()
+    def deprecate_int_field(self, field_name):
+        int_map = self.new_map_with_additional_field(field_name, True)
+        boxed_map = self.new_map_with_additional_field(field_name, False)
+        if int_map is not None and boxed_map is not None:
+            int_map.replacement = boxed_map
+
+# The tree of machines not given one of their own.
+MAP_TREE = MapTree()
+EMPTY_MAP = MAP_TREE.root
 
 class Obj(VM_Obj):
-    def __init__(self):
+    def __init__(self, root_map = EMPTY_MAP):
         self.field_values = []
-        self.map = EMPTY_MAP
+        self.int_values = []
+        self.dict_fields = None
+        self.map = root_map
 
 
     def __repr__(self):
         return '{} {}'.format(self.__class__.__name__, self.__dict__)
 
+    def repr(self):
+        return 'object'
+
     def set_field(self, field_name, value):
         _map = jit.promote(self.map)
+        if _map.dict_mode:
+            self.dict_fields[field_name] = value
+            return
         index = _map.get_field_index(field_name)
-        if index != -1:
+        if index == -1:
+            self._add_field(_map, field_name, value, isinstance(value, Int))
+        elif not _map.field_is_int(field_name):
             self.field_values[index] = value
-            return
-        self.map = _map.new_map_with_additional_field(field_name)
-        self.field_values.append(value)
+        elif isinstance(value, Int):
+            self.int_values[index] = value.int_val
+        else:
+            self._generalize_field(field_name)
+            self.set_field(field_name, value)
 
     def get_field(self, field_name):
         _map = jit.promote(self.map)
+        if _map.dict_mode:
+            try:
+                return self.dict_fields[field_name]
+            except KeyError:
+                raise AttributeError(field_name)
         index = _map.get_field_index(field_name)
-        if index != -1:
-            return self.field_values[index]
-        raise AttributeError(field_name)
+        if index == -1:
+            raise AttributeError(field_name)
+        if _map.field_is_int(field_name):
+            return Int(self.int_values[index])
+        return self.field_values[index]
+
+    def _add_field(self, _map, field_name, value, is_int):
+        new_map = _map.new_map_with_additional_field(field_name, is_int)
+        if new_map is None:
+            _map.tree.record_dict_mode_switch(_map)
+            self._switch_to_dict_mode()
+            self.dict_fields[field_name] = value
+            return
+        replacement = new_map.replacement
+        if replacement is not None:
+            new_map = replacement
+        self.map = new_map
+        if new_map.field_is_int(field_name):
+            assert isinstance(value, Int)
+            self.int_values.append(value.int_val)
+        else:
+            self.field_values.append(value)
+
+    def _switch_to_dict_mode(self):
+        old_map = self.map
+        dict_fields = {}
+        for name in old_map.fields:
+            dict_fields[name] = self.get_field(name)
+        self.dict_fields = dict_fields
+        self.map = old_map.tree.dict_map
+        self.field_values = []
+        self.int_values = []
+
+    def _generalize_field(self, field_name):
+        # Re-adds every field, in order, to an empty object; field_name
+        # goes through the boxed transition this time.
+        old_map = self.map
+        values = [self.get_field(name) for name in old_map.fields]
+        self.map = old_map.tree.root
+        self.field_values = []
+        self.int_values = []
+        for i in range(len(old_map.fields)):
+            name = old_map.fields[i]
+            if self.map.dict_mode:
+                self.dict_fields[name] = values[i]
+                continue
+            is_int = isinstance(values[i], Int)
+            if name == field_name:
+                self.map.deprecate_int_field(name)
+                is_int = False
+            self._add_field(self.map, name, values[i], is_int)
+
+class ObjShape(object):
+    # The fields of an object literal, parsed from NEW_WITH_SHAPE's operand.
+    _immutable_fields_ = ['names[*]']
+    def __init__(self, names):
+        self.names = names
+
+_shapes = {}
+
+@jit.elidable
+def get_shape(descriptor):
+    try:
+        return _shapes[descriptor]
+    except KeyError:
+        shape = ObjShape(descriptor.split(','))
+        _shapes[descriptor] = shape
+        return shape
+
+def new_obj_with_shape(shape, values, root_map = EMPTY_MAP):
+    # Looks up the object's final map and fills in its storage in one go,
+    # instead of growing the object a field at a time. Under the JIT the map
+    # lookups fold away, given the types of the values and a constant
+    # root_map.
+    names = shape.names
+    _map = root_map
+    for i in range(len(names)):
+        _map = _map.new_map_with_additional_field(names[i],
+                                                  isinstance(values[i], Int))
+        if _map is None:
+            break
+        if _map.replacement is not None:
+            _map = _map.replacement
+
+    obj = Obj(root_map)
+    if _map is None:
+        # past the map limits, so the object ends up in dictionary mode
+        for i in range(len(names)):
+            obj.set_field(names[i], values[i])
+        return obj
+
+    field_values = [None] * (len(names) - _map.int_count)
+    int_values = [0] * _map.int_count
+    for i in range(len(names)):
+        index = _map.get_field_index(names[i])
+        value = values[i]
+        if _map.field_is_int(names[i]):
+            assert isinstance(value, Int)
+            int_values[index] = value.int_val
+        else:
+            field_values[index] = value
+    obj.map = _map
+    obj.field_values = field_values
+    obj.int_values = int_values
+    return obj
+
+# =============================================================================
+# Arrays
+#
+# An array's elements live in a storage object. Arrays start out with
+# IntArrayStorage, which keeps the elements unboxed in a list of machine ints,
+# and switch to ObjectArrayStorage for good the first time anything other than
+# an Int is stored in them.
+# =============================================================================
+
+class ArrayStorage(object):
+    def length(self):
+        raise NotImplementedError()
+
+    def get(self, index):
+        raise NotImplementedError()
+
+    def can_store(self, value):
+        raise NotImplementedError()
+
+    def set(self, index, value):
+        raise NotImplementedError()
+
+    def generalized(self):
+        raise NotImplementedError()
+
+class IntArrayStorage(ArrayStorage):
+    _immutable_fields_ = ['items']
+    def __init__(self, items):
+        make_sure_not_resized(items)
+        self.items = items
+
+    def length(self):
+        return len(self.items)
+
+    def get(self, index):
+        return Int(self.items[index])
+
+    def can_store(self, value):
+        return isinstance(value, Int)
+
+    def set(self, index, value):
+        assert isinstance(value, Int)
+        self.items[index] = value.int_val
+
+    def generalized(self):
+        items = [None] * len(self.items)
+        for i in range(len(self.items)):
+            items[i] = Int(self.items[i])
+        return ObjectArrayStorage(items)
+
+class ObjectArrayStorage(ArrayStorage):
+    _immutable_fields_ = ['items']
+    def __init__(self, items):
+        make_sure_not_resized(items)
+        self.items = items
+
+    def length(self):
+        return len(self.items)
+
+    def get(self, index):
+        return self.items[index]
+
+    def can_store(self, value):
+        return True
+
+    def set(self, index, value):
+        self.items[index] = value
+
+    def generalized(self):
+        return self
+
+class Array(VM_Obj):
+    def __init__(self, length):
+        self.storage = IntArrayStorage([0] * length)
+
+    def repr(self):
+        return 'array'
+
+    def _check_index(self, index):
+        if index < 0 or index >= self.storage.length():
+            raise IndexError()
+
+    def get(self, index):
+        self._check_index(index)
+        return self.storage.get(index)
+
+    def set(self, index, value):
+        self._check_index(index)
+        if not self.storage.can_store(value):
+            self.storage = self.storage.generalized()
+        self.storage.set(index, value)
 
 class Int(VM_Objspace):
     _immutable_fields_ = ['int_val']
@@ -115,25 +437,147 @@ class Int(VM_Objspace):
     def __eq__(self, other):
         return isinstance(other, self.__class__) and self.int_val == other.int_val
 
-class StrLiteral(VM_Objspace):
-    _immutable_fields_ = ['str_val']
-    def __init__(self, str_val):
+    def repr(self):
+        return str(self.int_val)
+
+# =============================================================================
+# Strings
+#
+# String constants are interned: CONST_STR pushes the one StrLiteral there is
+# for its text, so two interned strings are equal exactly when they are the
+# same object.
+#
+# Concatenation doesn't copy. It returns a StrRope over its two operands,
+# which is flattened the first time its contents are needed, for a
+# comparison or repr, and then keeps the flat string and drops its operands.
+# A string built by appending in a loop is so copied once, not once per
+# append. Results shorter than ROPE_MIN_LENGTH are flattened straight away,
+# as a rope node would take more memory than the copy.
+# =============================================================================
+
+ROPE_MIN_LENGTH = 32
+
+class Str(VM_Objspace):
+    def length(self):
+        raise NotImplementedError()
+
+    def flatten(self):
+        raise NotImplementedError()
+
+    def is_interned(self):
+        return False
+
+    def add(self, other):
+        assert isinstance(other, Str)
+        length = self.length() + other.length()
+        if length < ROPE_MIN_LENGTH:
+            return StrLiteral(self.flatten() + other.flatten())
+        return StrRope(self, other, length)
+
+    def equals(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Str):
+            return False
+        if self.is_interned() and other.is_interned():
+            return False
+        if self.length() != other.length():
+            return False
+        return self.flatten() == other.flatten()
+
+    def eq(self, other):
+        return Bool(self.equals(other))
+
+    def neq(self, other):
+        return Bool(not self.equals(other))
+
+    def lt(self, other):
+        assert isinstance(other, Str)
+        return Bool(self.flatten() < other.flatten())
+
+    def repr(self):
+        return self.flatten()
+
+class StrLiteral(Str):
+    _immutable_fields_ = ['str_val', 'interned']
+    def __init__(self, str_val, interned = False):
         self.str_val = str_val
+        self.interned = interned
+
+    def length(self):
+        return len(self.str_val)
+
+    def flatten(self):
+        return self.str_val
+
+    def is_interned(self):
+        return self.interned
+
+class StrRope(Str):
+    def __init__(self, left, right, length):
+        self.left = left
+        self.right = right
+        self.len = length
+        self.flat = None
+
+    def length(self):
+        return self.len
+
+    def flatten(self):
+        if self.flat is None:
+            self.flat = _flatten_rope(self)
+            self.left = None
+            self.right = None
+        return self.flat
+
+def _flatten_rope(rope):
+    # Iterative, as ropes built by appending in a loop are as deep as they
+    # are long. Ropes that were already flattened are copied whole.
+    builder = StringBuilder(rope.len)
+    pending = [rope]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, StrRope) and node.flat is None:
+            pending.append(node.right)
+            pending.append(node.left)
+        else:
+            builder.append(node.flatten())
+    return builder.build()
+
+_interned = {}
+
+@jit.elidable
+def intern_str(operand):
+    # The interned string for a CONST_STR operand. Interned by contents, not
+    # by operand, as differently escaped operands can spell the same string.
+    return intern_value(unquote_str(operand))
+
+def intern_value(value):
+    s = _interned.get(value, None)
+    if s is None:
+        s = StrLiteral(value, True)
+        _interned[value] = s
+    return s
 
 class Bool(VM_Objspace):
     _immutable_fields_ = ['bool_val']
     def __init__(self, bool_val):
         self.bool_val = bool_val
 
+    def repr(self):
+        return 'true' if self.bool_val else 'false'
+
 class Frame(VM_Obj):
     _immutable_fields_ = ['stack', 'return_address', 'caller_frame', 'variables' ]
     _virtualizable_ = ['return_address', 'sp', 'caller_frame', 'stack[*]', 'variables[*]' ]
 
-    def __init__(self, return_address, variables, caller_frame):
+    def __init__(self, return_address, variables, caller_frame, stack_size):
         self = jit.hint(self, access_directly=True, fresh_virtualizable=True)
         self.return_address = return_address
         self.variables = variables
-        self.stack = [None] * 10
+        # as deep as the function's code ever needs (see
+        # assembler.stack_depth)
+        self.stack = [None] * stack_size
         self.sp = 0
         self.caller_frame = caller_frame
         self.next_frame = None
@@ -185,6 +629,36 @@ class Frame(VM_Obj):
         val = o1.lt(o2)
         self.push(val)
 
+    # The int-specialized opcodes only ever see Ints, so the asserts stand in
+    # for the checks and the virtual calls of the generic ones.
+
+    def add_int(self):
+        o2 = self.pop()
+        o1 = self.pop()
+        assert isinstance(o1, Int) and isinstance(o2, Int)
+        self.push(Int(o1.int_val + o2.int_val))
+
+    def sub_int(self):
+        o2 = self.pop()
+        o1 = self.pop()
+        assert isinstance(o1, Int) and isinstance(o2, Int)
+        self.push(Int(o1.int_val - o2.int_val))
+
+    def eq_int(self):
+        o2 = self.pop()
+        o1 = self.pop()
+        assert isinstance(o1, Int) and isinstance(o2, Int)
+        self.push(Bool(o1.int_val == o2.int_val))
+
+    def lt_int(self):
+        self.push(Bool(self.int_less_than()))
+
+    def int_less_than(self):
+        o2 = self.pop()
+        o1 = self.pop()
+        assert isinstance(o1, Int) and isinstance(o2, Int)
+        return o1.int_val < o2.int_val
+
     def jump_if_true(self):
         exp = self.pop()
         if isinstance(exp, Bool):
@@ -205,7 +679,7 @@ class Frame(VM_Obj):
         self.push(obj)
 
     def new(self, vm):
-        obj = Obj()
+        obj = Obj(vm.map_tree.root)
         vm.heap.append(obj)
         ref = Int(len(vm.heap) - 1)
         self.push(ref)
@@ -215,7 +689,12 @@ class Frame(VM_Obj):
         obj_ref = self.pop()
         if isinstance(obj_ref, Int):
             obj = vm.heap[obj_ref.int_val]
+            if not isinstance(obj, Obj):
+                raise NotImplementedError()
+            old_map = obj.map
             obj.set_field(field, value)
+            if vm.profiler is not None and obj.map is not old_map:
+                vm.profiler.record_transition(old_map, obj.map)
         else:
             raise NotImplementedError()
 
@@ -223,11 +702,60 @@ class Frame(VM_Obj):
         obj_ref = self.pop()
         if isinstance(obj_ref, Int):
             obj = vm.heap[obj_ref.int_val]
+            if not isinstance(obj, Obj):
+                raise NotImplementedError()
             val = obj.get_field(field)
             self.push(val)
         else:
             raise NotImplementedError()
 
+    def new_with_shape(self, descriptor, vm):
+        shape = get_shape(descriptor)
+        values = [None] * len(shape.names)
+        for i in range(len(values) - 1, -1, -1):
+            values[i] = self.pop()
+        root_map = jit.promote(vm.map_tree.root)
+        vm.heap.append(new_obj_with_shape(shape, values, root_map))
+        self.push(Int(len(vm.heap) - 1))
+
+    def new_array(self, vm):
+        length = self.pop()
+        if isinstance(length, Int):
+            vm.heap.append(Array(length.int_val))
+            self.push(Int(len(vm.heap) - 1))
+        else:
+            raise NotImplementedError()
+
+    def _pop_array(self, vm):
+        array_ref = self.pop()
+        if isinstance(array_ref, Int):
+            array = vm.heap[array_ref.int_val]
+            if isinstance(array, Array):
+                return array
+        raise NotImplementedError()
+
+    def array_get(self, vm):
+        index = self.pop()
+        array = self._pop_array(vm)
+        if isinstance(index, Int):
+            self.push(array.get(index.int_val))
+        else:
+            raise NotImplementedError()
+
+    def array_set(self, vm):
+        value = self.pop()
+        index = self.pop()
+        array = self._pop_array(vm)
+        if isinstance(index, Int):
+            array.set(index.int_val, value)
+        else:
+            raise NotImplementedError()
+
+    def dup(self):
+        val = self.pop()
+        self.push(val)
+        self.push(val)
+
     def jump(self):
         pass
 
@@ -242,7 +770,7 @@ class Frame(VM_Obj):
         var = self.pop()
         if isinstance(var, Int):
             index = var.int_val
-            assert index > 0
+            assert index >= 0
             self.variables[index] = value
         else:
             raise NotImplementedError()
@@ -254,28 +782,71 @@ class Frame(VM_Obj):
         val = o1.neq(o2)
         self.push(val)
 
-    def ret(self):
-        return (self.return_address, self.caller_frame, self.pop())
-
 class VirtualMachine(object):
+    _immutable_fields_ = ['profiler', 'functions[*]', 'map_tree']
 
-    def __init__(self, instructions, fn_var_map, args = None):
+    def __init__(self, instructions, functions, args = None, profiler = None,
+                 map_tree = None):
         self.instructions = instructions
         self.stack = []
-        self.fn_var_map = fn_var_map
+        # the function table (bcfile.FunctionInfo), indexed by CALL operands
+        self.functions = functions
         self.heap = []
-
+        # a profiler.MemoryProfiler, if allocations should be recorded
+        self.profiler = profiler
+        # the MapTree the maps of the machine's objects belong to
+        if map_tree is None:
+            map_tree = MAP_TREE
+        self.map_tree = map_tree
+
+        # ints passed to main as its arguments
+        self.args = []
         if args:
-            [self.stack.append(Int(arg)) for arg in args]
+            self.args = args
+
+        # Set to stop at the first SNAPSHOT, leaving the frame running it and
+        # the pc to resume at in snapshot_frame and snapshot_pc, for
+        # jhvm.image to save. interp then returns None.
+        self.take_snapshot = False
+        self.snapshot_frame = None
+        self.snapshot_pc = 0
 
     def interp(self, bytecode):
-        main_fn_size = self.fn_var_map[0] # FIXME: VERY HACKY
-        main_vars = [None] * main_fn_size
-        frame = Frame(len(bytecode) + 1, main_vars, None)
+        main_fn = self.functions[0]
+        if len(self.args) > main_fn.arity:
+            bail('main takes %d arguments, got %d' % (main_fn.arity,
+                                                      len(self.args)))
+        main_vars = [None] * main_fn.var_count
+        for i in range(len(self.args)):
+            main_vars[i] = Int(self.args[i])
+        frame = Frame(len(bytecode) + 1, main_vars, None, main_fn.stack_size)
         self.stack.append(frame)
-        pc = 0
-
-        # Begin program interpreter loop
+        return self.run(bytecode, frame, 0)
+
+    def resume(self, bytecode, frame, pc):
+        # Carries on from a program state restored by jhvm.image, with frame
+        # the innermost frame and self.heap already filled in. Each frame
+        # runs to its return, which is then passed on to its caller.
+        main_frame = frame
+        while main_frame.caller_frame is not None:
+            main_frame = main_frame.caller_frame
+        self.stack.append(main_frame)
+        while True:
+            res = self.run(bytecode, frame, pc)
+            caller_frame = frame.caller_frame
+            if res is None or caller_frame is None:
+                return res
+            caller_frame.push(res)
+            pc = frame.return_address
+            frame = caller_frame
+
+    def run(self, bytecode, frame, pc):
+        # Runs frame from pc until it returns, and returns the value it
+        # returns. A call runs the callee's frame in a run() of its own, so
+        # that the frame of a run, the virtualizable, never changes. Calls
+        # are then calls of the portal, which the JIT compiles code for on
+        # function entry once they are made often enough, so recursive code
+        # without loops gets compiled too.
         while True:
             jitdriver.jit_merge_point(pc=pc, bytecode=bytecode, frame=frame, self=self)
             if pc >= len(bytecode):
@@ -297,9 +868,34 @@ class VirtualMachine(object):
                 if not val:
                     pc = int(bytecode[pc + 1])
                     continue # don't increment pc
+            elif instr == LOOP_IF_TRUE:
+                val = frame.jump_if_true()
+                if val:
+                    pc = int(bytecode[pc + 1])
+                    jitdriver.can_enter_jit(pc=pc, bytecode=bytecode,
+                                            frame=frame, self=self)
+                    continue # don't increment pc
+            elif instr == LT_INT_JUMP_IF_FALSE:
+                if not frame.int_less_than():
+                    pc = int(bytecode[pc + 1])
+                    continue # don't increment pc
+            elif instr == LT_INT_LOOP_IF_TRUE:
+                if frame.int_less_than():
+                    pc = int(bytecode[pc + 1])
+                    jitdriver.can_enter_jit(pc=pc, bytecode=bytecode,
+                                            frame=frame, self=self)
+                    continue # don't increment pc
             elif instr == JUMP:
                 pc = int(bytecode[pc + 1])
                 continue
+            elif instr == ADD_INT:
+                frame.add_int()
+            elif instr == SUB_INT:
+                frame.sub_int()
+            elif instr == LT_INT:
+                frame.lt_int()
+            elif instr == EQ_INT:
+                frame.eq_int()
             elif instr == ADD:
                 frame.add()
             elif instr == SUB:
@@ -310,37 +906,55 @@ class VirtualMachine(object):
                 frame.lt()
             elif instr == NEW:
                 frame.new(self)
+                if self.profiler is not None:
+                    self.profiler.record_allocation(pc, instr, len(self.heap))
+            elif instr == NEW_WITH_SHAPE:
+                frame.new_with_shape(str(bytecode[pc+1]), self)
+                if self.profiler is not None:
+                    self.profiler.record_allocation(pc, instr, len(self.heap))
             elif instr == GET_FIELD:
                 frame.get_field(str(bytecode[pc+1]), self)
             elif instr == SET_FIELD:
                 frame.set_field(str(bytecode[pc+1]), self)
+            elif instr == NEW_ARRAY:
+                frame.new_array(self)
+                if self.profiler is not None:
+                    self.profiler.record_allocation(pc, instr, len(self.heap))
+            elif instr == ARRAY_GET:
+                frame.array_get(self)
+            elif instr == ARRAY_SET:
+                frame.array_set(self)
+            elif instr == DUP:
+                frame.dup()
             elif instr == SWAP:
                 frame.swap()
             elif instr == NEQ:
                 frame.neq()
             elif instr == CALL:
-                caller_address = int(bytecode[pc + 1])
-                var_size = self.fn_var_map[caller_address]
-                frame = self.function_call(frame, pc, var_size)
-                pc = caller_address
-                continue
+                # A constant under the JIT, and with it the callee's pc,
+                # frame size and arity, as FunctionInfo is immutable.
+                function = jit.promote(self.functions[int(bytecode[pc + 1])])
+                callee_frame = self.function_call(frame, pc, function)
+                res = self.run(bytecode, callee_frame, function.pc)
+                if res is None:
+                    # stopped at a snapshot
+                    return None
+                frame.push(res)
             elif instr == RET:
-                ret_address, caller_frame, ret_val = frame.ret()
-                if not caller_frame: # if main function
-                    return ret_val
-                frame = caller_frame
-                frame.pop()
-                frame.push(ret_val)
-                pc = ret_address
-                continue
+                return frame.pop()
             elif instr == VAR:
                 frame.var(int(bytecode[pc + 1]))
             elif instr == ASSIGN:
                 frame.assign()
             elif instr == CONST_STR:
-                frame.push(StrLiteral(bytecode[pc + 1]))
+                frame.push(intern_str(bytecode[pc + 1]))
             elif instr == EXIT:
                 break
+            elif instr == SNAPSHOT:
+                if self.take_snapshot:
+                    self.snapshot_frame = frame
+                    self.snapshot_pc = pc + 1
+                    return None
             else:
                 bail('unknown op_code: %s' % bytecode[pc])
 
@@ -348,24 +962,17 @@ class VirtualMachine(object):
 
         return self.stack.pop()
 
-    def function_call(self, caller_frame, pc, var_size):
+    @jit.unroll_safe
+    def function_call(self, caller_frame, pc, function):
         # Invoked on the presence of the CALL opcode.
-        # This method will take the values pushed on the caller's stack before
-        # the CALL as arguments to the callee and place them inside the newly
-        # instantiated frame. It will then push this new frame to the VMs main
-        # execution stack.
-        return_address = pc + 2
-        variables = [None] * var_size
-        arg_count = caller_frame.pop()
-        if isinstance(arg_count, Int):
-            for i in range(arg_count.int_val):
-                arg = caller_frame.pop()
-                variables[i] = arg
-            new_frame = Frame(return_address, variables, caller_frame)
-            caller_frame.push(new_frame)
-            return new_frame
-        else:
-            raise NotImplementedError()
+        # The callee's arity is known statically, so this method moves exactly
+        # that many values from the caller's stack straight into the
+        # variables of the new frame, first argument on top. The new frame
+        # only links back to its caller and takes up no stack slot.
+        variables = [None] * function.var_count
+        for i in range(function.arity):
+            variables[i] = caller_frame.pop()
+        return Frame(pc + 2, variables, caller_frame, function.stack_size)
 
 
     def pop_frame(self):
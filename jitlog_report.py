@@ -0,0 +1,27 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+#
+# Summarises a PYPYLOG file from a JIT build of jhvm: every loop and bridge
+# with where it starts, its length, its guards and the guards failing most,
+# and the functions whose tracing was aborted. See jhvm/jitlog.py.
+import argparse
+
+from jhvm.bcfile import loads
+from jhvm.jitlog import parse_log, format_report
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('log', help = 'file written with PYPYLOG=jit:<file>')
+    parser.add_argument('bytecode', help = 'the bytecode file that was run')
+    parser.add_argument('-n', '--top', type = int, default = 5,
+                        help = 'failing guards listed per trace (default: 5)')
+    args = parser.parse_args()
+
+    with open(args.bytecode) as f:
+        bytecode, functions = loads(f.read())
+    with open(args.log) as f:
+        log = parse_log(f)
+    print format_report(log, bytecode, functions, args.top)
+
+if __name__ == '__main__':
+    main()
@@ -5,41 +5,109 @@ from __future__ import absolute_import
 import os
 import sys
 from jhvm.vm import VirtualMachine
-from jhvm.opcodes import EOB
+from jhvm.profiler import MemoryProfiler
+from jhvm.server import serve, DEFAULT_WORKERS
+from jhvm.bcfile import loads
+from jhvm.image import ImageError, dumps_image, resume_from_image
 from rpython.rlib.streamio import open_file_as_stream
 def usage():
-    print 'Usage: target-vm compiled-bytecode'
+    print ('Usage: target-vm [--mem-profile] [--save-image image | '
+           '--image image] compiled-bytecode [int-arg ...]')
+    print '       target-vm --serve socket-path [--workers n]'
     return 1
 
+def read_file(filename):
+    return open_file_as_stream(filename).readall()
+
+def write_file(filename, data):
+    stream = open_file_as_stream(filename, 'w')
+    stream.write(data)
+    stream.close()
+
+def load_bytecode(filename):
+    return loads(read_file(filename))
+
+def serve_entry_point(argv):
+    # target-vm --serve socket-path [--workers n]
+    if len(argv) < 3:
+        return usage()
+    workers = DEFAULT_WORKERS
+    if len(argv) == 5 and argv[3] == '--workers':
+        workers = int(argv[4])
+    elif len(argv) != 3:
+        return usage()
+    serve(argv[2], workers)
+    return 0
+
 def entry_point(argv):
-    if len(argv) < 1:
-        usage()
-
-    filename = argv[1]
-    lines = open_file_as_stream(argv[1]).readall().splitlines()
-    bytecode = []
-    break_line = 0
-    for i, line in enumerate(lines):
-        if line == EOB:
-            break_line = i
-            break
-        bytecode.append(line)
-
-    var_count = {}
-    for line in lines[break_line + 1:]:
-        k,v = line.split(',')
-        var_count.update({int(k):int(v)})
-
-    machine = VirtualMachine(bytecode, var_count)
+    if len(argv) > 1 and argv[1] == '--serve':
+        return serve_entry_point(argv)
+
+    # --mem-profile prints a report of allocations and object shapes to
+    # stderr once the program has finished.
+    profiler = None
+    if len(argv) > 1 and argv[1] == '--mem-profile':
+        profiler = MemoryProfiler()
+        argv = [argv[0]] + argv[2:]
+    # --save-image runs the program up to its snapshot statement and saves
+    # its state there; --image resumes the program from such an image
+    # instead of running it from the start.
+    image_option = None
+    image_path = None
+    if len(argv) > 2 and (argv[1] == '--save-image' or argv[1] == '--image'):
+        image_option = argv[1]
+        image_path = argv[2]
+        argv = [argv[0]] + argv[3:]
+    if len(argv) < 2:
+        return usage()
+
+    bytecode, functions = load_bytecode(argv[1])
+    args = [int(arg) for arg in argv[2:]]
+    machine = VirtualMachine(bytecode, functions, args, profiler)
+    if image_option == '--image':
+        try:
+            res = resume_from_image(machine, bytecode, read_file(image_path))
+        except ImageError as e:
+            os.write(2, 'Cannot resume from %s: %s\n' % (image_path,
+                                                         e.message))
+            return 1
+    else:
+        machine.take_snapshot = image_option == '--save-image'
+        res = machine.interp(bytecode)
+        if res is None:
+            assert image_path is not None
+            try:
+                write_file(image_path, dumps_image(machine, bytecode))
+            except ImageError as e:
+                os.write(2, 'Cannot save %s: %s\n' % (image_path, e.message))
+                return 1
+            return 0
+        if machine.take_snapshot:
+            os.write(2, 'The program ran no snapshot statement, %s was not '
+                        'written\n' % image_path)
+    print res.repr()
+    if profiler is not None:
+        os.write(2, profiler.report(machine.heap, machine.map_tree) + '\n')
+    return 0
+
+def fast_py_entry_point(argv):
+    # Runs the bytecode on the closure-compiled backend instead of the
+    # interpreter loop. Only available untranslated, under plain CPython.
+    from jhvm.closurevm import ClosureMachine
+    if len(argv) < 2:
+        return usage()
+
+    bytecode, functions = load_bytecode(argv[1])
+    args = [int(arg) for arg in argv[2:]]
+    machine = ClosureMachine(bytecode, functions, args)
     res = machine.interp(bytecode)
-    print res
+    print res.repr()
     return 0
 
 def target(*args):
     return entry_point
 
 if __name__ == '__main__':
+    if '--fast-py' in sys.argv:
+        sys.exit(fast_py_entry_point([a for a in sys.argv if a != '--fast-py']))
     entry_point(sys.argv)
-
-
-
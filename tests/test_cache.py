@@ -0,0 +1,83 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+import jhvm
+from jhvm.bcfile import dumps, loads, FunctionInfo
+from jhvm.cache import BytecodeCache, compiler_modules
+from jhvm.parser import build_parser
+from jhvm.lexer import lex
+
+class TestBytecodeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = BytecodeCache(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_miss_then_hit(self):
+        key = self.cache.key_for('fn main() { return 1 }')
+        self.assertEqual(self.cache.get(key), None)
+        data = dumps(['0', '1', '17'], [FunctionInfo(0, 0, 1, 0, 'main')])
+        self.cache.put(key, data)
+        self.assertEqual(self.cache.get(key), data)
+        self.assertEqual(loads(self.cache.get(key)),
+                         (['0', '1', '17'], [FunctionInfo(0, 0, 1, 0, 'main')]))
+
+    def test_key_depends_on_source_and_options(self):
+        source = 'fn main() { return 1 }'
+        key = self.cache.key_for(source)
+        self.assertEqual(key, self.cache.key_for(source, {}))
+        self.assertNotEqual(key, self.cache.key_for(source + ' '))
+        self.assertNotEqual(key, self.cache.key_for(source, {'opt' : True}))
+        self.assertEqual(self.cache.key_for(source, {'a' : 1, 'b' : 2}),
+                         self.cache.key_for(source, {'b' : 2, 'a' : 1}))
+
+    def test_version_covers_every_compiler_module(self):
+        modules = compiler_modules(os.path.dirname(jhvm.__file__))
+        for name in ['lexer', 'parser', 'ast', 'genast', 'opcodes', 'bcfile',
+                     'linker', 'assembler', 'typeinfer', 'licm', 'liveness']:
+            self.assertIn(name, modules)
+        self.assertNotIn('vm', modules)
+
+class TestParserTableCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_tables_are_persisted_and_reused(self):
+        source = 'fn main() { return 1 + 2 }'
+        expected = build_parser(self.cache_dir).parse(lex(source))
+        tables = os.listdir(self.cache_dir)
+        self.assertEqual(len(tables), 1)
+
+        parser = build_parser(self.cache_dir)
+        self.assertEqual(os.listdir(self.cache_dir), tables)
+        self.assertEqual(parser.parse(lex(source)), expected)
+
+    def test_stale_tables_are_regenerated(self):
+        build_parser(self.cache_dir)
+        path = os.path.join(self.cache_dir, os.listdir(self.cache_dir)[0])
+        with open(path, 'w') as f:
+            f.write('{"start": "not-our-grammar"}')
+        parser = build_parser(self.cache_dir)
+        self.assertEqual(parser.parse(lex('fn main() { return 1 }')).functions
+                         .items[0].name, 'main')
+
+    def test_unwritable_cache_dir(self):
+        # Below a file, so that not even root can create it.
+        blocker = os.path.join(self.cache_dir, 'file')
+        open(blocker, 'w').close()
+        parser = build_parser(os.path.join(blocker, 'tables'))
+        self.assertEqual(parser.parse(lex('fn main() { return 1 }')).functions
+                         .items[0].name, 'main')
+        self.assertEqual(os.listdir(self.cache_dir), ['file'])
@@ -0,0 +1,50 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+from tests import test_vm
+from jhvm.closurevm import ClosureMachine
+from jhvm.vm import VirtualMachine as VM
+from jhvm.vm import Int
+
+class TestClosureMachine(test_vm.TestVirtualMachine):
+    # Runs every VM test again on the closure-compiled backend.
+
+    def run_prog(self, bytecode, functions, args = None):
+        machine = ClosureMachine(bytecode, functions, args)
+        return machine.interp(bytecode)
+
+    def test_recursive_call_matches_interp(self):
+        source = """
+            fn main() {
+                return sum(20)
+            }
+
+            fn sum(n) {
+                if(n == 0) {
+                    return 0
+                };
+                return n + sum(n - 1)
+            }
+        """
+        bytecode, functions = self.compile(source)
+        expected = VM(bytecode, functions).interp(bytecode)
+        res = self.run_prog(bytecode, functions)
+        self.assertEqual(res, expected)
+        self.assertEqual(res, Int(210))
+
+    def test_machine_reruns_compiled_program(self):
+        source = """
+            fn main() {
+                x = object();
+                x.a = 2;
+                for(i = 0; i < 10; i = i + 1) {
+                    x.a = x.a + i
+                };
+                return x.a
+            }
+        """
+        bytecode, functions = self.compile(source)
+        machine = ClosureMachine(bytecode, functions)
+        self.assertEqual(machine.interp(bytecode), Int(47))
+        self.assertEqual(machine.interp(bytecode), Int(47))
@@ -0,0 +1,92 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+from jhvm.bcfile import loads
+from jhvm.vm import VirtualMachine as VM, Int
+
+import compiler
+
+GOOD = 'fn main() { return %d }'
+BAD = 'fn main() { return }'
+
+class TestBatchCompile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.src = os.path.join(self.tmpdir, 'src')
+        os.makedirs(os.path.join(self.src, 'sub'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, source):
+        path = os.path.join(self.src, name)
+        with open(path, 'w') as f:
+            f.write(source)
+        return path
+
+    def batch(self, argv):
+        args = compiler.parse_args(['--batch', '--cache-dir', self.cache_dir]
+                                   + argv)
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            status = compiler.batch_compile(args, {})
+            return status, sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def run_output(self, path):
+        bytecode, functions = loads(open(path[:-len('.jh')]).read())
+        return VM(bytecode, functions).interp(bytecode)
+
+    def test_directories_and_globs_are_expanded(self):
+        a = self.write('a.jh', GOOD % 1)
+        b = self.write('sub/b.jh', GOOD % 2)
+        c = self.write('c.jh', GOOD % 3)
+        self.write('notes.txt', '')
+        self.assertEqual(compiler.expand_inputs([self.src]), sorted([a, b, c]))
+        self.assertEqual(compiler.expand_inputs(
+                             [os.path.join(self.src, '*'), a]),
+                         sorted([a, c]))
+
+    def test_failing_file(self):
+        path = self.write('bad.jh', BAD)
+        filename, size, cached, error = compiler.compile_batch_file(
+            (path, self.cache_dir, True, {}))
+        self.assertEqual((filename, size, cached), (path, len(BAD), False))
+        self.assertTrue(error.startswith('ValueError'))
+
+    def test_missing_file(self):
+        path = os.path.join(self.src, 'missing.jh')
+        filename, size, cached, error = compiler.compile_batch_file(
+            (path, self.cache_dir, True, {}))
+        self.assertEqual((filename, size, cached), (path, 0, False))
+        self.assertTrue(error.startswith('IOError'))
+
+    def test_parallel_batch(self):
+        paths = [self.write('f%d.jh' % i, GOOD % i) for i in range(6)]
+        bad = self.write('sub/bad.jh', BAD)
+        status, out, err = self.batch(['-j', '3', self.src])
+        self.assertEqual(status, 1)
+        self.assertIn('Compiled 6 files (0 cached, 1 failed)', out)
+        self.assertIn('with 3 processes', out)
+        self.assertIn('FAILED %s' % bad, err)
+        for i, path in enumerate(paths):
+            self.assertEqual(self.run_output(path), Int(i))
+
+        os.remove(bad)
+        status, out, err = self.batch(['-j', '2', self.src])
+        self.assertEqual(status, 0)
+        self.assertIn('Compiled 6 files (6 cached, 0 failed)', out)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import shutil
+import tempfile
+import unittest
+from jhvm.parser import parse_input
+from jhvm.genast import (generate_bytecode, compile_function, link,
+                         CompiledFunction, IncrementalCompiler)
+from jhvm.assembler import Label, LabelDef, FunctionRef, AssemblerError, assemble
+from jhvm.cache import FunctionCache
+from jhvm.bcfile import FunctionInfo
+from jhvm.opcodes import *
+from jhvm.vm import VirtualMachine as VM
+
+from jhvm.vm import Int
+
+HELPER = """
+    fn helper(n) {
+        x = 0;
+        for(i = 0; i < n; i = i + 1) {
+            x = x + i
+        };
+        return x
+    }
+"""
+
+MAIN_V1 = """
+    fn main() {
+        return helper(10)
+    }
+"""
+
+MAIN_V2 = """
+    fn main() {
+        y = 1;
+        if(y == 1) {
+            y = helper(20)
+        };
+        return y
+    }
+"""
+
+class TestPerFunctionCodegen(unittest.TestCase):
+
+    def test_function_code_is_position_independent(self):
+        helper_v1 = parse_input(MAIN_V1 + HELPER).functions.items[1]
+        helper_v2 = parse_input(MAIN_V2 + HELPER).functions.items[1]
+        self.assertEqual(compile_function(helper_v1), compile_function(helper_v2))
+
+    def test_link_relocates_jumps_and_calls(self):
+        ast = parse_input(MAIN_V2 + HELPER)
+        main, helper = [compile_function(f) for f in ast.functions.items]
+        bytecode, functions = link([main, helper])
+        start = len(main.code)
+        self.assertEqual(functions,
+                         [FunctionInfo(0, main.var_count, main.stack_size, 0,
+                                       'main'),
+                          FunctionInfo(start, helper.var_count,
+                                       helper.stack_size, 1, 'helper')])
+        for i in helper.jump_operands:
+            self.assertEqual(int(bytecode[start + i]), int(helper.code[i]) + start)
+        for i in main.call_operands:
+            self.assertEqual(bytecode[i], '1')
+
+    def test_link_rejects_undefined_function(self):
+        ast = parse_input(MAIN_V1)
+        self.assertRaises(ValueError, generate_bytecode, ast)
+
+    def test_link_checks_arity(self):
+        ast = parse_input('fn main() { return helper(1, 2) }' + HELPER)
+        self.assertRaises(ValueError, generate_bytecode, ast)
+
+    def test_call_passes_only_arguments(self):
+        source = '''
+            fn main() {
+                return down(50)
+            }
+
+            fn down(n) {
+                if(n == 0) {
+                    return 0
+                };
+                return 1 + down(n - 1)
+            }
+        '''
+        bytecode, functions = generate_bytecode(parse_input(source))
+        self.assertEqual(bytecode[:5], [CONST_INT, '50', CALL, '1', RET])
+        self.assertEqual(functions[1], FunctionInfo(5, 1, 3, 1, 'down'))
+        self.assertEqual(VM(bytecode, functions).interp(bytecode), Int(50))
+
+    def test_dumps_loads(self):
+        helper = compile_function(parse_input(HELPER).functions.items[0])
+        self.assertEqual(CompiledFunction.loads(helper.dumps()), helper)
+
+    def test_duplicate_literal_field(self):
+        ast = parse_input('fn main() { return object(a = 1, a = 2) }')
+        self.assertRaises(ValueError, generate_bytecode, ast)
+
+    def test_loops_are_inverted(self):
+        helper = compile_function(parse_input(HELPER).functions.items[0])
+        code = helper.code
+        ops = []
+        pc = 0
+        while pc < len(code):
+            ops.append((pc, code[pc]))
+            pc += 2 if HAS_ARGS[int(code[pc])] else 1
+        branches = [(pc, op) for pc, op in ops if op in (JUMP, JUMP_IF_FALSE,
+                                                        LOOP_IF_TRUE)]
+        # The guard skips the loop, the loop branch goes back to just after
+        # the guard.
+        (guard_pc, guard), (loop_pc, loop) = branches
+        self.assertEqual((guard, loop), (JUMP_IF_FALSE, LOOP_IF_TRUE))
+        self.assertEqual(int(code[guard_pc + 1]), loop_pc + 2)
+        self.assertEqual(int(code[loop_pc + 1]), guard_pc + 2)
+
+class TestIncrementalCompiler(unittest.TestCase):
+
+    def test_only_changed_functions_are_regenerated(self):
+        compiler = IncrementalCompiler()
+        compiler.compile_program(parse_input(MAIN_V1 + HELPER))
+        self.assertEqual(compiler.regenerated, ['main', 'helper'])
+
+        ast = parse_input(MAIN_V2 + HELPER)
+        self.assertEqual(compiler.compile_program(ast), generate_bytecode(ast))
+        self.assertEqual(compiler.regenerated, ['main'])
+
+    def test_function_cache_store(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            ast = parse_input(MAIN_V1 + HELPER)
+            IncrementalCompiler(FunctionCache(cache_dir)).compile_program(ast)
+
+            compiler = IncrementalCompiler(FunctionCache(cache_dir))
+            self.assertEqual(compiler.compile_program(ast), generate_bytecode(ast))
+            self.assertEqual(compiler.regenerated, [])
+
+            other_options = IncrementalCompiler(FunctionCache(cache_dir, {'o' : 1}))
+            other_options.compile_program(ast)
+            self.assertEqual(other_options.regenerated, ['main', 'helper'])
+        finally:
+            shutil.rmtree(cache_dir)
+
+class TestAssembler(unittest.TestCase):
+
+    def test_assemble(self):
+        loop, done = Label('loop'), Label('done')
+        items = [LabelDef(loop), VAR, '0', JUMP_IF_FALSE, done,
+                 CALL, FunctionRef('f'), JUMP, loop, LabelDef(done), RET]
+        code, jump_operands, call_operands = assemble(items)
+        self.assertEqual(code, [VAR, '0', JUMP_IF_FALSE, '8', CALL, 'f',
+                                JUMP, '0', RET])
+        self.assertEqual(jump_operands, [3, 7])
+        self.assertEqual(call_operands, [5])
+
+    def test_unplaced_label(self):
+        self.assertRaises(AssemblerError, assemble, [JUMP, Label('nowhere')])
+
+    def test_adjacent_labels(self):
+        # The inner loop's exit and the if's exit end up at the same pc.
+        source = """
+            fn main() {
+                x = 0;
+                if(x == 0) {
+                    for(i = 0; i < 5; i = i + 1) {
+                        x = x + i
+                    }
+                };
+                return x
+            }
+        """
+        bytecode, functions = generate_bytecode(parse_input(source))
+        self.assertEqual(VM(bytecode, functions).interp(bytecode), Int(10))
+
+    def test_operands_named_like_labels_are_kept(self):
+        source = """
+            fn main() {
+                x = object();
+                if(1 == 1) {
+                    x.exit_0 = 5
+                };
+                return x.exit_0
+            }
+        """
+        bytecode, functions = generate_bytecode(parse_input(source))
+        self.assertIn('exit_0', bytecode)
+        self.assertEqual(VM(bytecode, functions).interp(bytecode), Int(5))
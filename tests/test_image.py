@@ -0,0 +1,137 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import unittest
+from jhvm.parser import parse_input
+from jhvm.genast import generate_bytecode
+from jhvm.closurevm import ClosureMachine
+from jhvm.image import ImageError, dumps_image, load_image, resume_from_image
+from jhvm.vm import (VirtualMachine as VM, Int, Obj, Array, Frame, StrLiteral,
+                     MAP_TREE, intern_str)
+
+SOURCE = """
+    fn main(n) {
+        table = build(n);
+        return 1 + use(table, n)
+    }
+
+    fn build(n) {
+        objs = array(n);
+        for(i = 0; i < n; i = i + 1) {
+            objs[i] = object(x = i, name = "obj")
+        };
+        names = ["a", "b"];
+        long = "a string long enough to be a rope" + "!";
+        return object(objs = objs, names = names, long = long, s = "a" + "b")
+    }
+
+    fn use(table, n) {
+        snapshot;
+        s = 0;
+        objs = table.objs;
+        for(i = 0; i < n; i = i + 1) {
+            o = objs[i];
+            s = s + o.x
+        };
+        if(table.s == "ab") {
+            s = s + 100
+        };
+        names = table.names;
+        if(names[1] == "b") {
+            s = s + 1000
+        };
+        if(table.long == "a string long enough to be a rope!") {
+            s = s + 10000
+        };
+        return s
+    }
+"""
+
+def compile_source(source):
+    return generate_bytecode(parse_input(source))
+
+def take_image(source, args):
+    bytecode, functions = compile_source(source)
+    machine = VM(bytecode, functions, args)
+    machine.take_snapshot = True
+    assert machine.interp(bytecode) is None
+    return dumps_image(machine, bytecode)
+
+class TestImage(unittest.TestCase):
+
+    def test_snapshot_is_ignored(self):
+        bytecode, functions = compile_source(SOURCE)
+        self.assertEqual(VM(bytecode, functions, [10]).interp(bytecode),
+                         Int(11146))
+        self.assertEqual(ClosureMachine(bytecode, functions, [10])
+                         .interp(bytecode), Int(11146))
+
+    def test_resume(self):
+        data = take_image(SOURCE, [10])
+        self.assertTrue(data.startswith('jhvm-image\n'))
+        # Resumed from freshly compiled bytecode, as in another process.
+        bytecode, functions = compile_source(SOURCE)
+        machine = VM(bytecode, functions)
+        self.assertEqual(resume_from_image(machine, bytecode, data),
+                         Int(11146))
+        self.assertEqual(len(machine.heap), 13)
+        obj = machine.heap[1]
+        self.assertIsInstance(obj, Obj)
+        self.assertFalse(obj.map.dict_mode)
+        self.assertEqual(obj.map.describe(), '{x:int, name}')
+        self.assertIs(obj.get_field('name'), intern_str('"obj"'))
+
+    def test_frames(self):
+        bytecode, functions = compile_source(SOURCE)
+        frame, pc = load_image(VM(bytecode, functions), bytecode,
+                               take_image(SOURCE, [3]))
+        self.assertEqual(bytecode[pc - 1], '34')
+        self.assertEqual(frame.variables[1], Int(3))
+        self.assertEqual(frame.sp, 0)
+        main_frame = frame.caller_frame
+        self.assertIsNone(main_frame.caller_frame)
+        self.assertEqual(main_frame.variables[0], Int(3))
+        self.assertEqual(main_frame.sp, 1)
+        self.assertEqual(main_frame.stack[0], Int(1))
+
+    def test_heap_entries(self):
+        bytecode, functions = compile_source(SOURCE)
+        machine = VM(bytecode, functions)
+        dict_obj = Obj()
+        dict_obj.set_field('a', Int(1))
+        dict_obj.set_field('b', StrLiteral('x\ny'))
+        dict_obj._switch_to_dict_mode()
+        array = Array(2)
+        array.set(0, Int(5))
+        array.set(1, intern_str('"s"'))
+        machine.heap = [dict_obj, array]
+        machine.snapshot_frame = Frame(0, [Int(0), None], None, 0)
+        machine.snapshot_pc = 5
+
+        other = VM(bytecode, functions)
+        frame, pc = load_image(other, bytecode, dumps_image(machine, bytecode))
+        self.assertEqual(pc, 5)
+        self.assertEqual(frame.variables, [Int(0), None])
+        loaded_obj, loaded_array = other.heap
+        self.assertIs(loaded_obj.map, MAP_TREE.dict_map)
+        self.assertEqual(loaded_obj.get_field('a'), Int(1))
+        self.assertEqual(loaded_obj.get_field('b').repr(), 'x\ny')
+        self.assertEqual(loaded_array.get(0), Int(5))
+        self.assertIs(loaded_array.get(1), intern_str('"s"'))
+
+    def test_wrong_bytecode(self):
+        data = take_image(SOURCE, [3])
+        bytecode, functions = compile_source(SOURCE.replace('100', '200'))
+        machine = VM(bytecode, functions)
+        with self.assertRaises(ImageError) as raised:
+            load_image(machine, bytecode, data)
+        self.assertEqual(raised.exception.message,
+                         'taken running different bytecode')
+        bytecode, functions = compile_source(SOURCE)
+        for broken in ['', data.replace('heap', 'hep'), data[:len(data) // 2]]:
+            self.assertRaises(ImageError, load_image, machine, bytecode,
+                              broken)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import unittest
+from rpython.jit.metainterp.test.support import LLJitMixin
+from rpython.jit.metainterp.warmspot import get_stats
+from jhvm.parser import parse_input
+from jhvm.genast import generate_bytecode
+from jhvm.vm import VirtualMachine as VM, Int
+
+# Recursive, with no loop for a trace to close at.
+FIB = """
+fn main(n) { return fib(n) }
+fn fib(n) {
+    if(n < 2) { return n };
+    return fib(n - 1) + fib(n - 2)
+}
+"""
+
+class TestJit(unittest.TestCase, LLJitMixin):
+
+    def test_recursive_code_is_compiled(self):
+        bytecode, functions = generate_bytecode(parse_input(FIB))
+        bytecode = [str(op) for op in bytecode]
+
+        def run(n):
+            # a fresh list, as the JIT can't take a prebuilt one as green
+            code = [op for op in bytecode]
+            res = VM(code, functions, [n]).interp(code)
+            # not an assert, which py.test would rewrite into non-RPython
+            if not isinstance(res, Int):
+                return -1
+            return res.int_val
+
+        self.assertEqual(self.meta_interp(run, [10], listops = True), 55)
+        stats = get_stats()
+        self.assertGreater(stats.enter_count, 0)
+        self.assertGreater(stats.compiled_count, 0)
+        self.assertEqual(stats.aborted_count, 0)
+
+if __name__ == '__main__':
+    unittest.main()
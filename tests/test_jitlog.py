@@ -0,0 +1,130 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import unittest
+from jhvm.parser import parse_input
+from jhvm.genast import generate_bytecode
+from jhvm.jitlog import parse_log, format_report, function_at
+from jhvm.opcodes import LT_INT_LOOP_IF_TRUE, JUMP_IF_FALSE
+
+SOURCE = """
+    fn main() {
+        s = 0;
+        for(i = 0; i < 100; i = i + 1) {
+            s = s + half(i)
+        };
+        return s
+    }
+
+    fn half(n) {
+        if(n < 50) {
+            return 1
+        };
+        return 2
+    }
+"""
+
+# Shaped like the output of PYPYLOG=jit:<file>; %(...)s are get_location()
+# strings.
+LOG = """\
+[1a0] {jit-tracing
+[1a1] {jit-abort-log
+# Loop 0 (%(loop)s) : noopt with 3 ops
+debug_merge_point(0, 0, '%(branch)s')
+debug_merge_point(0, 0, '%(half)s')
+guard_true(i4, descr=<Guard0xa>) [i1]
+[1a2] jit-abort-log}
+~~~ ABORTING TRACING ABORT_TOO_LONG
+[1a3] jit-tracing}
+[1b0] {jit-log-opt-loop
+# Loop 1 (%(loop)s) : loop with 12 ops
+[i0, i1]
++10: label(i0, i1, descr=TargetToken(4000))
+debug_merge_point(0, 0, '%(loop)s')
++20: guard_true(i2, descr=<Guard0x7f00>) [i0, i1]
+debug_merge_point(0, 0, '%(branch)s')
++30: guard_false(i3, descr=<Guard0x7f10>) [i0, i1]
++40: guard_no_overflow(descr=<Guard0x7f20>) [i0, i1]
++50: jump(i0, i1, descr=TargetToken(4000))
++60: --end of the loop--
+[1b1] jit-log-opt-loop}
+[1c0] {jit-log-opt-bridge
+# bridge out of Guard 0x7f10 with 5 ops
+[i0, i1]
+debug_merge_point(0, 0, '%(ret)s')
++12: guard_class(p2, 1234, descr=<Guard0x7f30>) [i0]
++20: jump(i0, i1, descr=TargetToken(4000))
+[1c1] jit-log-opt-bridge}
+[1d0] {jit-backend-counts
+entry 1:1
+TargetToken(4000):100
+bridge 32528:50
+bridge 32544:3
+[1d1] jit-backend-counts}
+"""
+
+class TestJitLog(unittest.TestCase):
+
+    def setUp(self):
+        self.bytecode, self.functions = generate_bytecode(parse_input(SOURCE))
+        self.loop_pc = self.bytecode.index(LT_INT_LOOP_IF_TRUE)
+        self.half = self.functions[1]
+        self.branch_pc = self.bytecode.index(JUMP_IF_FALSE, self.half.pc)
+        locations = {
+            'loop' : 'LineNo:%d Instr:LT_INT_LOOP_IF_TRUE' % (
+                self.loop_pc + 1),
+            'branch' : 'LineNo:%d Instr:JUMP_IF_FALSE' % (self.branch_pc + 1),
+            'half' : 'LineNo:%d Instr:VAR' % (self.half.pc + 1),
+            'ret' : 'LineNo:%d Instr:RET' % (self.branch_pc + 5),
+        }
+        self.log = parse_log((LOG % locations).splitlines())
+
+    def test_function_at(self):
+        self.assertEqual(function_at(self.functions, 0).name, 'main')
+        self.assertEqual(function_at(self.functions, self.loop_pc).name, 'main')
+        self.assertEqual(function_at(self.functions, self.half.pc).name, 'half')
+        self.assertEqual(function_at(self.functions, self.branch_pc).name,
+                         'half')
+
+    def test_loops_and_bridges(self):
+        self.assertEqual(len(self.log.loops), 1)
+        loop = self.log.loops[0]
+        self.assertEqual((loop.number, loop.op_count), (1, 12))
+        self.assertEqual(loop.location, (self.loop_pc, 'LT_INT_LOOP_IF_TRUE'))
+        self.assertEqual([guard.guard_id for guard in loop.guards],
+                         [0x7f00, 0x7f10, 0x7f20])
+        self.assertEqual(loop.guards[1].location,
+                         (self.branch_pc, 'JUMP_IF_FALSE'))
+        self.assertEqual(self.log.iterations(loop), 100)
+        self.assertEqual(self.log.entry_counts, {1 : 1})
+
+        self.assertEqual(len(self.log.bridges), 1)
+        bridge = self.log.bridges[0]
+        self.assertEqual(bridge.number, 0x7f10)
+        self.assertEqual(bridge.location, (self.branch_pc, 'JUMP_IF_FALSE'))
+        self.assertEqual(len(bridge.guards), 1)
+        self.assertEqual(self.log.failures(0x7f10), 50)
+        self.assertEqual(self.log.failures(0x7f00), 0)
+
+    def test_aborts(self):
+        self.assertEqual(len(self.log.aborts), 1)
+        abort = self.log.aborts[0]
+        self.assertEqual(abort.reason, 'ABORT_TOO_LONG')
+        self.assertEqual(abort.location, (self.branch_pc, 'JUMP_IF_FALSE'))
+
+    def test_report(self):
+        report = format_report(self.log, self.bytecode, self.functions)
+        self.assertIn('1 loop, 1 bridge, 1 aborted trace', report)
+        self.assertIn('Loop 1 at pc %d LT_INT_LOOP_IF_TRUE in main' %
+                      self.loop_pc, report)
+        self.assertIn('12 ops, 2 bytecodes, 3 guards, 1 entry, 100 iterations',
+                      report)
+        self.assertIn('        50  guard_false at pc %d JUMP_IF_FALSE in half'
+                      % self.branch_pc, report)
+        self.assertIn('Bridge out of guard 0x7f10 at pc %d JUMP_IF_FALSE in '
+                      'half' % self.branch_pc, report)
+        self.assertIn('         1  ABORT_TOO_LONG in half', report)
+
+if __name__ == '__main__':
+    unittest.main()
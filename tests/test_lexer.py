@@ -0,0 +1,53 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import glob
+import os
+import unittest
+from rply.errors import LexingError
+from jhvm.lexer import lex, rply_lex
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+def stream(tokens):
+    return [(t.gettokentype(), t.getstr(), t.getsourcepos().idx,
+             t.getsourcepos().lineno, t.getsourcepos().colno) for t in tokens]
+
+class TestLexer(unittest.TestCase):
+
+    def assertSameTokens(self, source):
+        self.assertEqual(stream(lex(source)), stream(rply_lex(source)))
+
+    def test_example_programs(self):
+        for filename in glob.glob(os.path.join(PROJECT_ROOT, '*', '*.jh')):
+            with open(filename) as f:
+                self.assertSameTokens(f.read())
+
+    def test_keywords_and_identifiers(self):
+        self.assertSameTokens('for fortune to tom if iffy else while fn fn_ '
+                              'object objects return returned snapshot '
+                              'snapshots _x x9 9x')
+
+    def test_operators(self):
+        self.assertSameTokens('a==b=c===d<e+f-g.h,i;j(k)[l]{m}')
+
+    def test_positions_across_lines(self):
+        source = '\tfn main() {\r\n\n   x = 1;\n\f\vreturn x\n}\n  '
+        self.assertSameTokens(source)
+        self.assertEqual(stream(lex(source))[-2], ('ID', 'x', 34, 4, 10))
+
+    def test_strings(self):
+        self.assertSameTokens('x = "a b" + "say \\"hi\\"\\n" + "" + "\\\\";')
+        for lexer in (lex, rply_lex):
+            self.assertRaises(LexingError, list, lexer('x = "open'))
+            self.assertRaises(LexingError, list, lexer('x = "a\nb"'))
+
+    def test_illegal_character(self):
+        for lexer in (lex, rply_lex):
+            try:
+                list(lexer('x = 1 ! 2'))
+            except LexingError as e:
+                self.assertEqual(e.getsourcepos().idx, 6)
+            else:
+                self.fail('no LexingError')
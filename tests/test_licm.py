@@ -0,0 +1,174 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import unittest
+from jhvm.parser import parse_input
+from jhvm.genast import generate_bytecode
+from jhvm.closurevm import ClosureMachine
+from jhvm.ast import HoistedLoop, ListBox, Var, BinExp, BinOp
+from jhvm.licm import hoist_invariants
+from jhvm.vm import VirtualMachine as VM, Int
+
+def parse_exp(source):
+    return parse_input('fn f() { return %s }' % source) \
+        .functions.items[0].body.items[0].exp
+
+def hoisted_loops(node):
+    # Every HoistedLoop in a function body, outermost first.
+    loops = []
+    if isinstance(node, HoistedLoop):
+        loops.append(node)
+        children = node.body
+    elif isinstance(node, ListBox):
+        children = node.items
+    else:
+        children = [getattr(node, name) for name in ('then_body', 'else_body',
+                                                     'body')
+                    if hasattr(node, name)]
+    for child in children:
+        loops.extend(hoisted_loops(child))
+    return loops
+
+def run(source, machine_class):
+    bytecode, functions = generate_bytecode(parse_input(source))
+    return machine_class(bytecode, functions).interp(bytecode)
+
+class TestLicm(unittest.TestCase):
+
+    def hoisted(self, source):
+        # The expressions hoisted out of every loop of main, innermost loop
+        # last.
+        function = parse_input(source).functions.items[0]
+        unchanged = repr(function)
+        hoisted = hoist_invariants(function)
+        self.assertEqual(repr(function), unchanged)
+        return [[assign.exp for assign in loop.preheader.items]
+                for loop in hoisted_loops(hoisted.body)]
+
+    def assert_runs(self, source, expected):
+        self.assertEqual(run(source, VM), Int(expected))
+        self.assertEqual(run(source, ClosureMachine), Int(expected))
+
+    def test_fields_and_constants(self):
+        source = """
+            fn main(n) {
+                o = object(x = 3, y = 4);
+                s = 0;
+                for(i = 0; i < n + 1; i = i + 1) {
+                    s = s + (o.x - 1);
+                    o.y = s;
+                    t = o.y + (2 + 3)
+                };
+                return s + t
+            }
+        """
+        self.assertEqual(self.hoisted(source),
+                         [[parse_exp('n + 1'), parse_exp('o.x - 1'),
+                           parse_exp('2 + 3')]])
+        self.assertEqual(run(source.replace('main(n)', 'main()')
+                               .replace('n + 1', '2 + 1'), VM), Int(17))
+
+    def test_writes_keep_code_in_the_loop(self):
+        source = """
+            fn main() {
+                o = object(x = 3);
+                a = [1, 2];
+                for(i = 0; i < 3; i = i + 1) {
+                    s = o.x + a[1];
+                    a[0] = s
+                };
+                while(a[0] < 10) {
+                    s = o.x + a[1];
+                    f(o)
+                };
+                j = 0;
+                while(j < 3) {
+                    s = j + 1;
+                    j = j - 1
+                };
+                return s
+            }
+        """
+        self.assertEqual(self.hoisted(source), [[parse_exp('o.x')]])
+
+    def test_only_code_sure_to_run_is_hoisted(self):
+        source = """
+            fn main(n) {
+                o = object(x = 1);
+                for(i = 0; i < 3; i = i + 1) {
+                    if(n == o.x) {
+                        s = n + 1
+                    } else {
+                        s = n + 2
+                    };
+                    if(n == 2) {
+                        return s
+                    };
+                    s = n + 3
+                };
+                return s
+            }
+        """
+        self.assertEqual(self.hoisted(source),
+                         [[parse_exp('n == o.x'), parse_exp('n == 2')]])
+
+    def test_hoisted_code_is_shared(self):
+        source = """
+            fn main() {
+                o = object(x = 1, y = 2);
+                s = 0;
+                for(i = 0; i < 3; i = i + 1) {
+                    if(i == 1) {
+                        s = s + o.y
+                    };
+                    s = s + o.y
+                };
+                return s
+            }
+        """
+        loop, = hoisted_loops(hoist_invariants(
+            parse_input(source).functions.items[0]).body)
+        self.assertEqual([assign.exp for assign in loop.preheader.items],
+                         [parse_exp('o.y')])
+        self.assertNotIn('FieldAccessor', repr(loop.body))
+        self.assert_runs(source, 8)
+
+    def test_nested_loops(self):
+        source = """
+            fn main() {
+                o = object(x = 2);
+                s = 0;
+                for(i = 0; i < 3; i = i + 1) {
+                    for(j = 0; j < o.x; j = j + 1) {
+                        s = s + (i + o.x)
+                    }
+                };
+                return s
+            }
+        """
+        # The inner loop's hoisted code reads what the outer loop hoisted.
+        self.assertEqual(self.hoisted(source),
+                         [[parse_exp('o.x')],
+                          [Var('$licm2'),
+                           BinExp(BinOp('ADD'), Var('i'), Var('$licm2'))]])
+        self.assert_runs(source, 18)
+
+    def test_loop_that_never_runs(self):
+        # o.y would fail, but the loop body never reaches it.
+        self.assert_runs("""
+            fn main() {
+                o = object(x = 1);
+                s = 0;
+                for(i = 0; i < 0; i = i + 1) {
+                    s = s + o.y
+                };
+                while(s == 1) {
+                    s = s + o.y
+                };
+                return s
+            }
+        """, 0)
+
+if __name__ == '__main__':
+    unittest.main()
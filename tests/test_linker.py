@@ -0,0 +1,65 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import unittest
+from jhvm.parser import parse_input
+from jhvm.genast import generate_bytecode
+from jhvm.linker import compile_module, link_modules, ObjectModule
+from jhvm.vm import VirtualMachine as VM
+
+from jhvm.vm import Int
+
+LIB = """
+    fn add2(x) {
+        return x + two()
+    }
+
+    fn two() {
+        return 2
+    }
+"""
+
+PROG = """
+    fn main() {
+        return add2(3) + 1
+    }
+"""
+
+class TestLinker(unittest.TestCase):
+
+    def module(self, source, name):
+        return compile_module(parse_input(source), name)
+
+    def test_exports_and_imports(self):
+        lib = self.module(LIB, 'lib')
+        prog = self.module(PROG, 'prog')
+        self.assertEqual(lib.exports, ['add2', 'two'])
+        self.assertEqual(lib.imports, [])
+        self.assertEqual(prog.exports, ['main'])
+        self.assertEqual(prog.imports, ['add2'])
+
+    def test_link_matches_single_file_compile(self):
+        lib = self.module(LIB, 'lib')
+        prog = self.module(PROG, 'prog')
+        # main is laid out first whatever the module order
+        bytecode, functions = link_modules([lib, prog])
+        self.assertEqual((bytecode, functions),
+                         generate_bytecode(parse_input(PROG + LIB)))
+        self.assertEqual(VM(bytecode, functions).interp(bytecode), Int(6))
+
+    def test_dumps_loads(self):
+        lib = self.module(LIB, 'lib')
+        self.assertEqual(ObjectModule.loads(lib.dumps()), lib)
+
+    def test_unresolved_import(self):
+        self.assertRaises(ValueError, link_modules, [self.module(PROG, 'prog')])
+
+    def test_duplicate_export(self):
+        lib = self.module(LIB, 'lib')
+        other = self.module(LIB, 'other')
+        self.assertRaises(ValueError, link_modules,
+                          [self.module(PROG, 'prog'), lib, other])
+
+    def test_missing_entry_point(self):
+        self.assertRaises(ValueError, link_modules, [self.module(LIB, 'lib')])
@@ -0,0 +1,113 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import unittest
+from jhvm.parser import parse_input
+from jhvm.genast import generate_bytecode, compile_function
+from jhvm.closurevm import ClosureMachine
+from jhvm.opcodes import *
+from jhvm.vm import VirtualMachine as VM, Int
+
+def compile_main(source):
+    return compile_function(parse_input(source).functions.items[0])
+
+class TestLiveness(unittest.TestCase):
+
+    def assert_runs(self, source, expected):
+        bytecode, functions = generate_bytecode(parse_input(source))
+        self.assertEqual(VM(bytecode, functions).interp(bytecode),
+                         Int(expected))
+        self.assertEqual(ClosureMachine(bytecode, functions)
+                         .interp(bytecode), Int(expected))
+
+    def test_chain_shares_a_slot(self):
+        source = """
+            fn main() {
+                a = 1;
+                b = a + 1;
+                c = b + 1;
+                return c
+            }
+        """
+        function = compile_main(source)
+        self.assertEqual(function.var_count, 1)
+        self.assertEqual(function.code, [CONST_INT, '0', CONST_INT, '1', ASSIGN,
+                                         CONST_INT, '0', VAR, '0', CONST_INT,
+                                         '1', ADD_INT, ASSIGN,
+                                         CONST_INT, '0', VAR, '0', CONST_INT,
+                                         '1', ADD_INT, ASSIGN,
+                                         VAR, '0', RET])
+        self.assert_runs(source, 3)
+
+    def test_overlapping_values(self):
+        self.assertEqual(compile_main("""
+            fn main() {
+                a = 1;
+                b = 2;
+                return a + b
+            }
+        """).var_count, 2)
+
+    def test_loop_carried_values(self):
+        # s and i live around the loop, and t while they are; u reuses a
+        # slot once the loop is done.
+        source = """
+            fn main() {
+                s = 0;
+                for(i = 0; i < 3; i = i + 1) {
+                    t = i + 1;
+                    s = s + t
+                };
+                u = s + 1;
+                v = u + u;
+                return v
+            }
+        """
+        self.assertEqual(compile_main(source).var_count, 3)
+        self.assert_runs(source, 14)
+
+    def test_value_live_across_the_back_edge(self):
+        # x is read at the top of every iteration and still needed when y
+        # is assigned, so y must not take its slot.
+        source = """
+            fn main() {
+                x = 1;
+                s = 0;
+                for(i = 0; i < 3; i = i + 1) {
+                    s = s + x;
+                    y = s + 10;
+                    x = x + y
+                };
+                return s
+            }
+        """
+        self.assertEqual(compile_main(source).var_count, 4)
+        self.assert_runs(source, 48)
+
+    def test_params_are_pinned(self):
+        source = """
+            fn main() {
+                return f(1, 2) + g(3, 4)
+            }
+
+            fn f(a, b) {
+                c = a + 10;
+                return c + b
+            }
+
+            fn g(a, b) {
+                c = b;
+                return c
+            }
+        """
+        f, g = [compile_function(function)
+                for function in parse_input(source).functions.items[1:]]
+        # c takes the slot of a, which is dead by then, never that of b.
+        self.assertEqual((f.arity, f.var_count), (2, 2))
+        self.assertEqual(f.code[:2], [CONST_INT, '0'])
+        self.assertEqual((g.arity, g.var_count), (2, 2))
+        self.assert_runs(source, 17)
+
+if __name__ == '__main__':
+    unittest.main()
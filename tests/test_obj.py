@@ -0,0 +1,111 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import unittest
+from jhvm.vm import Obj, MapTree, Int, Bool, get_shape, new_obj_with_shape
+
+class TestObjStorage(unittest.TestCase):
+
+    def test_int_fields_are_unboxed(self):
+        obj = Obj()
+        obj.set_field('a', Int(1))
+        obj.set_field('b', Bool(True))
+        obj.set_field('a', Int(2))
+        self.assertEqual(obj.int_values, [2])
+        self.assertEqual(len(obj.field_values), 1)
+        self.assertEqual(obj.get_field('a'), Int(2))
+        self.assertTrue(obj.get_field('b').bool_val)
+
+    def test_non_int_write_generalizes_field(self):
+        obj = Obj()
+        obj.set_field('a', Int(1))
+        obj.set_field('b', Int(2))
+        obj.set_field('c', Int(3))
+        obj.set_field('b', Bool(False))
+        self.assertEqual(obj.int_values, [1, 3])
+        self.assertEqual(len(obj.field_values), 1)
+        self.assertEqual(obj.map.fields, ['a', 'b', 'c'])
+        self.assertEqual(obj.get_field('a'), Int(1))
+        self.assertFalse(obj.get_field('b').bool_val)
+        self.assertEqual(obj.get_field('c'), Int(3))
+
+        # Objects built the same way afterwards keep b boxed from the start
+        # and end up sharing the generalized map.
+        other = Obj()
+        other.set_field('a', Int(4))
+        other.set_field('b', Int(5))
+        other.set_field('c', Int(6))
+        self.assertEqual(other.field_values, [Int(5)])
+        self.assertIs(other.map, obj.map)
+
+    def test_object_literal_gets_final_map(self):
+        obj = new_obj_with_shape(get_shape('p,q,r'),
+                                 [Int(1), Bool(True), Int(3)])
+        other = Obj()
+        other.set_field('p', Int(4))
+        other.set_field('q', Bool(False))
+        other.set_field('r', Int(6))
+        self.assertIs(obj.map, other.map)
+        self.assertEqual(obj.int_values, [1, 3])
+        self.assertTrue(obj.get_field('q').bool_val)
+        self.assertIs(get_shape('p,q,r'), get_shape('p,q,r'))
+
+    def test_maps_are_shared(self):
+        objs = [Obj(), Obj()]
+        for obj in objs:
+            obj.set_field('x', Int(0))
+            obj.set_field('y', Bool(True))
+        self.assertIs(objs[0].map, objs[1].map)
+
+class TestDictMode(unittest.TestCase):
+
+    def test_transition_limit(self):
+        tree = MapTree(max_maps = 100, max_transitions = 2)
+        objs = []
+        for name in ['a', 'b', 'c']:
+            obj = Obj(tree.root)
+            obj.set_field('x', Int(0))
+            obj.set_field(name, Int(1))
+            objs.append(obj)
+        self.assertFalse(objs[0].map.dict_mode)
+        self.assertFalse(objs[1].map.dict_mode)
+        self.assertIs(objs[2].map, tree.dict_map)
+        self.assertEqual(objs[2].get_field('x'), Int(0))
+        self.assertEqual(objs[2].get_field('c'), Int(1))
+        self.assertRaises(AttributeError, objs[2].get_field, 'a')
+        self.assertEqual(tree.transition_limit_hits, 1)
+        self.assertEqual(tree.map_limit_hits, 0)
+
+    def test_map_limit(self):
+        tree = MapTree(max_maps = 4, max_transitions = 100)
+        obj = Obj(tree.root)
+        for i in range(5):
+            obj.set_field('f%d' % i, Int(i))
+        self.assertTrue(obj.map.dict_mode)
+        self.assertEqual(tree.map_count, 4)
+        self.assertEqual(tree.map_limit_hits, 1)
+        obj.set_field('f0', Bool(True))
+        self.assertTrue(obj.get_field('f0').bool_val)
+        self.assertEqual(obj.get_field('f4'), Int(4))
+
+    def test_object_literal_past_the_limit(self):
+        tree = MapTree(max_maps = 3, max_transitions = 100)
+        obj = new_obj_with_shape(get_shape('a,b'), [Int(1), Int(2)],
+                                 tree.root)
+        self.assertIs(obj.map, tree.dict_map)
+        self.assertEqual(obj.get_field('b'), Int(2))
+        self.assertEqual(tree.map_limit_hits, 1)
+
+    def test_generalizing_past_the_limit(self):
+        tree = MapTree(max_maps = 4, max_transitions = 100)
+        obj = Obj(tree.root)
+        obj.set_field('a', Int(1))
+        obj.set_field('b', Int(2))
+        obj.set_field('a', Bool(False))
+        self.assertTrue(obj.map.dict_mode)
+        self.assertFalse(obj.get_field('a').bool_val)
+        self.assertEqual(obj.get_field('b'), Int(2))
+        # only the switch counts, not deprecate_int_field's lookups
+        self.assertEqual(tree.map_limit_hits, 1)
+        self.assertEqual(tree.transition_limit_hits, 0)
@@ -0,0 +1,54 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import unittest
+from jhvm.parser import parse_input
+from jhvm.genast import generate_bytecode
+from jhvm.profiler import MemoryProfiler
+from jhvm.vm import VirtualMachine as VM
+
+SOURCE = """
+    fn main() {
+        for(i = 0; i < 5; i = i + 1) {
+            p = object();
+            p.x = i;
+            p.y = array(2)
+        };
+        q = object();
+        q.x = 1 == 1;
+        return 0
+    }
+"""
+
+class TestMemoryProfiler(unittest.TestCase):
+
+    def setUp(self):
+        bytecode, functions = generate_bytecode(parse_input(SOURCE))
+        self.profiler = MemoryProfiler()
+        self.machine = VM(bytecode, functions, profiler = self.profiler)
+        self.machine.interp(bytecode)
+
+    def test_allocation_sites(self):
+        counts = sorted(self.profiler.allocations.values())
+        self.assertEqual(counts, [1, 5, 5])
+        self.assertEqual(self.profiler.peak_heap_size, 11)
+
+    def test_objects_by_map(self):
+        objects_by_map, arrays_by_storage = \
+            self.profiler.live_objects(self.machine.heap)
+        self.assertEqual(objects_by_map, {'{x:int, y:int}' : 5, '{x}' : 1})
+        self.assertEqual(arrays_by_storage, {'int array' : 5})
+
+    def test_transitions(self):
+        self.assertEqual(self.profiler.transitions,
+                         {'{} -> {x:int}' : 5,
+                          '{x:int} -> {x:int, y:int}' : 5,
+                          '{} -> {x}' : 1})
+
+    def test_report_lists_most_frequent_first(self):
+        report = self.profiler.report(self.machine.heap)
+        self.assertIn('peak heap size: 11', report)
+        section = report.split('Live objects by map:\n')[1]
+        self.assertTrue(section.startswith('         5  {x:int, y:int}\n'
+                                           '         1  {x}\n'))
@@ -0,0 +1,96 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from jhvm.parser import parse_input
+from jhvm.genast import generate_bytecode
+from jhvm.bcfile import dumps
+from jhvm.server import (ProgramCache, handle_request, format_request,
+                         worker_loop, run_on_server, ServerError)
+
+from rpython.rlib.rsocket import RSocket, UNIXAddress, AF_UNIX, SOCK_STREAM
+
+SOURCE = """
+    fn main(n, m) {
+        x = 0;
+        for(i = 0; i < n; i = i + 1) {
+            x = x + m
+        };
+        return x
+    }
+"""
+
+def compile_source(source):
+    return dumps(*generate_bytecode(parse_input(source)))
+
+class TestHandleRequest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = compile_source(SOURCE)
+
+    def test_args_are_passed_to_main(self):
+        cache = ProgramCache()
+        request = format_request(self.data, [4, 5])
+        self.assertEqual(handle_request(cache, request), 'ok 20\n')
+
+    def test_programs_are_reused(self):
+        cache = ProgramCache()
+        program = cache.get(self.data)
+        handle_request(cache, format_request(self.data, [1, 1]))
+        self.assertIs(cache.get(self.data), program)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_cache_is_bounded(self):
+        cache = ProgramCache(max_programs = 1)
+        cache.get(self.data)
+        cache.get(compile_source('fn main() { return 1 }'))
+        self.assertEqual(len(cache.programs), 1)
+
+    def test_programs_have_their_own_map_trees(self):
+        # More shapes between them than one tree has room for.
+        cache = ProgramCache()
+        for i in range(300):
+            fields = ', '.join(['f%d_%d = %d' % (i, j, j) for j in range(4)])
+            data = compile_source('fn main() { o = object(%s); o.g = 1; '
+                                  'return o.f%d_3 + o.g }' % (fields, i))
+            self.assertEqual(handle_request(cache, format_request(data)),
+                             'ok 4\n')
+            tree = cache.get(data).map_tree
+            self.assertEqual(tree.map_limit_hits, 0)
+            self.assertEqual(tree.map_count, 7)
+
+    def test_errors(self):
+        cache = ProgramCache()
+        self.assertEqual(handle_request(cache, 'x\n' + self.data),
+                         'error malformed request\n')
+        self.assertEqual(handle_request(cache, '\n'), 'error no program\n')
+        failing = compile_source('fn main() { a = [1]; return a[1] }')
+        self.assertEqual(handle_request(cache, format_request(failing)),
+                         'error program failed\n')
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'jhvm.sock')
+        sock = RSocket(AF_UNIX, SOCK_STREAM)
+        sock.bind(UNIXAddress(self.path))
+        sock.listen(1)
+        # A worker without the forking, in this process.
+        worker = threading.Thread(target = worker_loop, args = (sock,))
+        worker.daemon = True
+        worker.start()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_run_on_server(self):
+        data = compile_source(SOURCE)
+        self.assertEqual(run_on_server(self.path, data, [3, 7]), '21')
+        self.assertEqual(run_on_server(self.path, data, [2, 2]), '4')
+        self.assertRaises(ServerError, run_on_server, self.path, '')
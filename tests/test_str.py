@@ -0,0 +1,86 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import unittest
+from jhvm.bcfile import dumps, loads, quote_str, unquote_str, FunctionInfo
+from jhvm.genast import generate_bytecode
+from jhvm.opcodes import CONST_STR, EOB, RET
+from jhvm.parser import parse_input
+from jhvm.vm import (StrLiteral, StrRope, Int, intern_str, ROPE_MIN_LENGTH,
+                     VirtualMachine as VM)
+
+class TestStrings(unittest.TestCase):
+
+    def test_constants_are_interned(self):
+        a = intern_str('"hello"')
+        self.assertTrue(a is intern_str('"hello"'))
+        self.assertTrue(a is intern_str('"\\hello"'))
+        self.assertTrue(a.eq(intern_str('"hello"')).bool_val)
+        self.assertFalse(a.eq(intern_str('"world"')).bool_val)
+
+    def test_short_concatenation_is_flat(self):
+        s = intern_str('"ab"').add(intern_str('"cd"'))
+        self.assertTrue(isinstance(s, StrLiteral))
+        self.assertFalse(s.is_interned())
+        self.assertTrue(s.eq(intern_str('"abcd"')).bool_val)
+
+    def test_rope_is_flattened_once(self):
+        part = StrLiteral('x' * ROPE_MIN_LENGTH)
+        rope = part.add(part)
+        self.assertTrue(isinstance(rope, StrRope))
+        self.assertEqual(rope.flat, None)
+        self.assertEqual(rope.length(), 2 * ROPE_MIN_LENGTH)
+        self.assertEqual(rope.repr(), 'x' * 2 * ROPE_MIN_LENGTH)
+        self.assertEqual((rope.left, rope.right), (None, None))
+        bigger = rope.add(StrLiteral('y'))
+        self.assertEqual(bigger.repr(), 'x' * 2 * ROPE_MIN_LENGTH + 'y')
+
+    def test_deep_rope(self):
+        s = StrLiteral('')
+        for i in range(100000):
+            s = s.add(StrLiteral('%d,' % (i % 10)))
+        self.assertEqual(s.length(), 200000)
+        self.assertEqual(s.repr()[:8], '0,1,2,3,')
+        self.assertTrue(s.eq(StrLiteral(s.repr())).bool_val)
+
+    def test_compare(self):
+        part = StrLiteral('a' * ROPE_MIN_LENGTH)
+        self.assertTrue(part.lt(part.add(part)).bool_val)
+        self.assertFalse(part.add(part).lt(part).bool_val)
+        self.assertFalse(part.eq(part.add(part)).bool_val)
+        self.assertTrue(part.neq(part.add(part)).bool_val)
+        self.assertFalse(part.eq(Int(1)).bool_val)
+
+    def test_quoting(self):
+        for value in ['', 'plain', 'line\nbreak\ttab', 'say "hi"', 'back\\',
+                      EOB, 'cr\rlf\r\n',
+                      ''.join([chr(i) for i in range(256)])]:
+            quoted = quote_str(value)
+            self.assertEqual(len(quoted.splitlines()), 1)
+            self.assertNotEqual(quoted, EOB)
+            self.assertEqual(unquote_str(quoted), value)
+
+    def test_string_operands_in_bytecode_files(self):
+        bytecode = [CONST_STR, quote_str('two\nlines'), RET]
+        data = dumps(bytecode, [FunctionInfo(0, 0, 1, 0, 'main')])
+        loaded, functions = loads(data)
+        self.assertEqual(loaded, bytecode)
+        res = VM(loaded, functions).interp(loaded)
+        self.assertEqual(res.repr(), 'two\nlines')
+
+    def test_unquoting_hex_escapes(self):
+        self.assertEqual(unquote_str('"\\x41\\x0A"'), 'A\n')
+        self.assertEqual(unquote_str('"\\x4"'), 'x4')
+        self.assertEqual(unquote_str('"\\xzz"'), 'xzz')
+
+    def test_control_characters_survive_bytecode_files(self):
+        source = 'fn main() { return "a\rb\x0bc\x1cd" }'
+        bytecode, functions = generate_bytecode(parse_input(source))
+        loaded, functions = loads(dumps(bytecode, functions))
+        self.assertEqual(loaded, bytecode)
+        res = VM(loaded, functions).interp(loaded)
+        self.assertEqual(res.repr(), 'a\rb\x0bc\x1cd')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import unittest
+from jhvm.parser import parse_input
+from jhvm.genast import generate_bytecode
+from jhvm.closurevm import ClosureMachine
+from jhvm.synthetic import ProgramSpec, generate_program
+from jhvm.vm import VirtualMachine as VM
+
+class TestSyntheticPrograms(unittest.TestCase):
+
+    def run_on(self, vm_class, program):
+        bytecode, functions = generate_bytecode(parse_input(program.source))
+        return vm_class(bytecode, functions).interp(bytecode).int_val
+
+    def test_deterministic_by_seed(self):
+        first = generate_program(ProgramSpec(seed = 3))
+        again = generate_program(ProgramSpec(seed = 3))
+        other = generate_program(ProgramSpec(seed = 4))
+        self.assertEqual(first.source, again.source)
+        self.assertEqual(first.expected, again.expected)
+        self.assertNotEqual(first.source, other.source)
+
+    def test_expected_results(self):
+        for seed in range(4):
+            for loop_depth in range(3):
+                spec = ProgramSpec(functions = 6, loop_depth = loop_depth,
+                                   expr_depth = 2, call_depth = 2,
+                                   seed = seed)
+                program = generate_program(spec)
+                self.assertEqual(self.run_on(VM, program), program.expected)
+                self.assertEqual(self.run_on(ClosureMachine, program),
+                                 program.expected)
+
+    def test_size_follows_spec(self):
+        small = generate_program(ProgramSpec(functions = 4))
+        large = generate_program(ProgramSpec(functions = 40))
+        self.assertEqual(large.source.count('fn '), 41)
+        self.assertTrue(len(large.source) > 5 * len(small.source))
+        deep = generate_program(ProgramSpec(loop_depth = 4))
+        self.assertIn('for(l = 0;', deep.source)
+        shapes = generate_program(ProgramSpec(functions = 40, shapes = 6))
+        self.assertIn('s5_0 = ', shapes.source)
+
+    def test_call_depth(self):
+        program = generate_program(ProgramSpec(functions = 3,
+                                               call_depth = 0))
+        self.assertNotIn('c = f_', program.source)
+        self.assertEqual(program.source.count('(s + f_'), 3)
+
+    def test_bad_spec(self):
+        self.assertRaises(ValueError, ProgramSpec, functions = 0)
+        self.assertRaises(ValueError, ProgramSpec, loop_depth = 7)
+
+if __name__ == '__main__':
+    unittest.main()
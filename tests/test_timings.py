@@ -0,0 +1,61 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import unittest
+from jhvm.parser import parse_input
+from jhvm.genast import generate_bytecode
+from jhvm.linker import compile_module
+from jhvm.timings import Timings
+
+SOURCE = """
+    fn main() {
+        return helper(1)
+    }
+
+    fn helper(n) {
+        for(i = 0; i < 3; i = i + 1) {
+            n = n + i
+        };
+        return n
+    }
+"""
+
+class TestTimings(unittest.TestCase):
+
+    def test_pipeline_stages(self):
+        timings = Timings()
+        ast = parse_input(SOURCE, timings)
+        self.assertEqual(ast, parse_input(SOURCE))
+        self.assertEqual(generate_bytecode(ast, timings),
+                         generate_bytecode(ast))
+        self.assertEqual([stage.name for stage in timings.stages],
+                         ['lex', 'parse', 'ast passes', 'codegen', 'liveness',
+                          'assemble', 'link'])
+        for stage in timings.stages:
+            self.assertEqual(stage.runs, 1)
+            self.assertTrue(stage.seconds >= 0)
+            self.assertTrue(stage.peak_rss > 0)
+
+    def test_stages_add_up(self):
+        timings = Timings()
+        for name in ['first', 'second']:
+            compile_module(parse_input(SOURCE, timings), name,
+                           timings = timings)
+        self.assertEqual([stage.runs for stage in timings.stages],
+                         [2, 2, 2, 2, 2, 2])
+        self.assertAlmostEqual(timings.total(),
+                               sum([s.seconds for s in timings.stages]))
+
+    def test_report(self):
+        timings = Timings()
+        with timings.stage('lex'):
+            pass
+        lines = timings.report().split('\n')
+        self.assertEqual(lines[0].split(),
+                         ['stage', 'time', '%', 'peak', 'RSS', 'RSS', 'growth'])
+        self.assertTrue(lines[1].startswith('lex '))
+        self.assertTrue(lines[2].startswith('total '))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Annotates and rtypes targetjhvm as `rpython --rtype targetjhvm.py` does,
+# without compiling. Run in a process of its own, as translation leaves
+# global state behind.
+RTYPE_TARGET = """
+import sys
+sys.path.insert(0, %r)
+from rpython.config.translationoption import (get_combined_translation_config,
+                                              set_opt_level, DEFAULT_OPT_LEVEL)
+from rpython.translator.driver import TranslationDriver
+import targetjhvm
+config = get_combined_translation_config(translating = True)
+set_opt_level(config, DEFAULT_OPT_LEVEL)
+driver = TranslationDriver.from_targetspec(targetjhvm.__dict__, config, [])
+driver.proceed(['rtype_lltype'])
+""" % ROOT
+
+class TestTranslation(unittest.TestCase):
+
+    def test_target_rtypes(self):
+        process = subprocess.Popen([sys.executable, '-c', RTYPE_TARGET],
+                                   cwd = ROOT, stdout = subprocess.PIPE,
+                                   stderr = subprocess.STDOUT)
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            self.fail('translation failed:\n' + output[-3000:])
+
+if __name__ == '__main__':
+    unittest.main()
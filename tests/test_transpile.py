@@ -0,0 +1,158 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import unittest
+from jhvm.parser import parse_input
+from jhvm.genast import generate_bytecode
+from jhvm.transpile import compile_program, run_program, transpile
+from jhvm.vm import VirtualMachine as VM
+
+from jhvm.vm import Int
+
+class TestTranspile(unittest.TestCase):
+
+    def run_source(self, source, *args):
+        return run_program(parse_input(source), *args)
+
+    def test_function_calls(self):
+        source = """
+            fn main() {
+                return b(1, 2)
+            }
+
+            fn b(x, y) {
+                return c(x, y, 3)
+            }
+
+            fn c(x, y, z) {
+                return 10 - (x + y + z)
+            }
+        """
+        self.assertEqual(self.run_source(source), 4)
+
+    def test_for_loop_becomes_while_loop(self):
+        source = """
+            fn main() {
+                x = 10;
+                for(i = 0; i < 100; i = i + 1) {
+                    x = x + 1
+                };
+                return x
+            }
+        """
+        self.assertIn('while (v_i < 100):', transpile(parse_input(source)))
+        self.assertEqual(self.run_source(source), 110)
+
+    def test_objects_and_branches(self):
+        source = """
+            fn main() {
+                x = object();
+                x.bye = 10;
+                if(x.bye == 10) {
+                    x.hello = x.bye
+                }
+                else {
+                    x.hello = 0
+                };
+                return x.hello + x.bye
+            }
+        """
+        self.assertEqual(self.run_source(source), 20)
+
+    def test_missing_field_raises(self):
+        source = """
+            fn main() {
+                x = object();
+                return x.nope
+            }
+        """
+        self.assertRaises(AttributeError, self.run_source, source)
+
+    def test_functions_are_callable_from_python(self):
+        source = """
+            fn main() {
+                return 0
+            }
+
+            fn sum(n) {
+                if(n == 0) {
+                    return 0
+                };
+                return n + sum(n - 1)
+            }
+        """
+        program = compile_program(parse_input(source))
+        self.assertEqual(program.functions['sum'](100), 5050)
+
+    def test_matches_interp(self):
+        source = """
+            fn main() {
+                x = object();
+                x.a = 3;
+                for(i = 0; i < 50; i = i + 1) {
+                    x.a = step(x.a, i)
+                };
+                return x.a
+            }
+
+            fn step(a, i) {
+                if(i < 25) {
+                    return a + i
+                };
+                return a - 1
+            }
+        """
+        bytecode, functions = generate_bytecode(parse_input(source))
+        expected = VM(bytecode, functions).interp(bytecode)
+        self.assertEqual(Int(self.run_source(source)), expected)
+
+    def test_arrays_are_lists(self):
+        source = """
+            fn main() {
+                a = [1, 2, 3];
+                b = array(3);
+                for(i = 0; i < 3; i = i + 1) {
+                    b[i] = a[i] + 10
+                };
+                return b
+            }
+        """
+        self.assertEqual(self.run_source(source), [11, 12, 13])
+
+    def test_while_loop(self):
+        source = """
+            fn main(n) {
+                x = 1;
+                while(0 < n) {
+                    x = x + x;
+                    n = n - 1
+                };
+                return x
+            }
+        """
+        self.assertEqual(self.run_source(source, 10), 1024)
+
+    def test_object_literal(self):
+        source = """
+            fn main() {
+                p = object(x = 3, y = 4);
+                return p.x + p.y
+            }
+        """
+        self.assertEqual(self.run_source(source), 7)
+
+    def test_strings(self):
+        source = """
+            fn main() {
+                s = "";
+                for(i = 0; i < 3; i = i + 1) {
+                    s = s + "a\\n"
+                };
+                if(s == "a\\na\\na\\n") {
+                    return s
+                };
+                return ""
+            }
+        """
+        self.assertEqual(self.run_source(source), 'a\na\na\n')
@@ -0,0 +1,129 @@
+# vim: ai ts=4 sts=4 et sw=4
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import unittest
+from jhvm.parser import parse_input
+from jhvm.genast import generate_bytecode
+from jhvm.closurevm import ClosureMachine
+from jhvm.ast import Node, BinExp
+from jhvm.opcodes import *
+from jhvm.typeinfer import infer_types, INT, STR, REF, UNKNOWN
+from jhvm.vm import VirtualMachine as VM, Int
+
+def binexps(node):
+    # Every BinExp in node.
+    found = []
+    if isinstance(node, BinExp):
+        found.append(node)
+    if isinstance(node, list):
+        children = node
+    elif isinstance(node, Node):
+        children = node.__dict__.values()
+    else:
+        return found
+    for child in children:
+        found.extend(binexps(child))
+    return found
+
+def opcodes(bytecode):
+    ops = []
+    pc = 0
+    while pc < len(bytecode):
+        ops.append(bytecode[pc])
+        pc += int(HAS_ARGS[int(bytecode[pc])]) + 1
+    return ops
+
+class TestTypeInference(unittest.TestCase):
+
+    def operand_types(self, source):
+        function = parse_input(source).functions.items[0]
+        info = infer_types(function)
+        # Sorted, as the nodes are found in no particular order.
+        return sorted([info.operands(node) for node in binexps(function.body)])
+
+    def test_int_loop_is_specialized(self):
+        source = """
+            fn main() {
+                s = 0;
+                for(i = 0; i < 10; i = i + 1) {
+                    if(i == 3) {
+                        s = s - 1
+                    } else {
+                        s = s + i
+                    }
+                };
+                return s
+            }
+        """
+        bytecode, functions = generate_bytecode(parse_input(source))
+        ops = opcodes(bytecode)
+        # i == 3 is not fused, so a plain JUMP_IF_FALSE follows EQ_INT.
+        for generic in (ADD, SUB, EQ, LT, LOOP_IF_TRUE):
+            self.assertNotIn(generic, ops)
+        for specialized in (ADD_INT, SUB_INT, EQ_INT, LT_INT_JUMP_IF_FALSE,
+                            LT_INT_LOOP_IF_TRUE):
+            self.assertIn(specialized, ops)
+        self.assertEqual(VM(bytecode, functions).interp(bytecode), Int(41))
+        self.assertEqual(ClosureMachine(bytecode, functions).interp(bytecode),
+                         Int(41))
+
+    def test_unknown_values_stay_generic(self):
+        source = """
+            fn main(n) {
+                o = object(x = 1);
+                a = n + 1;
+                b = o.x + 1;
+                c = o + 1;
+                d = f(1) + 1;
+                return a
+            }
+        """
+        self.assertEqual(self.operand_types(source),
+                         [(REF, INT), (UNKNOWN, INT), (UNKNOWN, INT),
+                          (UNKNOWN, INT)])
+
+    def test_types_are_joined(self):
+        source = """
+            fn main(n) {
+                x = 1;
+                y = 1;
+                if(n) {
+                    x = "one"
+                } else {
+                    y = 2
+                };
+                return (x + 1) + (y + 1)
+            }
+        """
+        self.assertEqual(self.operand_types(source),
+                         [(INT, INT), (UNKNOWN, INT), (UNKNOWN, INT)])
+
+    def test_loop_reaches_fixpoint(self):
+        # s is an int on the first iteration only.
+        source = """
+            fn main() {
+                s = 0;
+                t = 0;
+                for(i = 0; i < 10; i = i + 1) {
+                    t = s + 1;
+                    s = "a"
+                };
+                return t
+            }
+        """
+        self.assertEqual(self.operand_types(source),
+                         [(INT, INT), (INT, INT), (UNKNOWN, INT)])
+
+    def test_strings(self):
+        source = """
+            fn main() {
+                s = "a" + "b";
+                return s + "c"
+            }
+        """
+        self.assertEqual(self.operand_types(source),
+                         [(STR, STR), (STR, STR)])
+
+if __name__ == '__main__':
+    unittest.main()
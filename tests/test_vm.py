@@ -15,15 +15,31 @@ class TestVirtualMachine(unittest.TestCase):
     def compile(self, source):
         ast = parse_input(source)
         print ast
-        bytecode, fn_var_map = generate_bytecode(ast)
+        bytecode, functions = generate_bytecode(ast)
         bytecode = [str(op) for op in bytecode]
-        print fn_var_map
-        return bytecode, fn_var_map
+        print functions
+        return bytecode, functions
 
-    def run_prog(self, bytecode, fn_var_map):
-        machine = VM(bytecode, fn_var_map)
+    def run_prog(self, bytecode, functions, args = None):
+        machine = VM(bytecode, functions, args)
         return machine.interp(bytecode)
 
+    def test_args_fill_only_the_parameters(self):
+        bytecode, functions = self.compile("""
+            fn main(a) {
+                b = 2;
+                return a + b
+            }
+        """)
+        self.assertEqual(self.run_prog(bytecode, functions, [3]), Int(5))
+        bytecode, functions = self.compile("""
+            fn main(a) {
+                return b + c
+            }
+        """)
+        self.assertRaises(Exception, self.run_prog, bytecode, functions,
+                          [1, 2])
+
     def test_simple_function_call(self):
         source = """
             fn main() {
@@ -36,8 +52,8 @@ class TestVirtualMachine(unittest.TestCase):
 
         """
 
-        bytecode, fn_var_map = self.compile(source)
-        res = self.run_prog(bytecode, fn_var_map)
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
         self.assertEqual(res, Int(55))
 
     def test_multilevel_function_call(self):
@@ -55,8 +71,8 @@ class TestVirtualMachine(unittest.TestCase):
             }
         """
 
-        bytecode, fn_var_map = self.compile(source)
-        res = self.run_prog(bytecode, fn_var_map)
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
         self.assertEqual(res, Int(4))
 
 
@@ -71,8 +87,8 @@ class TestVirtualMachine(unittest.TestCase):
             }
         """
 
-        bytecode, fn_var_map = self.compile(source)
-        res = self.run_prog(bytecode, fn_var_map)
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
         self.assertEqual(res, Int(110))
 
     def test_simple_object(self):
@@ -83,8 +99,8 @@ class TestVirtualMachine(unittest.TestCase):
                 return x.hello
             }
         """
-        bytecode, fn_var_map = self.compile(source)
-        res = self.run_prog(bytecode, fn_var_map)
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
         self.assertEqual(res, Int(5))
 
     def test_object_across_funcs(self):
@@ -100,8 +116,8 @@ class TestVirtualMachine(unittest.TestCase):
                 return x.hello + x.bye
             }
         """
-        bytecode, fn_var_map = self.compile(source)
-        res = self.run_prog(bytecode, fn_var_map)
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
         self.assertEqual(res, Int(20))
 
     def test_if_statement(self):
@@ -113,8 +129,8 @@ class TestVirtualMachine(unittest.TestCase):
                 return x
             }
         """
-        bytecode, fn_var_map = self.compile(source)
-        res = self.run_prog(bytecode, fn_var_map)
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
         self.assertEqual(res, Int(1))
 
     def test_if_else_statement(self):
@@ -136,11 +152,227 @@ class TestVirtualMachine(unittest.TestCase):
                 return x
             }
         """
-        bytecode, fn_var_map = self.compile(source)
-        res = self.run_prog(bytecode, fn_var_map)
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
         self.assertEqual(res, Int(3))
 
+    def test_array_literal(self):
+        source = """
+            fn main() {
+                a = [3, 4, 5];
+                return a[0] + a[2]
+            }
+        """
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
+        self.assertEqual(res, Int(8))
 
+    def test_array_literal_lengths(self):
+        source = """
+            fn main() {
+                a = [];
+                b = [7];
+                return b[0]
+            }
+        """
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
+        self.assertEqual(res, Int(7))
 
+    def test_new_array_in_loop(self):
+        source = """
+            fn main() {
+                a = array(10);
+                for(i = 0; i < 10; i = i + 1) {
+                    a[i] = i + 1
+                };
+                return sum(a, 10)
+            }
 
+            fn sum(a, n) {
+                x = 0;
+                for(i = 0; i < n; i = i + 1) {
+                    x = x + a[i]
+                };
+                return x
+            }
+        """
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
+        self.assertEqual(res, Int(55))
 
+    def test_array_storage_generalizes(self):
+        source = """
+            fn main() {
+                a = [1, 2];
+                b = 1 == 1;
+                a[0] = b;
+                if(a[0]) {
+                    return a[1]
+                };
+                return 0
+            }
+        """
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
+        self.assertEqual(res, Int(2))
+
+    def test_array_in_object(self):
+        source = """
+            fn main() {
+                x = object();
+                x.items = array(2);
+                a = x.items;
+                a[1] = 7;
+                b = x.items;
+                return b[1]
+            }
+        """
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
+        self.assertEqual(res, Int(7))
+
+    def test_array_index_out_of_range(self):
+        source = """
+            fn main() {
+                a = [1, 2];
+                return a[2]
+            }
+        """
+        bytecode, functions = self.compile(source)
+        self.assertRaises(IndexError, self.run_prog, bytecode, functions)
+
+    def test_field_changes_type(self):
+        source = """
+            fn main() {
+                x = object();
+                x.count = 0;
+                for(i = 0; i < 5; i = i + 1) {
+                    x.count = x.count + i
+                };
+                x.done = x.count == 10;
+                x.count = x.done;
+                if(x.count) {
+                    return 1
+                };
+                return 0
+            }
+        """
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
+        self.assertEqual(res, Int(1))
+
+    def test_while_loop(self):
+        source = """
+            fn main() {
+                x = 0;
+                n = 10;
+                while(0 < n) {
+                    x = x + n;
+                    n = n - 1
+                };
+                while(n < 0) {
+                    x = 0
+                };
+                return x
+            }
+        """
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
+        self.assertEqual(res, Int(55))
+
+    def test_object_literal(self):
+        source = """
+            fn main() {
+                p = object(x = 3, y = 4, ok = 1 == 1);
+                q = object(a = 1, b = 2, c = 3, d = 4, e = 5, f = 6, g = p.x + p.y);
+                if(p.ok) {
+                    return q.a + q.f + q.g
+                };
+                return 0
+            }
+        """
+        bytecode, functions = self.compile(source)
+        self.assertEqual(bytecode.count(NEW_WITH_SHAPE), 2)
+        res = self.run_prog(bytecode, functions)
+        self.assertEqual(res, Int(14))
+
+    def test_object_literal_nested_in_expressions(self):
+        source = """
+            fn main() {
+                x = 1 + 2 + 3 + 4 + 5 + last(object(a = 1, b = 2, c = 3, d = 4, e = 5, f = 6));
+                return x + sum(1, 2, 3, 4, 5, object(a = 1, b = 2, c = 3, d = 4, e = 5, f = 6))
+            }
+
+            fn last(o) {
+                return o.f
+            }
+
+            fn sum(a, b, c, d, e, o) {
+                return a + b + c + d + e + o.f
+            }
+        """
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
+        self.assertEqual(res, Int(42))
+
+    def test_wide_object_literal(self):
+        source = """
+            fn main() {
+                return 1 + 2 + 3 + 4 + 5 + last(object(a = 1, b = 2, c = 3, d = 4, e = 5, f = 6, g = 7, h = 8, i = 9, j = 10, k = 11, l = 12))
+            }
+
+            fn last(o) {
+                return o.l
+            }
+        """
+        bytecode, functions = self.compile(source)
+        self.assertEqual(bytecode.count(NEW_WITH_SHAPE), 1)
+        self.assertGreater(functions[0].stack_size, 12)
+        res = self.run_prog(bytecode, functions)
+        self.assertEqual(res, Int(27))
+
+    def test_unused_expression_values(self):
+        source = """
+            fn main() {
+                n = 0;
+                for(i = 0; i < 100; i + 1) {
+                    count(n);
+                    n + 1;
+                    n = n + 1;
+                    i = i + 1
+                };
+                return n
+            }
+
+            fn count(n) {
+                return n
+            }
+        """
+        bytecode, functions = self.compile(source)
+        self.assertEqual(functions[0].stack_size, 3)
+        res = self.run_prog(bytecode, functions)
+        self.assertEqual(res, Int(100))
+
+    def test_strings(self):
+        source = """
+            fn main() {
+                s = "";
+                for(i = 0; i < 100; i = i + 1) {
+                    s = s + "ab"
+                };
+                t = "";
+                for(i = 0; i < 50; i = i + 1) {
+                    t = t + "abab"
+                };
+                if(s == t) {
+                    if("ab" < s) {
+                        return "equal: " + "\\"ok\\""
+                    }
+                };
+                return "wrong"
+            }
+        """
+        bytecode, functions = self.compile(source)
+        res = self.run_prog(bytecode, functions)
+        self.assertEqual(res.repr(), 'equal: "ok"')